@@ -1,462 +1,307 @@
 import os
+import io
 import json
-import streamlit as st
+import time
 import requests
-from typing import Dict, Any, Optional
-from dotenv import load_dotenv
-
-# =========================================================
-# 환경 변수 로드
-# =========================================================
-load_dotenv()
+import streamlit as st
+from typing import Dict, Any, Optional, Callable, List, Union
+
+# 분류 기능은 Streamlit에 의존하지 않는 ive_classifier 패키지에 있고, 이 파일은 화면만 담당합니다.
+from ive_classifier.core import (
+    GeminiError,
+    RESULT_SECTIONS,
+    EXTENDED_RESULT_SCHEMA,
+    EXTENDED_CSV_HEADERS,
+    KOREAN_COLUMN_LABELS,
+    KOREAN_SECTIONS,
+    RULE_FAST_PATH,
+    RULE_CONFIDENCE_THRESHOLD,
+    NEAR_DUP_ENABLED,
+    NEAR_DUP_MAX_DISTANCE,
+    classify_ad,
+    classify_ad_stream,
+    run_batch_csv,
+    convert_to_csv_format,
+    get_classification_cache,
+    get_near_duplicate_index,
+    get_api_key_pool,
+    default_api_key,
+    get_metrics,
+    get_korean_ad_type,
+    get_korean_target_age,
+    get_korean_target_gender,
+    get_korean_categories,
+    get_korean_themes,
+    get_korean_motivation_key,
+    get_korean_engagement_key,
+    get_korean_promo_key,
+    get_korean_brand_key,
+    get_korean_commerce_key,
+    translate_column,
+)
+
+GEMINI_STREAMING = os.getenv("GEMINI_STREAMING", "1") != "0"  # streamGenerateContent로 결과를 받는 대로 표시
 
 # =========================================================
-# 분류 프롬프트 (원본과 동일)
+# Streamlit UI
 # =========================================================
-def create_classification_prompt() -> str:
-    return """
-1. 역할 정의
-당신은 광고 텍스트를 분석해 사전 정의된 파라미터 스키마에 따라 JSON으로 분류하는 분류기입니다.
-출력은 반드시 유효한 JSON 한 덩어리로만 반환해야 하며, 설명 문장은 notes 필드에만 기록합니다.
-
-2. 출력 스키마
-{
-  "ad_type": "",
-  "ad_type_category": [],
-  "ad_theme": [],
-  "target_age": "",
-  "target_gender": "",
-  "motivation": {
-    "fun": 0, "social": 0, "rewards": 0, "savings": 0, "trust": 0,
-    "convenience": 0, "growth": 0, "status_display": 0, "curiosity": 0,
-    "habit_building": 0, "safety_net": 0
-  },
-  "engagement": {
-    "casual_score": 0.0, "hardcore_score": 0.0, "frequency_score": 0.0,
-    "multi_app_usage": 0, "retention_potential": 0.0,
-    "session_length_expectation": "short"
-  },
-  "promo": {
-    "install_reward_sensitive": 0, "coupon_event_sensitive": 0,
-    "fomo_sensitive": 0, "exclusive_benefit_sensitive": 0,
-    "trial_experience_sensitive": 0
-  },
-  "brand": {
-    "brand_loyalty": 0.0, "nostalgia": 0, "trust_in_official": 0.0,
-    "award_proof_sensitive": 0, "local_trust_factor": 0.0,
-    "global_trust_factor": 0.0
-  },
-  "commerce": {
-    "price_sensitivity": 0.0, "premium_willingness": 0.0,
-    "transaction_frequency": 0.0, "risk_tolerance": 0.0,
-    "recurring_payment": 0, "big_purchase_intent": 0.0
-  },
-  "notes": []
+# 결과 화면의 지표와 점수 탭 (필드 이름 → 표시 방법)
+RESULT_METRICS = {
+    "target_age": ("타겟 연령", get_korean_target_age),
+    "ad_type": ("광고 유형", get_korean_ad_type),
+    "target_gender": ("타겟 성별", get_korean_target_gender),
+    "ad_type_category": ("카테고리", get_korean_categories),
+    "ad_theme": ("테마", get_korean_themes),
 }
+# 성능 지표 패널의 단계 이름
+METRIC_STAGE_LABELS = {
+    "prompt_build": "프롬프트 생성",
+    "rate_limit_wait": "속도 제한 대기",
+    "http_wait": "Gemini 응답 대기",
+    "stream_read": "스트리밍 수신",
+    "retry_backoff": "재시도 대기",
+    "json_parse": "응답 해석",
+    "flatten": "CSV 변환 (광고당)",
+}
+RESULT_TABS = (
+    ("motivation", "🎯 동기", get_korean_motivation_key),
+    ("engagement", "🎮 참여도", get_korean_engagement_key),
+    ("promo", "🎁 프로모션", get_korean_promo_key),
+    ("brand", "🏢 브랜드", get_korean_brand_key),
+    ("commerce", "💰 상거래", get_korean_commerce_key),
+)
+
+def create_result_placeholders() -> Dict[str, Any]:
+    """분류 결과 화면의 틀을 먼저 그리고, 필드 이름별 자리표시자를 반환합니다."""
+    st.header("📊 분류 결과")
+    placeholders: Dict[str, Any] = {}
+    col1, col2, col3 = st.columns(3)
+    for column, keys in ((col1, ("target_age", "ad_type")),
+                         (col2, ("target_gender", "ad_type_category")),
+                         (col3, ("ad_theme",))):
+        for key in keys:
+            placeholders[key] = column.empty()
+    tabs = st.tabs([label for _, label, _ in RESULT_TABS])
+    for (section, _, _), tab in zip(RESULT_TABS, tabs):
+        placeholders[section] = tab.empty()
+    return placeholders
+
+def show_result_field(placeholder, key: str, value: Any) -> None:
+    """분류 결과 필드 하나를 자리표시자에 그립니다. 스트리밍 중에는 필드가 도착할 때마다 호출됩니다."""
+    if key in RESULT_METRICS:
+        label, to_korean = RESULT_METRICS[key]
+        # 안전하게 문자열로 변환하여 처리
+        placeholder.metric(label, str(to_korean(value)))
+        return
+
+    title, get_korean_key = next((label, fn) for section, label, fn in RESULT_TABS if section == key)
+    with placeholder.container():
+        st.subheader(title)
+        for score_key, score in (value if isinstance(value, dict) else {}).items():
+            korean_key = get_korean_key(score_key)
+            if isinstance(score, (int, float)):
+                # 1.0일 때는 0.95로 표시하여 더 올라갈 수 있음을 시각적으로 표현
+                display_value = 0.95 if score >= 1.0 else score
+                score_text = f"{korean_key}: {score:.3f}"
+                st.progress(display_value, text=score_text)
+            else:
+                st.write(f"**{korean_key}**: {score}")
+
+UI_RESULT_CACHE_ENTRIES = 256  # 화면에서 같은 입력으로 다시 분류할 때 재사용할 결과 수
+
+@st.cache_data(show_spinner=False, max_entries=UI_RESULT_CACHE_ENTRIES)
+def classify_ad_memoized(ad_data: Dict[str, str],
+                         use_cache: bool = True,
+                         use_rules: Optional[bool] = None,
+                         use_near_duplicates: Optional[bool] = None,
+                         _api_key: str = "",
+                         _result: Optional[Dict[str, Any]] = None,
+                         _lookup_only: bool = False) -> Dict[str, Any]:
+    """
+    화면용 분류 함수. ad_data와 옵션이 같으면 Streamlit 캐시에 있는 결과를 반환하여 다시 요청하지 않습니다.
+    _로 시작하는 인자는 캐시 키에 포함되지 않습니다.
+    - _result: 분류하지 않고 이 결과를 캐시에 등록 (스트리밍으로 받은 결과 등록용)
+    - _lookup_only: 캐시에 없으면 분류하지 않고 LookupError 발생
 
-3. 분류 규칙
-(A) 광고 유형 ad_type
-1:설치형 → 1
-2:실행형 → 2
-3:참여형 → 3
-4:클릭형 → 4
-5:페북 → 5
-6:트위터 → 6
-7:인스타 → 7
-8:노출형 → 8
-9:퀘스트 → 9
-10:유튜브 → 10
-11:네이버 → 11
-12:CPS(물건구매) → 12
-
-(B) 광고 카테고리 ad_type_category
-0: 카테고리 선택안함 → 0
-1: 앱(간편적립) → 1
-2: 경험하기(게임적립)/앱(간편적립) - cpi,cpe → 2
-3: 구독(간편적립) → 3
-4: 간편미션-퀴즈(간편적립) → 4
-5: 경험하기(게임적립) - cpa → 5
-6: 멀티보상(게임적립) → 6
-7: 금융(참여적립) → 7
-8: 무료참여(참여적립) → 8
-10: 유료참여(참여적립) → 10
-11: 쇼핑-상품별카테고리(쇼핑적립) → 11
-12: 제휴몰(쇼핑적립) → 12
-13: 간편미션(간편적립) → 13
-`
-(C) 광고 테마 ad_theme
-서사·정서·소구 포인트 태깅, 복수 가능
-예: 판타지 RPG → fantasy, competition, growth
-예: 보험 → trust, safety_net, security_privacy
-예: 리워드 → rewards, savings_benefit, urgency
-
-(D) 연령 target_age
-명시 있으면 그대로 반영 (예: 13~18세 → teens)
-단서 없으면 → all_ages
-보험, 금융 → 기본 thirties 이상 추정 가능
-
-(E) 성별 target_gender
-명시 없으면 기본 neutral
-여성용 뷰티/패션 강조 → female_focus
-남성 전용 서비스(면도, 밀리터리) → male_focus
-
-4. 파라미터 값 판정 기준
-핵심 원칙: 명시적 키워드가 없더라도, 광고 유형(ad_type)과 문맥을 바탕으로 관련성이 높은 항목에 대해서는 0 대신 합리적인 기본 점수(예: 0.2~0.5)를 적극적으로 부여한다.
-
-Motivation
-- rewards: '적립', '보상' 언급 시 1. 'shopping', 'game' 유형 광고는 문맥상 암시만 있어도 0.3 이상 추론.
-- savings: '할인', '최저가' 언급 시 1. 'shopping' 유형 광고는 가격 소구 가능성이 높으므로 기본 0.3 이상 추론.
-- fun: 'game' 광고는 명시적 단어 없어도 기본 0.7 이상 부여. 엔터테인먼트, 'content' 유형도 0.3 이상 추론.
-- trust: 'finance', 'healthcare' 광고는 신뢰가 중요하므로 기본 0.5 이상 부여. '공식', '인증' 등 언급 시 1.
-- growth: 'education', 'game'(특히 RPG) 유형은 성장 요소가 내재되어 있으므로 기본 0.4 이상 추론.
-- curiosity: '무료 체험', '새로운 기능' 등 언급 시 1. 신규 앱/서비스 광고는 호기심 유발 가능성이 높으므로 0.2 이상 추론.
-
-Commerce
-- price_sensitivity: 'shopping' 광고는 대부분 가격에 민감한 사용자를 타겟하므로 기본 0.6 이상 부여. '최저가', '할인' 강조 시 0.9 이상.
-- risk_tolerance: 'finance' 중 투자, 가상화폐 관련 광고는 리스크 감수 성향이 중요하므로 0.8 이상 부여. '보험'은 리스크 회피이므로 이 항목은 0.1 이하로 유지.
-- big_purchase_intent: 'finance'(대출, 보험), 'real_estate' 등 고가 상품/서비스는 0.7 이상 부여.
-
-Brand
-- brand_loyalty, trust_in_official: '아모레퍼시픽', '삼성' 등 대중에게 알려진 기업/브랜드 이름이 언급되면, '유명 브랜드'라는 직접적 표현이 없어도 0.5 이상 부여. 'finance' 유형은 기본 0.3 이상 추론.
-- local_trust_factor: 광고 주체가 국내 기업으로 명확히 인지되면 1 부여.
-
-5. 출력 규칙
-항상 JSON만 출력 (추가 설명 금지).
-notes 필드에 분류 근거 키워드를 짧게 기록.
-가장 중요한 것은 문맥을 파악하여 0으로 비워두기보다, 관련성이 조금이라도 있다면 적극적으로 값을 추론해 채우는 것이다.
-
-6. 사용자 지정 정보 활용
-- "사용자 지정 광고 유형"이 제공된 경우, 해당 값을 ad_type으로 사용하되 문맥상 부적절하면 재분류
-- "사용자 지정 광고 카테고리"가 제공된 경우, 해당 값을 ad_type_category에 포함
-- 사용자 지정 정보가 없으면 광고 텍스트를 바탕으로 자동 분류
-
-다음 광고 텍스트를 분석하여 위 스키마에 맞는 JSON을 반환하세요:
-""".strip()
-
-# =========================================================
-# Gemini API 호출 함수 (원본과 동일)
-# =========================================================
-def call_gemini_json(prompt_text: str,
-                     api_key: str,
-                     model: str = "gemini-2.5-flash-lite",
-                     timeout: int = 30) -> Optional[Dict[str, Any]]:
+    분류 실패(GeminiError 등)는 예외로 전달되며, st.cache_data는 예외를 캐시하지 않으므로 다음 시도에서 다시 요청합니다.
+    캐시된 함수 안에서 그린 요소는 캐시 적중 때 다시 재생되므로, 이 함수는 화면에 아무것도 그리지 않습니다.
     """
-    Gemini에 프롬프트를 전달하고, JSON 응답을 안전하게 추출합니다.
-    JSON 코드펜스가 있을 경우 제거합니다.
+    if _lookup_only:
+        raise LookupError("캐시에 없는 광고입니다.")
+    if _result is not None:
+        return _result
+    return classify_ad(ad_data, _api_key, use_cache=use_cache, use_rules=use_rules,
+                       use_near_duplicates=use_near_duplicates)
+
+def classify_ad_streaming_memoized(ad_data: Dict[str, str],
+                                   api_key: str,
+                                   use_cache: bool = True,
+                                   use_rules: Optional[bool] = None,
+                                   use_near_duplicates: Optional[bool] = None,
+                                   on_partial: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
     """
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent"
-    headers = {"Content-Type": "application/json"}
-    body = {
-        "contents": [
-            {"role": "user", "parts": [{"text": prompt_text}]}
-        ],
-        "generationConfig": {
-            "temperature": 0.1,
-            "maxOutputTokens": 2000
-        }
-    }
-
-    resp = requests.post(f"{url}?key={api_key}", headers=headers, json=body, timeout=timeout)
-    if resp.status_code != 200:
-        st.error(f"Gemini API 오류: status={resp.status_code}")
-        return None
-
-    data = resp.json()
-    cands = data.get("candidates", [])
-    if not cands:
-        st.error("Gemini 응답에 candidates가 없습니다.")
-        return None
-
-    parts = cands[0].get("content", {}).get("parts", [])
-    if not parts:
-        st.error("Gemini 응답에 parts가 없습니다.")
-        return None
-
-    text = parts[0].get("text", "")
-    if not text:
-        st.error("Gemini 응답에 text가 없습니다.")
-        return None
-
-    raw = text.strip()
-    cleaned = raw.replace("```json", "").replace("```", "").strip()
-
-    # 최종 JSON 파싱
+    classify_ad_memoized의 스트리밍 버전. 캐시에 있으면 바로 반환하고,
+    없으면 캐시 밖에서 부분 결과를 on_partial로 넘기며 받은 뒤 완성된 결과를 캐시에 등록합니다.
+    """
+    options = (use_cache, use_rules, use_near_duplicates)
     try:
-        return json.loads(cleaned)
-    except json.JSONDecodeError:
-        # 간단 복구: 앞/뒤 설명 제거 가능성이 있으므로 중괄호 범위만 추출 시도
-        try:
-            first = cleaned.find("{")
-            last = cleaned.rfind("}")
-            if first != -1 and last != -1 and last > first:
-                sliced = cleaned[first:last+1]
-                return json.loads(sliced)
-        except Exception:
-            pass
-        st.error(f"JSON 파싱 실패. 원문 일부: {cleaned[:500]}")
-        return None
+        return classify_ad_memoized(ad_data, *options, _lookup_only=True)
+    except LookupError:
+        pass
+
+    result = None
+    for partial in classify_ad_stream(ad_data, api_key, use_cache=use_cache, use_rules=use_rules,
+                                      use_near_duplicates=use_near_duplicates):
+        if on_partial is not None:
+            on_partial(partial)
+        result = partial
+    return classify_ad_memoized(ad_data, *options, _result=result)
+
+def show_result(placeholders: Dict[str, Any], result: Dict[str, Any]) -> None:
+    """완성된 결과로 모든 자리표시자를 채웁니다. 없는 필드는 기본값으로 표시합니다."""
+    for key, placeholder in placeholders.items():
+        default: Any = {} if key in RESULT_SECTIONS else [] if key in ("ad_type_category", "ad_theme") else "N/A"
+        show_result_field(placeholder, key, result.get(key, default))
+
+# 배치 결과 표: 필터를 둘 열(결과 파일에 있는 열만 사용), 열 묶음(섹션), 페이지 크기
+BATCH_TABLE_FILTERS = ("ad_type", "target_age", "target_gender", "classification_source")
+BATCH_TABLE_SEARCH = ("original_ads_name", "ads_idx", "ads_code")
+BATCH_TABLE_BASIC = "기본 정보"
+BATCH_TABLE_PAGE_SIZES = (50, 100, 250, 500, 1000)
+_SCORE_COLUMNS = [header for header, (_, _, kind) in zip(EXTENDED_CSV_HEADERS, EXTENDED_RESULT_SCHEMA) if kind == "score"]
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def load_batch_table(data: Union[str, bytes], result_format: str):
+    """
+    배치 결과 파일(json_total 형식)을 한국어 열 이름과 값의 DataFrame으로 읽습니다.
+    값은 미리 만든 번역 표로 열 단위로 바꾸며(translate_column), 같은 결과이면 다시 만들지 않습니다.
+    """
+    import pandas as pd
 
-# =========================================================
-# 한국어 변환 함수들
-# =========================================================
-def get_korean_ad_type(ad_type):
-    """광고 유형을 한국어로 변환"""
-    ad_type_map = {
-        "1": "설치형", "2": "실행형", "3": "참여형", "4": "클릭형", 
-        "5": "페북", "6": "트위터", "7": "인스타", "8": "노출형", 
-        "9": "퀘스트", "10": "유튜브", "11": "네이버", "12": "CPS(물건구매)",
-        "game": "게임", "app": "앱", "shopping": "쇼핑", "finance": "금융",
-        "service": "서비스", "content": "콘텐츠", "healthcare": "헬스케어",
-        "education": "교육", "rewards_only": "리워드 전용", "other": "기타"
-    }
-    # 숫자나 다른 타입도 문자열로 변환하여 처리
-    ad_type_str = str(ad_type)
-    return ad_type_map.get(ad_type_str, ad_type_str)
-
-def get_korean_target_age(target_age):
-    """타겟 연령을 한국어로 변환"""
-    age_map = {
-        "all_ages": "전연령", "teens": "10대", "twenties": "20대", "thirties": "30대", 
-        "forties": "40대", "fifties": "50대", "adults": "성인"
-    }
-    return age_map.get(target_age, target_age)
-
-def get_korean_target_gender(target_gender):
-    """타겟 성별을 한국어로 변환"""
-    gender_map = {
-        "male_focus": "남성 중심", "female_focus": "여성 중심", 
-        "male": "남성", "female": "여성", "neutral": "전성별"
-    }
-    return gender_map.get(target_gender, target_gender)
-
-def get_korean_categories(categories):
-    """카테고리를 한국어로 변환"""
-    category_map = {
-        "0": "카테고리 선택안함", "1": "앱(간편적립)", 
-        "2": "경험하기(게임적립)/앱(간편적립)", "3": "구독(간편적립)",
-        "4": "간편미션-퀴즈(간편적립)", "5": "경험하기(게임적립)",
-        "6": "멀티보상(게임적립)", "7": "금융(참여적립)",
-        "8": "무료참여(참여적립)", "10": "유료참여(참여적립)",
-        "11": "쇼핑-상품별카테고리(쇼핑적립)", "12": "제휴몰(쇼핑적립)",
-        "13": "간편미션(간편적립)"
-    }
-    
-    if isinstance(categories, list):
-        korean_categories = [category_map.get(str(cat), str(cat)) for cat in categories]
-        return ", ".join(korean_categories) if korean_categories else "N/A"
+    if result_format == "csv":
+        text_columns = {header: str for header in EXTENDED_CSV_HEADERS if header not in _SCORE_COLUMNS}
+        table = pd.read_csv(io.StringIO(data), dtype=text_columns, keep_default_na=False)
     else:
-        return category_map.get(str(categories), str(categories)) if categories else "N/A"
-
-def get_korean_themes(themes):
-    """테마를 한국어로 변환"""
-    theme_map = {
-        "fantasy": "판타지", "competition": "경쟁", "growth": "성장",
-        "trust": "신뢰", "safety_net": "안전성", "security_privacy": "보안/개인정보",
-        "rewards": "리워드", "savings_benefit": "절약 혜택", "urgency": "긴급성",
-        "fun": "재미", "social": "소셜", "convenience": "편의성",
-        "curiosity": "호기심", "habit_building": "습관형성", "status_display": "지위표시"
-    }
-    
-    if isinstance(themes, list):
-        korean_themes = [theme_map.get(str(theme), str(theme)) for theme in themes]
-        return ", ".join(korean_themes) if korean_themes else "N/A"
-    else:
-        return theme_map.get(str(themes), str(themes)) if themes else "N/A"
-
-def get_korean_motivation_key(key):
-    """동기 키를 한국어로 변환"""
-    motivation_map = {
-        "fun": "재미", "social": "소셜", "rewards": "리워드", "savings": "절약",
-        "trust": "신뢰", "convenience": "편의성", "growth": "성장", 
-        "status_display": "지위표시", "curiosity": "호기심", 
-        "habit_building": "습관형성", "safety_net": "안전성"
-    }
-    return motivation_map.get(key, key)
-
-def get_korean_engagement_key(key):
-    """참여도 키를 한국어로 변환"""
-    engagement_map = {
-        "casual_score": "캐주얼", "hardcore_score": "하드코어", 
-        "frequency_score": "사용빈도", "multi_app_usage": "멀티앱",
-        "retention_potential": "유지력", "session_length_expectation": "세션길이"
-    }
-    return engagement_map.get(key, key)
-
-def get_korean_promo_key(key):
-    """프로모션 키를 한국어로 변환"""
-    promo_map = {
-        "install_reward_sensitive": "설치리워드", "coupon_event_sensitive": "쿠폰이벤트",
-        "fomo_sensitive": "FOMO", "exclusive_benefit_sensitive": "독점혜택",
-        "trial_experience_sensitive": "체험경험"
-    }
-    return promo_map.get(key, key)
-
-def get_korean_brand_key(key):
-    """브랜드 키를 한국어로 변환"""
-    brand_map = {
-        "brand_loyalty": "브랜드충성도", "nostalgia": "향수", 
-        "trust_in_official": "공식신뢰", "award_proof_sensitive": "수상증명",
-        "local_trust_factor": "국내신뢰", "global_trust_factor": "글로벌신뢰"
-    }
-    return brand_map.get(key, key)
-
-def get_korean_commerce_key(key):
-    """상거래 키를 한국어로 변환"""
-    commerce_map = {
-        "price_sensitivity": "가격민감도", "premium_willingness": "프리미엄지불의향",
-        "transaction_frequency": "거래빈도", "risk_tolerance": "위험감수성",
-        "recurring_payment": "정기결제", "big_purchase_intent": "고액구매의도"
-    }
-    return commerce_map.get(key, key)
-
-# =========================================================
-# CSV 변환 함수
-# =========================================================
-def convert_to_csv_format(result: Dict[str, Any]) -> str:
-    """JSON 결과를 CSV 형태로 변환합니다."""
-    import io
-    import csv
-    
-    # CSV 헤더 정의 (json_total.csv 구조와 동일)
-    headers = [
-        'ad_type', 'ad_type_category', 'ad_theme', 'target_age', 'target_gender', 'notes',
-        'ads_idx', 'ads_code', 'original_ads_name',
-        'motivation_fun', 'motivation_social', 'motivation_rewards', 'motivation_savings',
-        'motivation_trust', 'motivation_convenience', 'motivation_growth', 'motivation_status_display',
-        'motivation_curiosity', 'motivation_habit_building', 'motivation_safety_net',
-        'engagement_casual_score', 'engagement_hardcore_score', 'engagement_frequency_score',
-        'engagement_multi_app_usage', 'engagement_retention_potential', 'engagement_session_length_expectation',
-        'promo_install_reward_sensitive', 'promo_coupon_event_sensitive', 'promo_fomo_sensitive',
-        'promo_exclusive_benefit_sensitive', 'promo_trial_experience_sensitive',
-        'brand_brand_loyalty', 'brand_nostalgia', 'brand_trust_in_official', 'brand_award_proof_sensitive',
-        'brand_local_trust_factor', 'brand_global_trust_factor',
-        'commerce_price_sensitivity', 'commerce_premium_willingness', 'commerce_transaction_frequency',
-        'commerce_risk_tolerance', 'commerce_recurring_payment', 'commerce_big_purchase_intent'
-    ]
-    
-    # 데이터 추출
-    row_data = []
-    
-    # 기본 정보
-    def safe_join(data, default=''):
-        if isinstance(data, list):
-            return ','.join(str(item) for item in data) if data else default
-        else:
-            return str(data) if data else default
-    
-    row_data.extend([
-        result.get('ad_type', ''),
-        safe_join(result.get('ad_type_category', [])),
-        safe_join(result.get('ad_theme', [])),
-        result.get('target_age', ''),
-        result.get('target_gender', ''),
-        safe_join(result.get('notes', [])),
-        result.get('ads_idx', ''),
-        result.get('ads_code', ''),
-        result.get('ads_name', '')
-    ])
-    
-    # Motivation
-    motivation = result.get('motivation', {})
-    row_data.extend([
-        motivation.get('fun', 0),
-        motivation.get('social', 0),
-        motivation.get('rewards', 0),
-        motivation.get('savings', 0),
-        motivation.get('trust', 0),
-        motivation.get('convenience', 0),
-        motivation.get('growth', 0),
-        motivation.get('status_display', 0),
-        motivation.get('curiosity', 0),
-        motivation.get('habit_building', 0),
-        motivation.get('safety_net', 0)
-    ])
-    
-    # Engagement
-    engagement = result.get('engagement', {})
-    row_data.extend([
-        engagement.get('casual_score', 0),
-        engagement.get('hardcore_score', 0),
-        engagement.get('frequency_score', 0),
-        engagement.get('multi_app_usage', 0),
-        engagement.get('retention_potential', 0),
-        engagement.get('session_length_expectation', '')
-    ])
-    
-    # Promo
-    promo = result.get('promo', {})
-    row_data.extend([
-        promo.get('install_reward_sensitive', 0),
-        promo.get('coupon_event_sensitive', 0),
-        promo.get('fomo_sensitive', 0),
-        promo.get('exclusive_benefit_sensitive', 0),
-        promo.get('trial_experience_sensitive', 0)
-    ])
-    
-    # Brand
-    brand = result.get('brand', {})
-    row_data.extend([
-        brand.get('brand_loyalty', 0),
-        brand.get('nostalgia', 0),
-        brand.get('trust_in_official', 0),
-        brand.get('award_proof_sensitive', 0),
-        brand.get('local_trust_factor', 0),
-        brand.get('global_trust_factor', 0)
-    ])
-    
-    # Commerce
-    commerce = result.get('commerce', {})
-    row_data.extend([
-        commerce.get('price_sensitivity', 0),
-        commerce.get('premium_willingness', 0),
-        commerce.get('transaction_frequency', 0),
-        commerce.get('risk_tolerance', 0),
-        commerce.get('recurring_payment', 0),
-        commerce.get('big_purchase_intent', 0)
-    ])
-    
-    # CSV 생성
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(headers)
-    writer.writerow(row_data)
-    
-    return output.getvalue()
-
-# =========================================================
-# 광고 분류 함수
-# =========================================================
-def classify_ad(ad_data: Dict[str, str], api_key: str) -> Optional[Dict[str, Any]]:
-    """광고 데이터를 분류합니다."""
-    ad_text = f"""
-광고명: {ad_data.get('ads_name', '')}
-요약: {ad_data.get('ads_summary', '')}
-가이드: {ad_data.get('ads_guide', '')}
-제한사항: {ad_data.get('ads_limit', '')}
-리워드 가격: {ad_data.get('ads_reward_price', '')}
-연령 범위: {ad_data.get('ads_age_min', '')}~{ad_data.get('ads_age_max', '')}
-시작일: {ad_data.get('ads_sdate', '')}
-종료일: {ad_data.get('ads_edate', '')}
-사용자 지정 광고 유형: {ad_data.get('ad_type', '')}
-사용자 지정 광고 카테고리: {ad_data.get('ad_type_category', '')}
-""".strip()
-
-    prompt = create_classification_prompt() + "\n\n" + "광고 텍스트:\n" + ad_text
-    result = call_gemini_json(prompt, api_key=api_key)
-    
-    if result is None:
-        return None
-
-    # 원본 데이터 추가 (JSON 형식에 맞춤)
-    result["ads_idx"] = ad_data.get("ads_idx", "")
-    result["ads_code"] = ad_data.get("ads_code", "")
-    result["original_ads_name"] = ad_data.get("ads_name", "")
-    
-    return result
+        table = pd.read_parquet(io.BytesIO(data))
+    for header in table.columns:
+        if header not in _SCORE_COLUMNS:
+            table[header] = translate_column(header, table[header])
+    return table.rename(columns=KOREAN_COLUMN_LABELS)
+
+def _batch_table_groups(labels) -> Dict[str, List[str]]:
+    # 열 묶음 이름 -> 표에 있는 한국어 열 이름 목록 (기본 정보 + 섹션별 점수)
+    groups: Dict[str, List[str]] = {BATCH_TABLE_BASIC: []}
+    for header, (section, _, _) in zip(EXTENDED_CSV_HEADERS, EXTENDED_RESULT_SCHEMA):
+        if KOREAN_COLUMN_LABELS[header] in labels:
+            groups.setdefault(KOREAN_SECTIONS[section] if section else BATCH_TABLE_BASIC, []).append(
+                KOREAN_COLUMN_LABELS[header])
+    return groups
+
+def show_batch_table(batch_result: Dict[str, Any]) -> None:
+    """
+    배치 결과를 번역된 표 하나로 보여 줍니다. 필터/검색/정렬은 DataFrame 연산으로 처리하고
+    현재 페이지만 st.dataframe으로 그리므로(점수는 진행 막대 열), 수천 건도 위젯을 결과마다 만들지 않습니다.
+    """
+    table = load_batch_table(batch_result["data"], batch_result["format"])
+    st.subheader(f"📋 배치 결과 ({len(table):,}건)")
+    if table.empty:
+        return
+
+    filters = [header for header in BATCH_TABLE_FILTERS if KOREAN_COLUMN_LABELS[header] in table.columns]
+    filter_columns = st.columns(len(filters) + 1)
+    mask = None
+    for column, header in zip(filter_columns, filters):
+        label = KOREAN_COLUMN_LABELS[header]
+        selected = column.multiselect(label, sorted(table[label].unique()), key=f"batch_table_filter_{header}",
+                                      placeholder="전체")
+        if selected:
+            matched = table[label].isin(selected)
+            mask = matched if mask is None else mask & matched
+    query = filter_columns[-1].text_input("검색", key="batch_table_search", placeholder="광고명 / 번호 / 코드").strip()
+    if query:
+        matched = False
+        for header in BATCH_TABLE_SEARCH:
+            matched = matched | table[KOREAN_COLUMN_LABELS[header]].str.contains(query, case=False, regex=False)
+        mask = matched if mask is None else mask & matched
+    view = table if mask is None else table[mask]
+
+    groups = _batch_table_groups(set(table.columns))
+    col1, col2, col3 = st.columns([3, 2, 1])
+    shown_groups = col1.multiselect("표시할 열", list(groups), default=[BATCH_TABLE_BASIC, KOREAN_SECTIONS["motivation"]],
+                                    key="batch_table_groups")
+    shown = [label for group in shown_groups for label in groups[group]] or groups[BATCH_TABLE_BASIC]
+    sort_by = col2.selectbox("정렬 기준", ["입력 순서"] + shown, key="batch_table_sort")
+    descending = col3.toggle("내림차순", value=sort_by in {KOREAN_COLUMN_LABELS[h] for h in _SCORE_COLUMNS},
+                             key="batch_table_descending")
+    if sort_by != "입력 순서":
+        view = view.sort_values(sort_by, ascending=not descending, kind="stable")
+    elif descending:
+        view = view.iloc[::-1]
+
+    col4, col5 = st.columns([1, 3])
+    page_size = col4.selectbox("페이지당 행 수", BATCH_TABLE_PAGE_SIZES, index=1, key="batch_table_page_size")
+    pages = max((len(view) + page_size - 1) // page_size, 1)
+    if st.session_state.get("batch_table_page", 1) > pages:
+        st.session_state["batch_table_page"] = 1  # 필터로 행이 줄면 첫 페이지로
+    page = col5.number_input(f"페이지 (전체 {pages:,})", min_value=1, max_value=pages, step=1, key="batch_table_page")
+    start = (int(page) - 1) * page_size
+
+    score_labels = {KOREAN_COLUMN_LABELS[header] for header in _SCORE_COLUMNS}
+    st.dataframe(
+        view.iloc[start:start + page_size][shown],
+        hide_index=True,
+        column_config={label: st.column_config.ProgressColumn(label, min_value=0.0, max_value=1.0, format="%.2f")
+                       for label in shown if label in score_labels},
+    )
+    st.caption(f"조건에 맞는 {len(view):,}건 중 {min(start + 1, len(view)):,}–{min(start + page_size, len(view)):,}건 "
+               f"(전체 {len(table):,}건)")
+
+def show_metrics_panel() -> None:
+    """이 프로세스에서 분류한 광고의 단계별 시간, 토큰 사용량, 예상 비용, 느린 광고를 표시합니다."""
+    summary = get_metrics().summary()
+    st.header("📈 성능 지표")
+    ads = summary["ads"]
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("분류한 광고", sum(ads.values()), help=", ".join(f"{k} {v}" for k, v in sorted(ads.items())) or None)
+    col2.metric("광고당 예상 비용 (Gemini)", f"${summary['cost_per_model_ad_usd']:.6f}",
+                help=f"누적 ${summary['cost_usd']:.4f} / 광고당 {summary['tokens_per_model_ad']:.0f} 토큰")
+    col3.metric("응답 대체 해석 비율", f"{summary['parse_fallback_rate']:.1%}",
+                help=f"해석 실패 {summary['parse_failure_rate']:.1%}")
+    col4.metric("광고 한 건 p95", f"{summary['ad_latency']['p95_ms']:.0f} ms")
+
+    st.dataframe(
+        [{"단계": METRIC_STAGE_LABELS.get(stage, stage), "횟수": stats["count"], "평균 ms": stats["mean_ms"],
+          "p50 ms": stats["p50_ms"], "p95 ms": stats["p95_ms"], "최대 ms": stats["max_ms"]}
+         for stage, stats in summary["stages"].items() if stats["count"]],
+        hide_index=True
+    )
+    tokens = summary["tokens"]
+    st.caption(f"토큰: 입력 {tokens['prompt']:,} / 출력 {tokens['candidates']:,} / thinking {tokens['thoughts']:,} "
+               f"/ 캐시 {tokens['cached']:,} (Gemini 응답 {summary['gemini_responses']}건)")
+    if summary["tiers"]:
+        # 모델 cascade: 검증을 통과하지 못해 다음 모델로 넘긴 호출 수와 모델별 지연/비용
+        st.dataframe(
+            [{"모델": model, "통과": tier["accepted"], "상위 모델로": tier["escalated"],
+              "검증 실패(사용)": tier["invalid"], "해석 실패": tier["failed"],
+              "p50 ms": tier["latency"]["p50_ms"], "p95 ms": tier["latency"]["p95_ms"],
+              "예상 비용 $": tier["cost_usd"]}
+             for model, tier in summary["tiers"].items()],
+            hide_index=True
+        )
+    if summary["slowest"]:
+        with st.expander("🐢 가장 느린 광고"):
+            st.dataframe(
+                [{"ads_idx": r["ads_idx"], "출처": r["source"], "전체 ms": r["total_ms"],
+                  **{METRIC_STAGE_LABELS.get(k, k): v for k, v in r["stages_ms"].items()},
+                  "토큰": r["tokens"].get("total", 0), "모델": r.get("model") or "",
+                  "오류": r["error"] or ""}
+                 for r in summary["slowest"]],
+                hide_index=True
+            )
+    if st.button("지표 초기화"):
+        get_metrics().reset()
+        st.rerun()
 
-# =========================================================
-# Streamlit UI
-# =========================================================
 def main():
     st.set_page_config(
         page_title="IVE 광고 분류기",
@@ -611,7 +456,8 @@ def main():
         """)
     
     # API 키는 환경변수에서 자동으로 가져옴
-    api_key = os.getenv("GEMINI_API_KEY", "")
+    # (GEMINI_API_KEYS에 쉼표로 구분한 여러 키를 주면 키별 할당량을 나눠 사용)
+    api_key = default_api_key()
     
     if not api_key:
         st.error("⚠️ GEMINI_API_KEY 환경변수가 설정되지 않았습니다.")
@@ -625,6 +471,55 @@ export GEMINI_API_KEY="your_api_key_here"
         """)
         st.stop()
     
+    # 분류 캐시 현황
+    with st.sidebar:
+        st.header("🗄️ 분류 캐시")
+        use_cache = st.checkbox("캐시된 결과 사용", value=True,
+                                help="같은 광고 텍스트의 이전 분류 결과를 재사용하여 API 호출을 생략합니다.")
+        cache = get_classification_cache()
+        cache_stats = cache.stats()
+        st.metric("저장된 결과", cache_stats["entries"])
+        st.caption(f"적중 {cache_stats['hits']}회 / 미스 {cache_stats['misses']}회 (적중률 {cache_stats['hit_rate']:.0%})")
+        if st.button("캐시 비우기"):
+            cache.clear()
+            classify_ad_memoized.clear()
+            st.rerun()
+
+        use_near_duplicates = st.checkbox("유사 광고 결과 재사용", value=NEAR_DUP_ENABLED,
+                                          help=f"텍스트의 자카드 거리가 {NEAR_DUP_MAX_DISTANCE:.2f} 이내인 광고(날짜·가격·문장 일부만 다른 광고)는 "
+                                               "이전 Gemini 결과를 재사용합니다.")
+        near_dup_stats = get_near_duplicate_index().stats()
+        st.caption(f"유사 광고 색인 {near_dup_stats['entries']}건 / 재사용 {near_dup_stats['hits']}회 "
+                   f"(재사용률 {near_dup_stats['hit_rate']:.0%})")
+        if st.button("유사 광고 색인 비우기"):
+            get_near_duplicate_index().clear()
+            st.rerun()
+
+        st.header("⚡ 규칙 기반 빠른 분류")
+        use_rules = st.checkbox("명확한 광고는 Gemini 없이 분류", value=RULE_FAST_PATH,
+                                help=f"키워드 규칙의 신뢰도가 {RULE_CONFIDENCE_THRESHOLD:.2f} 이상인 광고는 "
+                                     "API를 호출하지 않고 규칙 기반 결과를 사용합니다.")
+
+        st.header("📡 응답 표시")
+        use_streaming = st.checkbox("결과를 받는 대로 표시 (스트리밍)", value=GEMINI_STREAMING,
+                                    help="streamGenerateContent로 응답을 받아 타겟 연령, 광고 유형, 점수 탭을 도착하는 순서대로 채웁니다.")
+
+        st.header("⏱️ API 호출 현황")
+        limiter_stats = get_api_key_pool(api_key).stats()
+        st.caption(f"요청 {limiter_stats['requests']}회 / 재시도 {limiter_stats['retries']}회 "
+                   f"(할당량 초과 {limiter_stats['throttle_events']}회, 서버 오류 {limiter_stats['server_errors']}회)")
+        if len(limiter_stats["keys"]) > 1:
+            # 키별 사용량: 요청은 진행 중인 요청이 가장 적은 키로 보내고, 429/403을 받은 키는 잠시 쉬게 함
+            st.dataframe(
+                [{"키": key["key"], "요청": key["requests"], "진행 중": key["in_flight"], "성공": key["ok"],
+                  "429": key["throttled"], "403": key["forbidden"],
+                  "상태": f"쉬는 중 {key['cooldown_seconds']:.0f}초" if key["cooldown_seconds"] > 0 else "사용 가능"}
+                 for key in limiter_stats["keys"]],
+                hide_index=True
+            )
+        show_metrics = st.checkbox("📈 성능 지표 보기", value=False,
+                                   help="단계별 소요 시간, 토큰 사용량과 예상 비용, 응답 대체 해석 비율, 느린 광고를 표시합니다.")
+    
     # 광고 정보 입력 폼
     st.header("📝 광고 정보 입력")
     
@@ -680,168 +575,178 @@ export GEMINI_API_KEY="your_api_key_here"
         ad_type_category = category_mapping[selected_category_label]
     
     # 분류 실행 버튼
-    if st.button("🚀 광고 분류하기", type="primary"):
-        if not ads_name.strip():
-            st.error("광고명을 입력해주세요.")
-        else:
-            # 광고 데이터 구성
-            ad_data = {
-                "ads_idx": ads_idx,
-                "ads_code": ads_code,
-                "ads_name": ads_name,
-                "ads_summary": ads_summary,
-                "ads_guide": ads_guide,
-                "ads_limit": ads_limit,
-                "ads_reward_price": ads_reward_price,
-                "ads_age_min": str(ads_age_min),
-                "ads_age_max": str(ads_age_max),
-                "ads_sdate": str(ads_sdate),
-                "ads_edate": str(ads_edate),
-                "ad_type": selected_ad_type,
-                "ad_type_category": ad_type_category
-            }
-            
-            # 진행 표시
-            with st.spinner("광고를 분류하고 있습니다..."):
-                result = classify_ad(ad_data, api_key)
-            
-            if result:
-                st.success("✅ 분류가 완료되었습니다!")
-                
-                # 결과 표시
-                st.header("📊 분류 결과")
-                
-                # 기본 정보
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    # 타겟 연령을 한국어로 표시
-                    target_age = result.get("target_age", "N/A")
-                    target_age_korean = get_korean_target_age(target_age)
-                    st.metric("타겟 연령", target_age_korean)
-                    
-                    # 광고 유형을 한국어로 표시
-                    ad_type = result.get("ad_type", "N/A")
-                    ad_type_korean = get_korean_ad_type(ad_type)
-                    # 안전하게 문자열로 변환하여 처리
-                    ad_type_korean = str(ad_type_korean)
-                    st.metric("광고 유형", ad_type_korean)
-                    
-                with col2:
-                    # 타겟 성별을 한국어로 표시
-                    target_gender = result.get("target_gender", "N/A")
-                    target_gender_korean = get_korean_target_gender(target_gender)
-                    st.metric("타겟 성별", target_gender_korean)
-                    
-                    # 카테고리를 한국어로 표시
-                    categories = result.get("ad_type_category", [])
-                    categories_korean = get_korean_categories(categories)
-                    st.metric("카테고리", categories_korean)
-                    
-                with col3:
-                    # 테마를 한국어로 표시
-                    themes = result.get("ad_theme", [])
-                    themes_korean = get_korean_themes(themes)
-                    st.metric("테마", themes_korean)
-                
-                # 상세 결과를 탭으로 표시
-                tab1, tab2, tab3, tab4, tab5 = st.tabs(["🎯 동기", "🎮 참여도", "🎁 프로모션", "🏢 브랜드", "💰 상거래"])
-                
-                with tab1:
-                    st.subheader("🎯 동기")
-                    motivation = result.get("motivation", {})
-                    for key, value in motivation.items():
-                        korean_key = get_korean_motivation_key(key)
-                        if isinstance(value, (int, float)):
-                            # 1.0일 때는 0.95로 표시하여 더 올라갈 수 있음을 시각적으로 표현
-                            display_value = 0.95 if value >= 1.0 else value
-                            score_text = f"{korean_key}: {value:.3f}"
-                            st.progress(display_value, text=score_text)
-                        else:
-                            st.write(f"**{korean_key}**: {value}")
-                
-                with tab2:
-                    st.subheader("🎮 참여도")
-                    engagement = result.get("engagement", {})
-                    for key, value in engagement.items():
-                        korean_key = get_korean_engagement_key(key)
-                        if isinstance(value, (int, float)):
-                            # 1.0일 때는 0.95로 표시하여 더 올라갈 수 있음을 시각적으로 표현
-                            display_value = 0.95 if value >= 1.0 else value
-                            score_text = f"{korean_key}: {value:.3f}"
-                            st.progress(display_value, text=score_text)
-                        else:
-                            st.write(f"**{korean_key}**: {value}")
-                
-                with tab3:
-                    st.subheader("🎁 프로모션")
-                    promo = result.get("promo", {})
-                    for key, value in promo.items():
-                        korean_key = get_korean_promo_key(key)
-                        if isinstance(value, (int, float)):
-                            # 1.0일 때는 0.95로 표시하여 더 올라갈 수 있음을 시각적으로 표현
-                            display_value = 0.95 if value >= 1.0 else value
-                            score_text = f"{korean_key}: {value:.3f}"
-                            st.progress(display_value, text=score_text)
-                        else:
-                            st.write(f"**{korean_key}**: {value}")
-                
-                with tab4:
-                    st.subheader("🏢 브랜드")
-                    brand = result.get("brand", {})
-                    for key, value in brand.items():
-                        korean_key = get_korean_brand_key(key)
-                        if isinstance(value, (int, float)):
-                            # 1.0일 때는 0.95로 표시하여 더 올라갈 수 있음을 시각적으로 표현
-                            display_value = 0.95 if value >= 1.0 else value
-                            score_text = f"{korean_key}: {value:.3f}"
-                            st.progress(display_value, text=score_text)
-                        else:
-                            st.write(f"**{korean_key}**: {value}")
-                
-                with tab5:
-                    st.subheader("💰 상거래")
-                    commerce = result.get("commerce", {})
-                    for key, value in commerce.items():
-                        korean_key = get_korean_commerce_key(key)
-                        if isinstance(value, (int, float)):
-                            # 1.0일 때는 0.95로 표시하여 더 올라갈 수 있음을 시각적으로 표현
-                            display_value = 0.95 if value >= 1.0 else value
-                            score_text = f"{korean_key}: {value:.3f}"
-                            st.progress(display_value, text=score_text)
-                        else:
-                            st.write(f"**{korean_key}**: {value}")
-                
-                # JSON 결과 다운로드
-                st.header("💾 결과 다운로드")
-                
-                # CSV 형태로도 다운로드 가능하도록 데이터 변환
-                csv_data = convert_to_csv_format(result)
-                
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    json_str = json.dumps(result, ensure_ascii=False, indent=2)
-                    st.download_button(
-                        label="📄 JSON 파일 다운로드",
-                        data=json_str,
-                        file_name=f"ad_classification_{ads_name.replace(' ', '_')}.json",
-                        mime="application/json"
-                    )
-                
-                with col2:
-                    st.download_button(
-                        label="📊 CSV 파일 다운로드",
-                        data=csv_data,
-                        file_name=f"ad_classification_{ads_name.replace(' ', '_')}.csv",
-                        mime="text/csv"
-                    )
-                
-                # 원본 JSON 표시
-                with st.expander("🔍 원본 JSON 결과 보기"):
-                    st.json(result)
-                
+    # 결과는 session_state에 보관: 다운로드 버튼 등 상호작용으로 스크립트가 다시 실행되어도 유지되고 API를 다시 호출하지 않음
+    classify_clicked = st.button("🚀 광고 분류하기", type="primary")
+    status = st.empty()
+    result_area = st.empty()
+    if classify_clicked and not ads_name.strip():
+        status.error("광고명을 입력해주세요.")
+    elif classify_clicked:
+        # 광고 데이터 구성
+        ad_data = {
+            "ads_idx": ads_idx,
+            "ads_code": ads_code,
+            "ads_name": ads_name,
+            "ads_summary": ads_summary,
+            "ads_guide": ads_guide,
+            "ads_limit": ads_limit,
+            "ads_reward_price": ads_reward_price,
+            "ads_age_min": str(ads_age_min),
+            "ads_age_max": str(ads_age_max),
+            "ads_sdate": str(ads_sdate),
+            "ads_edate": str(ads_edate),
+            "ad_type": selected_ad_type,
+            "ad_type_category": ad_type_category
+        }
+        
+        # 결과 화면의 틀을 먼저 그리고, 스트리밍이면 필드가 도착하는 대로 채움
+        status.info("⏳ 광고를 분류하고 있습니다...")
+        with result_area.container():
+            placeholders = create_result_placeholders()
+        started = time.perf_counter()
+        shown = set()
+
+        def show_partial(partial: Dict[str, Any]) -> None:
+            if not shown:
+                status.info(f"⏳ 결과를 받는 중입니다... (첫 결과 {time.perf_counter() - started:.1f}초)")
+            for key, value in partial.items():
+                if key in placeholders and key not in shown:
+                    show_result_field(placeholders[key], key, value)
+                    shown.add(key)
+
+        try:
+            if use_streaming:
+                result = classify_ad_streaming_memoized(ad_data, api_key, use_cache, use_rules,
+                                                        use_near_duplicates, on_partial=show_partial)
+            else:
+                with st.spinner("광고를 분류하고 있습니다..."):
+                    result = classify_ad_memoized(ad_data, use_cache, use_rules, use_near_duplicates,
+                                                  _api_key=api_key)
+            st.session_state["classification_result"] = result
+        except (GeminiError, requests.RequestException) as e:
+            st.session_state.pop("classification_result", None)
+            result_area.empty()
+            status.error(f"❌ 분류에 실패했습니다. API 키와 입력 정보를 확인해주세요.\n\n{e}")
+
+    result = st.session_state.get("classification_result")
+    if result:
+        if not classify_clicked:
+            with result_area.container():
+                placeholders = create_result_placeholders()
+        show_result(placeholders, result)
+        with status.container():
+            st.success("✅ 분류가 완료되었습니다!")
+            if result.get("classification_source") == "rules":
+                st.caption(f"⚡ 규칙 기반 분류 (신뢰도 {result.get('confidence', 0):.2f}) - Gemini를 호출하지 않았습니다.")
+            elif result.get("classification_source") == "near_duplicate":
+                st.caption(f"♻️ 유사 광고 결과 재사용 (유사도 {result.get('confidence', 0):.2f}) - Gemini를 호출하지 않았습니다.")
             else:
-                st.error("❌ 분류에 실패했습니다. API 키와 입력 정보를 확인해주세요.")
+                st.caption("🤖 Gemini 분류")
+        
+        # JSON 결과 다운로드
+        st.header("💾 결과 다운로드")
+        
+        # CSV 형태로도 다운로드 가능하도록 데이터 변환
+        csv_data = convert_to_csv_format(result)
+        file_stem = f"ad_classification_{result.get('original_ads_name', '').replace(' ', '_')}"
+        
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            json_str = json.dumps(result, ensure_ascii=False, indent=2)
+            st.download_button(
+                label="📄 JSON 파일 다운로드",
+                data=json_str,
+                file_name=f"{file_stem}.json",
+                mime="application/json"
+            )
+        
+        with col2:
+            st.download_button(
+                label="📊 CSV 파일 다운로드",
+                data=csv_data,
+                file_name=f"{file_stem}.csv",
+                mime="text/csv"
+            )
+        
+        # 원본 JSON 표시
+        with st.expander("🔍 원본 JSON 결과 보기"):
+            st.json(result)
+
+    # 배치 분류 섹션
+    st.markdown("---")
+    st.header("📦 배치 분류 (CSV)")
+    st.info("💡 ads_idx, ads_code, ads_name, ads_summary 등 입력 폼과 같은 컬럼을 가진 CSV를 업로드하면 여러 광고를 동시에 분류합니다.")
+
+    uploaded_csv = st.file_uploader("광고 CSV 파일", type=["csv"])
+    col5, col6 = st.columns(2)
+    with col5:
+        batch_workers = st.number_input("동시 작업 수", min_value=1, max_value=64, value=8)
+    with col6:
+        batch_in_flight = st.number_input("최대 동시 요청 수", min_value=1, max_value=256, value=16)
+    batch_dedupe = st.checkbox("같은 ads_code의 동일 내용 광고는 한 번만 분류", value=True,
+                               help="ads_code와 요약/가이드/제한사항이 같은 변형 광고는 대표 광고의 결과를 공유합니다.")
+    batch_job_id = st.text_input("작업 ID (선택)", placeholder="예: nightly-2025-01-01",
+                                 help="작업 ID를 지정하면 완료된 결과를 저널에 기록하고, 중단 후 같은 ID로 다시 실행하면 완료된 광고를 건너뜁니다.")
+    batch_pack = st.checkbox("여러 광고를 한 번의 요청으로 묶어서 분류", value=False,
+                             help="짧은 광고가 많을 때 요청 수와 입력 토큰을 줄입니다. 응답에서 누락된 광고는 개별 요청으로 재시도합니다.")
+    batch_ordered = st.checkbox("입력 CSV 행 순서대로 저장", value=False,
+                                help="끝난 순서 대신 입력 순서로 기록합니다. 느린 광고가 있으면 뒤의 결과를 잠시 모아 두었다가 씁니다.")
+    batch_include_source = st.checkbox("분류 출처/신뢰도 열 추가", value=False,
+                                       help="json_total.csv의 43열 뒤에 classification_source, confidence 열을 추가합니다.")
+    batch_format = st.radio("출력 형식", ["csv", "parquet"], horizontal=True,
+                            help="parquet은 pyarrow가 설치되어 있어야 합니다.")
+
+    if st.button("📦 배치 분류 실행", disabled=uploaded_csv is None):
+        progress_text = st.empty()
+
+        def show_progress(stats: Dict[str, Any]) -> None:
+            progress_text.text(f"처리 {stats['processed']}건 (성공 {stats['succeeded']} / 실패 {stats['failed']}, "
+                               f"이전 실행에서 완료 {stats['resumed']}건)")
+
+        output = io.StringIO() if batch_format == "csv" else io.BytesIO()
+        with st.spinner("광고를 배치 분류하고 있습니다..."):
+            batch_stats = run_batch_csv(
+                io.TextIOWrapper(uploaded_csv, encoding="utf-8-sig", newline=""),
+                output,
+                api_key,
+                max_workers=int(batch_workers),
+                max_in_flight=int(batch_in_flight),
+                use_cache=use_cache,
+                dedupe=batch_dedupe,
+                pack=batch_pack,
+                job_id=batch_job_id.strip() or None,
+                output_format=batch_format,
+                progress_callback=show_progress,
+                use_rules=use_rules,
+                use_near_duplicates=use_near_duplicates,
+                ordered=batch_ordered,
+                include_source=batch_include_source
+            )
+        progress_text.empty()
+        st.session_state["batch_result"] = {"stats": batch_stats, "format": batch_format, "data": output.getvalue()}
+
+    # 배치 결과도 session_state에 보관하여 다운로드 버튼을 눌러도 다시 분류하지 않음
+    batch_result = st.session_state.get("batch_result")
+    if batch_result:
+        batch_stats, result_format = batch_result["stats"], batch_result["format"]
+        st.success(f"✅ 배치 분류 완료: 성공 {batch_stats['succeeded']}건, 실패 {batch_stats['failed']}건 "
+                   f"(중복 제거로 재사용 {batch_stats['deduplicated']}건, 규칙 기반 {batch_stats['rules']}건, "
+                   f"유사 광고 재사용 {batch_stats['near_duplicates']}건)")
+        if batch_stats["failed_ads_idx"]:
+            with st.expander("❌ 분류 실패 ads_idx"):
+                st.write(", ".join(str(idx) for idx in batch_stats["failed_ads_idx"]))
+
+        st.download_button(
+            label=f"📊 json_total.{result_format} 다운로드",
+            data=batch_result["data"],
+            file_name=f"json_total.{result_format}",
+            mime="text/csv" if result_format == "csv" else "application/vnd.apache.parquet"
+        )
+        show_batch_table(batch_result)
+
+    if show_metrics:
+        show_metrics_panel()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,6 @@
+"""
+오프라인 측정 도구 모음.
+
+generativelanguage.googleapis.com 대신 로컬에서 동작하는 Gemini 대역 서버(mock_gemini)와
+이를 이용한 측정 스크립트가 들어 있습니다. 저장소 루트에서 `python -m bench.<모듈>`로 실행합니다.
+"""
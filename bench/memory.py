@@ -0,0 +1,115 @@
+"""
+배치 파이프라인 메모리 측정 (입력 행 수에 따른 최대 RSS)
+
+행 수만 다른 합성 광고 CSV를 만들고 로컬 Gemini 대역 서버(bench.mock_gemini)를 띄운 뒤,
+행 수마다 별도 프로세스에서 run_batch_csv로 분류하여 최대 RSS와 처리량을 측정합니다.
+읽기 → 분류 → 기록 단계가 제한된 큐로 이어져 있으므로 최대 RSS는 행 수와 관계없이 거의 같아야 합니다.
+
+결과 캐시/중복 제거는 실제 배치와 같이 켜고 측정합니다. (규칙 기반 분류는 --rules, 유사 광고 재사용은 --near-duplicates로 켬)
+각 측정은 빈 캐시 디렉터리에서 시작합니다.
+
+실행:
+    python -m bench.memory --rows 10000,40000,160000
+    python -m bench.memory --rows 20000,200000 --ordered --pack --latency-ms 20
+    python -m bench.memory --rows 50000,500000 --job-id   # 저널 기록과 정리(compact)까지 포함
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+from typing import Any, Dict, List
+
+from bench.mock_gemini import MockGeminiServer, add_fault_arguments, fault_options
+from bench.throughput import write_synthetic_csv, peak_rss_mb
+
+
+def run_size(input_csv: str, output: str, args: argparse.Namespace) -> Dict[str, Any]:
+    """현재 프로세스에서 CSV 전체를 분류하고 측정값을 반환합니다."""
+    from ive_classifier import core
+
+    started = time.perf_counter()
+    stats = core.run_batch_csv(input_csv, output, "mock-key",
+                               max_workers=args.workers,
+                               max_in_flight=args.max_in_flight,
+                               pack=args.pack,
+                               ordered=args.ordered,
+                               job_id="bench-memory" if args.job_id else None,
+                               use_rules=args.rules,
+                               use_near_duplicates=args.near_duplicates)
+    elapsed = time.perf_counter() - started
+    return {
+        "processed": stats["processed"],
+        "failed": stats["failed"],
+        "elapsed_s": round(elapsed, 2),
+        "rows_per_s": round(stats["processed"] / elapsed, 1) if elapsed > 0 else 0.0,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def measure(server: MockGeminiServer, rows: int, args: argparse.Namespace) -> Dict[str, Any]:
+    """행 수 하나를 새 프로세스에서 측정합니다."""
+    with tempfile.TemporaryDirectory(prefix="ive-bench-memory-") as work_dir:
+        input_csv = os.path.join(work_dir, "ads.csv")
+        write_synthetic_csv(input_csv, rows, args.seed or 0)
+        env = dict(os.environ,
+                   GEMINI_API_BASE=server.base_url,
+                   IVE_CACHE_PATH=os.path.join(work_dir, "cache.sqlite3"),
+                   IVE_NEAR_DUP_PATH=os.path.join(work_dir, "near_duplicates.sqlite3"),
+                   IVE_JOBS_DIR=os.path.join(work_dir, "jobs"))
+        command = [sys.executable, "-m", "bench.memory", "--run", input_csv,
+                   "--output", os.path.join(work_dir, "json_total" + args.suffix),
+                   "--workers", str(args.workers), "--max-in-flight", str(args.max_in_flight)]
+        command += [flag for flag, on in (("--pack", args.pack), ("--ordered", args.ordered),
+                                          ("--job-id", args.job_id), ("--rules", args.rules),
+                                          ("--near-duplicates", args.near_duplicates))
+                    if on]
+        proc = subprocess.run(command, env=env, capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        if proc.returncode != 0:
+            raise RuntimeError(f"{rows}행 측정 실패:\n{proc.stderr}")
+        return {"rows": rows, **json.loads(proc.stdout.strip().splitlines()[-1])}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="입력 행 수에 따른 배치 파이프라인 최대 RSS 측정")
+    parser.add_argument("--rows", default="10000,40000,160000", help="측정할 행 수 (쉼표로 구분)")
+    parser.add_argument("--workers", type=int, default=8, help="워커 스레드 수")
+    parser.add_argument("--max-in-flight", type=int, default=16, help="최대 동시 요청 수")
+    parser.add_argument("--pack", action="store_true", help="여러 광고를 한 요청으로 묶어 분류")
+    parser.add_argument("--ordered", action="store_true", help="입력 행 순서대로 기록")
+    parser.add_argument("--job-id", action="store_true", help="저널에 기록한 뒤 정리하여 출력 (재시작 가능한 배치)")
+    parser.add_argument("--rules", action="store_true", help="규칙 기반 빠른 분류를 켬")
+    parser.add_argument("--near-duplicates", action="store_true", help="유사 광고 결과 재사용을 켬")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="대역 서버의 요청당 평균 지연(ms)")
+    parser.add_argument("--suffix", default=".csv", choices=(".csv", ".parquet", ".arrow"), help="출력 형식")
+    parser.add_argument("--json", action="store_true", help="결과를 JSON으로 출력")
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    parser.add_argument("--output", help=argparse.SUPPRESS)
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_size(args.run, args.output, args)))
+        return
+
+    sizes = [int(size) for size in args.rows.split(",") if size.strip()]
+    with MockGeminiServer(latency_ms=args.latency_ms, **fault_options(args)) as server:
+        results: List[Dict[str, Any]] = [measure(server, rows, args) for rows in sizes]
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+    print(f"{'rows':>9} {'failed':>6} {'elapsed s':>9} {'rows/s':>8} {'RSS MB':>7}")
+    for r in results:
+        print(f"{r['rows']:>9} {r['failed']:>6} {r['elapsed_s']:>9.1f} {r['rows_per_s']:>8.1f} {r['peak_rss_mb']:>7.1f}")
+    if len(results) > 1:
+        smallest, largest = results[0], results[-1]
+        print(f"\n행 수 {largest['rows'] / smallest['rows']:.0f}배 → 최대 RSS "
+              f"{largest['peak_rss_mb'] - smallest['peak_rss_mb']:+.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
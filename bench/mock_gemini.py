@@ -0,0 +1,563 @@
+"""
+generativelanguage.googleapis.com 로컬 대역 서버
+
+실제 API 키나 네트워크 없이 분류기를 실행하고 측정하기 위한 서버입니다.
+다음 엔드포인트를 흉내 냅니다.
+
+- POST /v1beta/models/{model}:generateContent   → 스키마에 맞는 고정 분류 결과 반환
+  (광고 텍스트의 사용자 지정 카테고리와 명시된 연령 범위는 프롬프트 규칙대로 반영)
+- POST /v1beta/models/{model}:streamGenerateContent?alt=sse → 같은 결과를 SSE 조각으로 나눠 전송
+- POST /v1beta/cachedContents                   → 컨텍스트 캐시 등록 (이름 반환)
+- GET  /v1beta/stats                            → 요청 수/바이트 등 누적 통계
+
+generationConfig에 responseSchema가 있으면 결과를 그 스키마 모양(짧은 키 포함)으로 바꿔 보냅니다.
+응답에는 실제 API처럼 usageMetadata(입력/출력 토큰 수)가 들어 있습니다. (글자 수로 추정한 값)
+
+응답 지연은 latency_ms + per_kb_ms × (요청 본문 KB)로 흉내 냅니다.
+latency_dist로 latency_ms를 평균으로 하는 분포(fixed/uniform/exponential/lognormal)에서 매 요청의 지연을 뽑을 수 있습니다.
+스트리밍 응답은 같은 전체 지연을 stream_chunks개의 조각에 나눠 보내므로 첫 조각은 그만큼 일찍 도착합니다.
+컨텍스트 캐시로 참조된 지시문은 요청 본문에 없으므로 지연에 포함되지 않습니다.
+실제 Gemini의 처리 시간이 아니라, 입력 크기에 따른 비용 차이를 보기 위한 단순 모델입니다.
+
+실패 상황도 비율로 흉내 낼 수 있습니다. (seed로 재현 가능)
+- rate_429 / rate_500: 지연 없이 429(retry_after가 있으면 Retry-After 헤더 포함) / 500 응답
+- fenced_rate: 결과 JSON을 ```json 코드펜스로 감싸는 비율 (기본 1.0, responseMimeType이 JSON인 요청은 감싸지 않음)
+- truncated_rate: 결과 JSON을 중간에서 잘라 보내는 비율 (maxOutputTokens에 걸린 응답)
+- invalid_rate: 해석은 되지만 검증(validate_classification)에 걸리는 결과를 보내는 비율.
+  invalid_model을 주면 그 모델의 요청에만 적용 (모델 cascade 측정용)
+
+model_latency_ms로 모델마다 다른 평균 지연을 줄 수 있습니다. (예: 상위 모델은 더 느림)
+
+API 키(쿼리 문자열 key)마다 할당량도 흉내 냅니다. (여러 키를 쓰는 키 풀 측정용)
+- key_rpm: 키 하나의 분당 요청 한도. 넘으면 429 (core.TokenBucket 기본값처럼 10초 분량까지 몰아 쓰기 허용, 0이면 제한 없음)
+- forbidden_keys: 403(권한 없음/비활성 프로젝트)을 반환할 키 목록
+
+실행:
+    python -m bench.mock_gemini --port 8765 --latency-ms 200 --per-kb-ms 10
+    python -m bench.mock_gemini --latency-ms 300 --latency-dist lognormal --rate-429 0.05 --truncated-rate 0.02
+    python -m bench.mock_gemini --invalid-rate 0.05 --invalid-model gemini-2.5-flash-lite \
+        --model-latency gemini-2.5-flash=600
+    python -m bench.mock_gemini --key-rpm 600 --forbidden-key mock-key-3
+    GEMINI_API_BASE=http://127.0.0.1:8765/v1beta streamlit run app.py
+"""
+import re
+import json
+import math
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from typing import Dict, Any, Optional, List, Tuple, Iterable
+
+CANNED_RESULT: Dict[str, Any] = {
+    "ad_type": "1",
+    "ad_type_category": ["2"],
+    "ad_theme": ["fantasy", "growth", "rewards"],
+    "target_age": "twenties",
+    "target_gender": "neutral",
+    "motivation": {
+        "fun": 0.8, "social": 0.2, "rewards": 1, "savings": 0.3, "trust": 0.2,
+        "convenience": 0.4, "growth": 0.6, "status_display": 0.3, "curiosity": 0.5,
+        "habit_building": 0.3, "safety_net": 0
+    },
+    "engagement": {
+        "casual_score": 0.4, "hardcore_score": 0.6, "frequency_score": 0.5,
+        "multi_app_usage": 1, "retention_potential": 0.5,
+        "session_length_expectation": "medium"
+    },
+    "promo": {
+        "install_reward_sensitive": 1, "coupon_event_sensitive": 0.3,
+        "fomo_sensitive": 0.2, "exclusive_benefit_sensitive": 0.3,
+        "trial_experience_sensitive": 0.4
+    },
+    "brand": {
+        "brand_loyalty": 0.2, "nostalgia": 0, "trust_in_official": 0.3,
+        "award_proof_sensitive": 0, "local_trust_factor": 0.5,
+        "global_trust_factor": 0.2
+    },
+    "commerce": {
+        "price_sensitivity": 0.4, "premium_willingness": 0.3,
+        "transaction_frequency": 0.3, "risk_tolerance": 0.2,
+        "recurring_payment": 0, "big_purchase_intent": 0.1
+    },
+    "notes": ["설치", "적립", "RPG"]
+}
+
+_PACKED_ID_RE = re.compile(r"### 광고 id: (\S+)")
+# invalid_rate로 보내는 결과에서 바꿀 곳: (섹션, 필드, 값) - 선택지 밖의 값, 범위 밖의 점수, 판정 기준 위반(게임 광고의 낮은 fun)
+INVALID_EDITS: Tuple[Tuple[str, str, Any], ...] = (
+    ("", "target_age", "unknown"),
+    ("brand", "nostalgia", 5),
+    ("motivation", "fun", 0.1),
+)
+
+
+# 프롬프트의 사용자 지정 정보 규칙을 따르기 위한 광고 텍스트 항목
+_USER_CATEGORY_RE = re.compile(r"사용자 지정 광고 카테고리: *([^\n]*)")
+_AGE_RANGE_RE = re.compile(r"연령 범위: *(\d+)~(\d+)")
+_AGE_DECADES = ((20, "twenties"), (30, "thirties"), (40, "forties"), (50, "fifties"))
+# 판정 기준의 카테고리별 기본 점수: (카테고리 코드, 섹션, 필드, 최소 점수) - 게임 fun, 금융 trust, 쇼핑 price_sensitivity
+_CATEGORY_SCORES = (
+    (("2", "5", "6"), "motivation", "fun", 0.7),
+    (("7",), "motivation", "trust", 0.5),
+    (("11", "12"), "commerce", "price_sensitivity", 0.6),
+)
+
+
+def _explicit_target_age(low: int, high: int) -> Optional[str]:
+    # 분류 규칙 (D): 명시된 연령 범위는 그대로 반영 (0~100처럼 전 연령이면 명시 없음)
+    if low <= 14 and high >= 60:
+        return None
+    if high <= 19:
+        return "teens"
+    for decade, label in _AGE_DECADES:
+        if decade <= low and high < decade + 10:
+            return label
+    return "adults" if low >= 19 else None
+
+
+def follow_ad_text(result: Dict[str, Any], ad_text: str) -> Dict[str, Any]:
+    """
+    고정 결과에 광고 텍스트의 사용자 지정 카테고리와 명시된 연령 범위, 카테고리별 기본 점수를 반영합니다.
+    (프롬프트 규칙을 따르는 모델처럼)
+    """
+    result = dict(result)
+    match = _USER_CATEGORY_RE.search(ad_text)
+    categories = [c.strip() for c in (match.group(1) if match else "").split(",") if c.strip()]
+    if categories:
+        result["ad_type_category"] = list(dict.fromkeys(list(result.get("ad_type_category", [])) + categories))
+        for codes, section, key, minimum in _CATEGORY_SCORES:
+            score = result.get(section, {}).get(key)
+            if any(c in codes for c in categories) and isinstance(score, (int, float)) and 0 <= score < minimum:
+                result[section] = dict(result[section], **{key: minimum})
+    match = _AGE_RANGE_RE.search(ad_text)
+    target_age = _explicit_target_age(int(match.group(1)), int(match.group(2))) if match else None
+    if target_age:
+        result["target_age"] = target_age
+    return result
+
+
+def _model_name(path: str) -> str:
+    # /v1beta/models/{model}:generateContent -> {model}
+    return path.rsplit("/", 1)[-1].split(":", 1)[0]
+
+
+def _api_key(path: str) -> str:
+    # /v1beta/models/{model}:generateContent?key=... -> 키
+    return parse_qs(urlsplit(path).query).get("key", [""])[0]
+
+LATENCY_DISTS = ("fixed", "uniform", "exponential", "lognormal")
+
+
+class _MockGeminiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # 헤더와 본문을 나눠 쓰므로 Nagle + 지연 ACK(약 40ms)가 지연에 섞이지 않도록
+    server: "_MockHTTPServer"
+
+    def log_message(self, format, *args):  # noqa: A002 - BaseHTTPRequestHandler 시그니처
+        pass
+
+    def _send_json(self, status: int, payload: Any) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if status == 429 and self.server.mock.retry_after is not None:
+            self.send_header("Retry-After", str(self.server.mock.retry_after))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.split("?")[0].endswith("/stats"):
+            self._send_json(200, self.server.mock.stats())
+        else:
+            self._send_json(404, {"error": {"code": 404, "message": "not found"}})
+
+    def do_POST(self):
+        raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = self.path.split("?")[0]
+        try:
+            body = json.loads(raw or b"{}")
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": {"code": 400, "message": "invalid JSON"}})
+            return
+
+        mock = self.server.mock
+        if path.endswith("/cachedContents"):
+            self._send_json(200, mock.create_cached_content(body))
+        elif path.endswith(":generateContent"):
+            status, payload = mock.generate_content(body, len(raw), _model_name(path), _api_key(self.path))
+            self._send_json(status, payload)
+        elif path.endswith(":streamGenerateContent"):
+            error = mock.record_request(body, len(raw), _model_name(path), _api_key(self.path))
+            if error is not None:
+                self._send_json(*error)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for delay, payload in mock.stream_chunks_for(body, len(raw), _model_name(path)):
+                time.sleep(delay)
+                event = ("data: " + json.dumps(payload, ensure_ascii=False) + "\r\n\r\n").encode("utf-8")
+                self.wfile.write(f"{len(event):X}\r\n".encode("ascii") + event + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+        else:
+            self._send_json(404, {"error": {"code": 404, "message": "not found"}})
+
+
+class _MockHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # 동시 연결이 몰려도 SYN 재전송(1초) 지연이 측정에 섞이지 않도록
+    mock: "MockGeminiServer"
+
+
+def render_schema(schema: Dict[str, Any], value: Any) -> Any:
+    """
+    고정 결과를 responseSchema 모양으로 바꿉니다. 속성 값은 description(짧은 키의 원래 이름) 또는 속성 이름으로 찾고,
+    propertyOrdering 순서로 담으며 maxItems를 넘는 목록은 자릅니다.
+    """
+    kind = str(schema.get("type", "")).upper()
+    if kind == "OBJECT":
+        source = value if isinstance(value, dict) else {}
+        properties = schema.get("properties", {})
+        return {
+            name: render_schema(properties[name], source.get(properties[name].get("description", name),
+                                                             source.get(name)))
+            for name in schema.get("propertyOrdering", list(properties))
+        }
+    if kind == "ARRAY":
+        items = value if isinstance(value, list) else []
+        if "maxItems" in schema:
+            items = items[:int(schema["maxItems"])]
+        return [render_schema(schema.get("items", {}), item) for item in items]
+    if value is None:
+        return 0 if kind in ("NUMBER", "INTEGER") else ""
+    return value
+
+
+class MockGeminiServer:
+    """Gemini REST API 대역 서버. with 문으로 사용하면 백그라운드 스레드에서 실행됩니다."""
+
+    def __init__(self,
+                 host: str = "127.0.0.1",
+                 port: int = 0,
+                 latency_ms: float = 0.0,
+                 per_kb_ms: float = 0.0,
+                 result: Optional[Dict[str, Any]] = None,
+                 stream_chunks: int = 8,
+                 latency_dist: str = "fixed",
+                 latency_sigma: float = 0.5,
+                 rate_429: float = 0.0,
+                 rate_500: float = 0.0,
+                 retry_after: Optional[float] = None,
+                 fenced_rate: float = 1.0,
+                 truncated_rate: float = 0.0,
+                 invalid_rate: float = 0.0,
+                 invalid_model: str = "",
+                 model_latency_ms: Optional[Dict[str, float]] = None,
+                 key_rpm: float = 0.0,
+                 forbidden_keys: Iterable[str] = (),
+                 seed: Optional[int] = None):
+        if latency_dist not in LATENCY_DISTS:
+            raise ValueError(f"latency_dist는 {LATENCY_DISTS} 중 하나여야 합니다.")
+        self.latency_ms = latency_ms
+        self.per_kb_ms = per_kb_ms
+        self.stream_chunks = max(stream_chunks, 1)
+        self.result = result if result is not None else CANNED_RESULT
+        self.latency_dist = latency_dist
+        self.latency_sigma = latency_sigma
+        self.rate_429 = rate_429
+        self.rate_500 = rate_500
+        self.retry_after = retry_after
+        self.fenced_rate = fenced_rate
+        self.truncated_rate = truncated_rate
+        self.invalid_rate = invalid_rate
+        self.invalid_model = invalid_model
+        self.model_latency_ms = dict(model_latency_ms or {})
+        self.key_rpm = key_rpm
+        self.forbidden_keys = frozenset(forbidden_keys)
+        self._key_quota: Dict[str, Tuple[float, float]] = {}  # 키 -> (남은 요청 수, 갱신 시각)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._cached_contents: Dict[str, str] = {}
+        self._httpd = _MockHTTPServer((host, port), _MockGeminiHandler)
+        self._httpd.mock = self
+        self._thread: Optional[threading.Thread] = None
+        self.reset_stats()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1beta"
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._stats = {
+                "generate_requests": 0,
+                "generate_request_bytes": 0,
+                "cached_content_hits": 0,
+                "cached_contents_created": 0,
+                "errors_429": 0,
+                "errors_500": 0,
+                "fenced_responses": 0,
+                "truncated_responses": 0,
+                "invalid_responses": 0,
+                "errors_403": 0,
+                "requests_by_model": {},
+                "requests_by_key": {},
+            }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._stats, "requests_by_model": dict(self._stats["requests_by_model"]),
+                    "requests_by_key": dict(self._stats["requests_by_key"])}
+
+    def create_cached_content(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        instruction = "".join(p.get("text", "") for p in body.get("systemInstruction", {}).get("parts", []))
+        with self._lock:
+            name = f"cachedContents/mock-{len(self._cached_contents) + 1}"
+            self._cached_contents[name] = instruction
+            self._stats["cached_contents_created"] += 1
+        return {"name": name, "model": body.get("model", ""), "ttl": body.get("ttl", "3600s")}
+
+    def _over_key_quota(self, api_key: str) -> bool:
+        # 잠금 안에서 호출됨. 키별 토큰 버킷 (초당 key_rpm / 60개씩 채우고 10초 분량까지 쌓임)
+        if self.key_rpm <= 0:
+            return False
+        rate = self.key_rpm / 60
+        capacity = max(rate * 10, 1.0)
+        now = time.monotonic()
+        tokens, updated = self._key_quota.get(api_key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * rate)
+        if tokens < 1:
+            self._key_quota[api_key] = (tokens, now)
+            return True
+        self._key_quota[api_key] = (tokens - 1, now)
+        return False
+
+    def record_request(self, body: Dict[str, Any], request_bytes: int,
+                       model: str = "", api_key: str = "") -> Optional[Tuple[int, Dict[str, Any]]]:
+        """
+        요청을 통계에 기록합니다. 참조한 컨텍스트 캐시가 없거나, 키가 막혔거나 할당량을 넘었거나,
+        오류를 흉내 낼 차례이면 (상태 코드, 오류 본문)을 반환합니다.
+        """
+        cached_name = body.get("cachedContent")
+        with self._lock:
+            if cached_name and cached_name not in self._cached_contents:
+                return 404, {"error": {"code": 404, "message": f"{cached_name} not found"}}
+            self._stats["generate_requests"] += 1
+            self._stats["generate_request_bytes"] += request_bytes
+            by_model = self._stats["requests_by_model"]
+            by_model[model] = by_model.get(model, 0) + 1
+            by_key = self._stats["requests_by_key"]
+            by_key[api_key] = by_key.get(api_key, 0) + 1
+            if api_key in self.forbidden_keys:
+                self._stats["errors_403"] += 1
+                return 403, {"error": {"code": 403, "message": "Permission denied on API key (mock)",
+                                       "status": "PERMISSION_DENIED"}}
+            if self._over_key_quota(api_key):
+                self._stats["errors_429"] += 1
+                return 429, {"error": {"code": 429, "message": "Quota exceeded for API key (mock)",
+                                       "status": "RESOURCE_EXHAUSTED"}}
+            roll = self._rng.random()
+            if roll < self.rate_429:
+                self._stats["errors_429"] += 1
+                return 429, {"error": {"code": 429, "message": "Resource has been exhausted (mock)",
+                                       "status": "RESOURCE_EXHAUSTED"}}
+            if roll < self.rate_429 + self.rate_500:
+                self._stats["errors_500"] += 1
+                return 500, {"error": {"code": 500, "message": "Internal error (mock)", "status": "INTERNAL"}}
+            if cached_name:
+                self._stats["cached_content_hits"] += 1
+        return None
+
+    def _latency(self, request_bytes: int, model: str = "") -> float:
+        mean = self.model_latency_ms.get(model, self.latency_ms)
+        if mean > 0 and self.latency_dist != "fixed":
+            with self._lock:
+                if self.latency_dist == "uniform":
+                    mean = self._rng.uniform(0, 2 * mean)
+                elif self.latency_dist == "exponential":
+                    mean = self._rng.expovariate(1 / mean)
+                else:
+                    # 평균이 latency_ms가 되도록 mu를 맞춘 로그정규분포 (긴 꼬리)
+                    sigma = self.latency_sigma
+                    mean = self._rng.lognormvariate(math.log(mean) - sigma * sigma / 2, sigma)
+        return (mean + self.per_kb_ms * request_bytes / 1024) / 1000
+
+    def generate_content(self, body: Dict[str, Any], request_bytes: int, model: str = "", api_key: str = ""):
+        error = self.record_request(body, request_bytes, model, api_key)
+        if error is not None:
+            return error
+        time.sleep(self._latency(request_bytes, model))
+        text = self._result_text(body, model)
+        return 200, {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}],
+                     "usageMetadata": self.usage_metadata(body, text)}
+
+    def stream_chunks_for(self, body: Dict[str, Any], request_bytes: int,
+                          model: str = "") -> List[Tuple[float, Dict[str, Any]]]:
+        """스트리밍 응답 조각 목록: (보내기 전 대기 시간(초), 응답 조각)"""
+        text = self._result_text(body, model)
+        size = -(-len(text) // self.stream_chunks)
+        delay = self._latency(request_bytes, model) / self.stream_chunks
+        chunks = [
+            (delay, {"candidates": [{"content": {"role": "model", "parts": [{"text": text[i:i + size]}]}}]})
+            for i in range(0, len(text), size)
+        ]
+        chunks[-1][1]["usageMetadata"] = self.usage_metadata(body, text)  # 실제 API처럼 마지막 조각에 누적 사용량
+        return chunks
+
+    def usage_metadata(self, body: Dict[str, Any], text: str) -> Dict[str, int]:
+        """요청/응답 글자 수로 추정한 usageMetadata (한글은 글자당 약 1토큰, 그 외는 4글자당 1토큰)"""
+        def tokens(value: str) -> int:
+            ascii_chars = len(value.encode("ascii", "ignore"))
+            return ascii_chars // 4 + (len(value) - ascii_chars) + 1
+
+        request_text = "".join(
+            part.get("text", "")
+            for content in body.get("contents", []) + [body.get("systemInstruction", {})]
+            for part in content.get("parts", [])
+        )
+        prompt = tokens(request_text)
+        output = tokens(text)
+        usage = {"promptTokenCount": prompt, "candidatesTokenCount": output}
+        if body.get("cachedContent"):
+            # 컨텍스트 캐시의 지시문도 입력 토큰에 포함됨 (실제 API와 같음)
+            with self._lock:
+                cached = tokens(self._cached_contents.get(body["cachedContent"], ""))
+            usage["cachedContentTokenCount"] = cached
+            usage["promptTokenCount"] = prompt = prompt + cached
+        usage["totalTokenCount"] = prompt + output
+        return usage
+
+    def _ad_result(self, ad_text: str, model: str) -> Dict[str, Any]:
+        # 잠금 안에서 호출됨. 검증에 걸리는 결과를 낼 차례이면 광고에 맞춘 결과의 한 곳을 망가뜨린 사본을 반환
+        result = follow_ad_text(self.result, ad_text)
+        if not self.invalid_rate or (self.invalid_model and model != self.invalid_model):
+            return result
+        if self._rng.random() >= self.invalid_rate:
+            return result
+        self._stats["invalid_responses"] += 1
+        section, key, value = self._rng.choice(INVALID_EDITS)
+        result = json.loads(json.dumps(result))
+        (result[section] if section else result)[key] = value
+        return result
+
+    def _result_text(self, body: Dict[str, Any], model: str = "") -> str:
+        user_text = "".join(
+            part.get("text", "")
+            for content in body.get("contents", [])
+            for part in content.get("parts", [])
+        )
+        # 묶음 요청이면 "### 광고 id: <id>"마다 광고 하나: [앞부분, id1, 광고1, id2, 광고2, ...]
+        sections = _PACKED_ID_RE.split(user_text)
+        with self._lock:
+            if len(sections) > 1:
+                payload: Any = [dict(self._ad_result(ad_text, model), id=ad_id)
+                                for ad_id, ad_text in zip(sections[1::2], sections[2::2])]
+            else:
+                payload = self._ad_result(user_text, model)
+        config = body.get("generationConfig", {})
+        if config.get("responseSchema"):
+            payload = render_schema(config["responseSchema"], payload)
+        # responseMimeType이 JSON이면 실제 API처럼 코드펜스 없이 JSON만 보냄
+        fence = "" if config.get("responseMimeType") == "application/json" else "```json\n"
+        text = json.dumps(payload, ensure_ascii=False)
+        with self._lock:
+            if self._rng.random() < self.truncated_rate:
+                # 출력 토큰 한도에 걸린 것처럼 30~90% 지점에서 자름 (코드펜스도 닫히지 않음)
+                self._stats["truncated_responses"] += 1
+                return fence + text[:int(len(text) * self._rng.uniform(0.3, 0.9))]
+            if fence and self._rng.random() < self.fenced_rate:
+                self._stats["fenced_responses"] += 1
+                return "```json\n" + text + "\n```"
+        return text
+
+    def serve_forever(self) -> None:
+        """현재 스레드에서 서버를 실행합니다."""
+        try:
+            self._httpd.serve_forever()
+        finally:
+            self._httpd.server_close()
+
+    def start(self) -> "MockGeminiServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="mock-gemini", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "MockGeminiServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def add_fault_arguments(parser: argparse.ArgumentParser) -> None:
+    """지연 분포와 실패 비율 옵션을 추가합니다. (측정 스크립트와 공유)"""
+    parser.add_argument("--latency-dist", choices=LATENCY_DISTS, default="fixed",
+                        help="요청당 지연 분포 (평균은 --latency-ms)")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="lognormal 분포의 sigma (클수록 꼬리가 김)")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="429 응답 비율 (0~1)")
+    parser.add_argument("--rate-500", type=float, default=0.0, help="500 응답 비율 (0~1)")
+    parser.add_argument("--retry-after", type=float, default=None, help="429 응답의 Retry-After 헤더(초)")
+    parser.add_argument("--fenced-rate", type=float, default=1.0, help="결과를 ```json 코드펜스로 감싸는 비율 (0~1)")
+    parser.add_argument("--truncated-rate", type=float, default=0.0, help="결과 JSON을 중간에서 잘라 보내는 비율 (0~1)")
+    parser.add_argument("--invalid-rate", type=float, default=0.0, help="검증에 걸리는 결과를 보내는 비율 (0~1)")
+    parser.add_argument("--invalid-model", default="", help="--invalid-rate를 적용할 모델 (기본값: 모든 모델)")
+    parser.add_argument("--model-latency", action="append", default=[], metavar="MODEL=MS",
+                        help="모델별 평균 지연(ms), 여러 번 지정 가능 (기본값: --latency-ms)")
+    parser.add_argument("--key-rpm", type=float, default=0.0,
+                        help="API 키 하나의 분당 요청 한도, 넘으면 429 (0이면 제한 없음)")
+    parser.add_argument("--forbidden-key", action="append", default=[], metavar="KEY",
+                        help="403을 반환할 API 키, 여러 번 지정 가능")
+    parser.add_argument("--seed", type=int, default=None, help="지연/실패를 재현하기 위한 난수 시드")
+
+
+def fault_options(args: argparse.Namespace) -> Dict[str, Any]:
+    """add_fault_arguments로 받은 옵션을 MockGeminiServer 인자로 변환합니다."""
+    return {
+        "latency_dist": args.latency_dist,
+        "latency_sigma": args.latency_sigma,
+        "rate_429": args.rate_429,
+        "rate_500": args.rate_500,
+        "retry_after": args.retry_after,
+        "fenced_rate": args.fenced_rate,
+        "truncated_rate": args.truncated_rate,
+        "invalid_rate": args.invalid_rate,
+        "invalid_model": args.invalid_model,
+        "model_latency_ms": {model: float(ms) for model, _, ms in (item.partition("=") for item in args.model_latency)},
+        "key_rpm": args.key_rpm,
+        "forbidden_keys": args.forbidden_key,
+        "seed": args.seed,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Gemini API 로컬 대역 서버")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="요청당 기본 지연(ms)")
+    parser.add_argument("--per-kb-ms", type=float, default=0.0, help="요청 본문 1KB당 추가 지연(ms)")
+    parser.add_argument("--stream-chunks", type=int, default=8, help="스트리밍 응답의 조각 수")
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockGeminiServer(args.host, args.port, args.latency_ms, args.per_kb_ms, stream_chunks=args.stream_chunks,
+                              **fault_options(args))
+    print(f"Mock Gemini API: {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
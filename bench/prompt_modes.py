@@ -0,0 +1,67 @@
+"""
+분류 지시문 전달 방식(inline / system / cached)별 입력 바이트와 지연 시간 측정
+
+로컬 Gemini 대역 서버(bench.mock_gemini)에 같은 합성 광고를 방식별로 보내고
+요청 본문 크기와 classify_ad 호출 지연을 비교합니다. 결과 캐시는 사용하지 않습니다.
+
+실행:
+    python -m bench.prompt_modes --ads 50 --latency-ms 150 --per-kb-ms 10
+"""
+import json
+import argparse
+import statistics
+import time
+from typing import Dict, Any, List
+
+from ive_classifier import core
+from bench.mock_gemini import MockGeminiServer
+from bench.synthetic import synthetic_ads
+
+
+def measure_prompt_mode(server: MockGeminiServer, prompt_mode: str, ads: List[Dict[str, str]]) -> Dict[str, Any]:
+    """한 가지 전달 방식으로 광고를 순서대로 분류하고 측정값을 반환합니다."""
+    core.GEMINI_PROMPT_MODE = prompt_mode
+    server.reset_stats()
+
+    latencies = []
+    for ad in ads:
+        started = time.perf_counter()
+        core.classify_ad(ad, api_key="mock-key", use_cache=False, use_rules=False, use_near_duplicates=False)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    stats = server.stats()
+    return {
+        "prompt_mode": prompt_mode,
+        "requests": stats["generate_requests"],
+        "avg_request_bytes": stats["generate_request_bytes"] / max(stats["generate_requests"], 1),
+        "total_request_bytes": stats["generate_request_bytes"],
+        "latency_p50_ms": statistics.median(latencies),
+        "latency_mean_ms": statistics.fmean(latencies),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="지시문 전달 방식별 입력 바이트/지연 측정")
+    parser.add_argument("--ads", type=int, default=50, help="방식별로 분류할 광고 수")
+    parser.add_argument("--latency-ms", type=float, default=150.0, help="대역 서버의 요청당 기본 지연(ms)")
+    parser.add_argument("--per-kb-ms", type=float, default=10.0, help="대역 서버의 요청 본문 1KB당 추가 지연(ms)")
+    parser.add_argument("--json", action="store_true", help="결과를 JSON으로 출력")
+    args = parser.parse_args()
+
+    ads = list(synthetic_ads(args.ads))
+    with MockGeminiServer(latency_ms=args.latency_ms, per_kb_ms=args.per_kb_ms) as server:
+        core.GEMINI_API_BASE = server.base_url
+        results = [measure_prompt_mode(server, mode, ads) for mode in core.PROMPT_MODES]
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+
+    print(f"{'mode':<8} {'requests':>8} {'avg bytes':>10} {'total bytes':>12} {'p50 ms':>8} {'mean ms':>8}")
+    for r in results:
+        print(f"{r['prompt_mode']:<8} {r['requests']:>8} {r['avg_request_bytes']:>10.0f} "
+              f"{r['total_request_bytes']:>12} {r['latency_p50_ms']:>8.1f} {r['latency_mean_ms']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
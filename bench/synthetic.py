@@ -0,0 +1,40 @@
+"""측정용 합성 광고 데이터"""
+import random
+from typing import Dict, Iterator
+
+_NAMES = [
+    "판타지 RPG 신규 설치", "최저가 쇼핑몰 첫 구매", "간편 보험료 조회", "웹툰 정주행 이벤트",
+    "영어 회화 7일 무료 체험", "가상화폐 거래소 가입", "배달앱 첫 주문 할인", "퀴즈 맞히고 포인트 적립"
+]
+_SUMMARIES = [
+    "앱 설치 후 실행하면 포인트가 적립됩니다.",
+    "신규 회원 가입 후 첫 구매 시 리워드를 드립니다.",
+    "레벨 10 달성 시 보상이 지급됩니다.",
+    "무료 체험 신청만 해도 적립 완료!",
+]
+_GUIDES = [
+    "1. 앱을 설치합니다.\n2. 회원가입을 완료합니다.\n3. 10분 이내에 적립됩니다.",
+    "광고 참여 후 24시간 이내 미적립 시 고객센터로 문의해주세요.",
+    "이미 설치한 이력이 있는 경우 적립되지 않습니다.",
+]
+
+
+def synthetic_ads(count: int, seed: int = 0) -> Iterator[Dict[str, str]]:
+    """입력 폼과 같은 컬럼을 가진 합성 광고 행을 생성합니다."""
+    rng = random.Random(seed)
+    for i in range(count):
+        yield {
+            "ads_idx": str(100000 + i),
+            "ads_code": f"AD{rng.randrange(count // 3 + 1):06d}",
+            "ads_name": rng.choice(_NAMES),
+            "ads_summary": rng.choice(_SUMMARIES),
+            "ads_guide": rng.choice(_GUIDES),
+            "ads_limit": rng.choice(["", "신규 설치자만 참여 가능", "1인 1회"]),
+            "ads_reward_price": str(rng.choice([10, 50, 100, 300, 1000])),
+            "ads_age_min": str(rng.choice([0, 14, 19])),
+            "ads_age_max": "100",
+            "ads_sdate": "2025-01-01",
+            "ads_edate": "2025-12-31",
+            "ad_type": rng.choice(["", "1", "3", "12"]),
+            "ad_type_category": rng.choice(["", "1", "5", "11"]),
+        }
@@ -0,0 +1,402 @@
+"""
+분류 처리량/지연 측정 (single / batch / packed / async)
+
+합성 광고 CSV를 만들고 로컬 Gemini 대역 서버(bench.mock_gemini)를 띄운 뒤,
+방식별로 별도 프로세스에서 같은 CSV를 분류하여 다음 값을 측정합니다.
+
+- 처리량: 초당 처리한 광고 수(ads/s)와 초당 Gemini 요청 수(req/s, 재시도 포함)
+- 광고 한 건의 지연 p50/p95/p99 (배치 방식은 입력에서 읽은 시점부터 결과가 나온 시점까지)
+- 응답 해석 실패율 (parse_gemini_response 실패 / 호출), 결과를 얻지 못한 광고 수
+- 검증(validate_classification)에 걸린 최종 결과 수와, 모델 cascade를 쓰면 모델별 호출 결과/지연/비용
+- 광고당 토큰 수(전체/출력)와 예상 비용 (대역 서버가 돌려준 usageMetadata 기준), 광고당 Gemini 요청 수
+- 최대 RSS (방식마다 새 프로세스에서 측정하므로 서로 섞이지 않음)
+
+방식:
+    single  classify_ad를 한 건씩 순서대로 호출
+    batch   classify_ads_batch (스레드 풀)
+    packed  classify_ads_batch(pack=True) (여러 광고를 한 요청으로 묶음)
+    async   classify_ads_async (하나의 이벤트 루프)
+
+결과 캐시/규칙 기반 분류/유사 광고 재사용/중복 제거는 끄고 측정합니다. (모든 광고가 Gemini 요청 경로를 거침)
+
+실행:
+    python -m bench.throughput --ads 500 --latency-ms 200 --latency-dist lognormal
+    python -m bench.throughput --modes batch,async --rate-429 0.05 --truncated-rate 0.02 --output after.json
+    python -m bench.throughput --output after.json --compare before.json   # 이전 결과와 비교
+    python -m bench.throughput --output-mode compact --fenced-rate 1 --compare text.json  # 응답 형식 비교
+    python -m bench.throughput --cascade-models gemini-2.5-flash-lite,gemini-2.5-flash \
+        --invalid-rate 0.05 --invalid-model gemini-2.5-flash-lite --model-latency gemini-2.5-flash=400
+    python -m bench.throughput --modes batch --api-keys 4 --key-rpm 600 --rpm 600   # 키 수에 따른 처리량 (키당 할당량)
+
+--output의 JSON에는 측정 환경(git 커밋, Python 버전, 옵션)과 방식별 결과가 들어 있어 버전 간 비교에 사용할 수 있습니다.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import platform
+import argparse
+import tempfile
+import threading
+import subprocess
+from typing import Any, Dict, Iterator, List
+
+from bench.mock_gemini import MockGeminiServer, add_fault_arguments, fault_options
+from bench.synthetic import synthetic_ads
+
+OUTPUT_MODES = ("text", "schema", "compact")  # ive_classifier.core.OUTPUT_MODES (측정 프로세스 밖에서는 core를 불러오지 않음)
+
+MODES = ("single", "batch", "packed", "async")
+AD_COLUMNS = ["ads_idx", "ads_code", "ads_name", "ads_summary", "ads_guide", "ads_limit", "ads_reward_price",
+              "ads_age_min", "ads_age_max", "ads_sdate", "ads_edate", "ad_type", "ad_type_category"]
+# 비교할 때 보여 줄 지표와 값이 커지는 쪽이 좋은지 여부
+COMPARE_METRICS = (("ads_per_s", True), ("latency_p50_ms", False), ("latency_p95_ms", False),
+                   ("latency_p99_ms", False), ("parse_failure_rate", False), ("tokens_per_ad", False),
+                   ("output_tokens_per_ad", False), ("invalid_results", False), ("requests_per_ad", False), ("peak_rss_mb", False))
+
+
+def write_synthetic_csv(path: str, count: int, seed: int = 0) -> None:
+    """입력 폼과 같은 컬럼의 합성 광고 CSV를 만듭니다."""
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=AD_COLUMNS)
+        writer.writeheader()
+        writer.writerows(synthetic_ads(count, seed))
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """정렬된 값의 q 분위수 (선형 보간)"""
+    if not sorted_values:
+        return 0.0
+    pos = (len(sorted_values) - 1) * q
+    lower = int(pos)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (pos - lower)
+
+
+def peak_rss_mb() -> float:
+    """현재 프로세스의 최대 RSS(MB). resource 모듈이 없는 환경(Windows)에서는 0을 반환합니다."""
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux는 KB, macOS는 바이트 단위
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+# =========================================================
+# 측정 프로세스 (방식 하나를 실행)
+# =========================================================
+class _ParseCounter:
+    """core.parse_gemini_response를 감싸 호출 수와 실패 수를 셉니다. (묶음 요청의 조용한 재시도 포함)"""
+
+    def __init__(self, core):
+        self.calls = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._parse = core.parse_gemini_response
+        self._error = core.GeminiResponseError
+        core.parse_gemini_response = self
+
+    def __call__(self, data):
+        try:
+            result = self._parse(data)
+        except self._error:
+            with self._lock:
+                self.calls += 1
+                self.failures += 1
+            raise
+        with self._lock:
+            self.calls += 1
+        return result
+
+
+class _Timer:
+    """입력 행을 읽은 시점을 기록하고, 결과가 나오면 그 사이의 지연(ms)을 모읍니다."""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self._started: Dict[int, float] = {}
+
+    def rows(self, source: Iterator[Dict[str, str]]) -> Iterator[Dict[str, str]]:
+        for row in source:
+            self._started[id(row)] = time.perf_counter()
+            yield row
+
+    def done(self, row: Dict[str, str]) -> None:
+        started = self._started.pop(id(row), None)
+        if started is not None:
+            self.latencies.append((time.perf_counter() - started) * 1000)
+
+
+def mock_api_keys(count: int) -> str:
+    """대역 서버에 보낼 API 키 목록 (쉼표로 구분, 하나이면 mock-key)"""
+    return "mock-key" if count <= 1 else ",".join(f"mock-key-{i}" for i in range(1, count + 1))
+
+
+def run_mode(mode: str, input_csv: str, workers: int, max_in_flight: int, api_key: str = "mock-key") -> Dict[str, Any]:
+    """현재 프로세스에서 방식 하나로 CSV 전체를 분류하고 측정값을 반환합니다."""
+    import requests
+    from ive_classifier import core
+
+    options = {"use_cache": False, "use_rules": False, "use_near_duplicates": False}
+    parses = _ParseCounter(core)
+    timer = _Timer()
+    failed = 0
+    invalid = 0  # 최종 결과 중 검증(validate_classification)에 걸리는 결과 수
+
+    def accept(row: Dict[str, str], result: Dict[str, Any]) -> None:
+        nonlocal invalid
+        invalid += bool(core.validate_classification(result, row))
+        writer.write(result)
+
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix="ive-bench-out-") as out_dir, \
+            core.ResultWriter(os.path.join(out_dir, "json_total.csv")) as writer:
+        if mode == "single":
+            for row in timer.rows(core.iter_ads_csv(input_csv)):
+                try:
+                    result = core.classify_ad(row, api_key, **options)
+                except (core.GeminiError, requests.RequestException):
+                    result = None
+                timer.done(row)
+                if result is None:
+                    failed += 1
+                else:
+                    accept(row, result)
+        elif mode in ("batch", "packed"):
+            for row, result in core.classify_ads_batch(timer.rows(core.iter_ads_csv(input_csv)), api_key,
+                                                       max_workers=workers, max_in_flight=max_in_flight,
+                                                       dedupe=False, pack=mode == "packed", **options):
+                timer.done(row)
+                if result is None:
+                    failed += 1
+                else:
+                    accept(row, result)
+        elif mode == "async":
+            import asyncio
+
+            async def classify_all() -> int:
+                failures = 0
+                async for row, result in core.classify_ads_async(timer.rows(core.iter_ads_csv(input_csv)), api_key,
+                                                                 max_in_flight=max_in_flight, dedupe=False,
+                                                                 **options):
+                    timer.done(row)
+                    if result is None:
+                        failures += 1
+                    else:
+                        accept(row, result)
+                await core.close_async_http_session()
+                return failures
+
+            failed = asyncio.run(classify_all())
+        else:
+            raise ValueError(f"알 수 없는 방식: {mode}")
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(timer.latencies)
+    metrics = core.get_metrics().summary()
+    return {
+        "mode": mode,
+        "ads": len(latencies),
+        "failed": failed,
+        "elapsed_s": round(elapsed, 3),
+        "ads_per_s": round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+        "latency_p50_ms": round(percentile(latencies, 0.50), 1),
+        "latency_p95_ms": round(percentile(latencies, 0.95), 1),
+        "latency_p99_ms": round(percentile(latencies, 0.99), 1),
+        "parse_calls": parses.calls,
+        "parse_failures": parses.failures,
+        "parse_failure_rate": round(parses.failures / parses.calls, 4) if parses.calls else 0.0,
+        "invalid_results": invalid,
+        "tokens_per_ad": round(metrics["tokens"]["total"] / len(latencies), 1) if latencies else 0.0,
+        "output_tokens_per_ad": round(metrics["tokens"]["candidates"] / len(latencies), 1) if latencies else 0.0,
+        "cost_per_ad_usd": round(metrics["cost_usd"] / len(latencies), 8) if latencies else 0.0,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        # 모델 단계(cascade)별 호출 결과, 지연, 비용
+        "tiers": {model: {**{key: tier[key] for key in ("accepted", "escalated", "invalid", "failed", "cost_usd")},
+                          "p50_ms": tier["latency"]["p50_ms"], "p95_ms": tier["latency"]["p95_ms"]}
+                  for model, tier in metrics["tiers"].items()},
+    }
+
+
+# =========================================================
+# 측정 실행과 결과 비교
+# =========================================================
+def _git_revision() -> str:
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def measure(server: MockGeminiServer,
+            mode: str,
+            input_csv: str,
+            work_dir: str,
+            args: argparse.Namespace) -> Dict[str, Any]:
+    """방식 하나를 새 프로세스에서 실행하고, 대역 서버가 받은 요청 통계를 더해 반환합니다."""
+    env = dict(os.environ,
+               GEMINI_API_BASE=server.base_url,
+               IVE_CACHE_PATH=os.path.join(work_dir, "cache.sqlite3"),
+               IVE_NEAR_DUP_PATH=os.path.join(work_dir, "near_duplicates.sqlite3"),
+               IVE_JOBS_DIR=os.path.join(work_dir, "jobs"))
+    if args.max_retries is not None:
+        env["GEMINI_MAX_RETRIES"] = str(args.max_retries)
+    if args.output_mode is not None:
+        env["GEMINI_OUTPUT_MODE"] = args.output_mode
+    if args.cascade_models is not None:
+        env["GEMINI_CASCADE_MODELS"] = args.cascade_models
+    if args.rpm is not None:
+        env["GEMINI_RPM"] = str(args.rpm)
+    command = [sys.executable, "-m", "bench.throughput", "--run-mode", mode, "--input", input_csv,
+               "--workers", str(args.workers), "--max-in-flight", str(args.max_in_flight),
+               "--api-keys", str(args.api_keys)]
+    if args.retry_base_delay is not None:
+        command += ["--retry-base-delay", str(args.retry_base_delay)]
+
+    server.reset_stats()
+    proc = subprocess.run(command, env=env, capture_output=True, text=True,
+                          cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    if proc.returncode != 0:
+        raise RuntimeError(f"{mode} 측정 실패:\n{proc.stderr}")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    stats = server.stats()
+    result["gemini_requests"] = stats["generate_requests"]
+    result["requests_per_s"] = round(stats["generate_requests"] / result["elapsed_s"], 2) if result["elapsed_s"] else 0.0
+    # 광고당 요청 수: 1보다 큰 만큼이 재시도(429/500, 해석 실패로 인한 개별 재요청)
+    result["requests_per_ad"] = round(stats["generate_requests"] / result["ads"], 3) if result["ads"] else 0.0
+    result["errors_429"] = stats["errors_429"]
+    result["errors_500"] = stats["errors_500"]
+    result["truncated_responses"] = stats["truncated_responses"]
+    result["invalid_responses"] = stats["invalid_responses"]
+    result["errors_403"] = stats["errors_403"]
+    result["requests_by_model"] = stats["requests_by_model"]
+    result["requests_by_key"] = stats["requests_by_key"]
+    return result
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any]) -> List[str]:
+    """기준 결과 파일과 방식별 지표를 비교한 표의 줄 목록을 반환합니다."""
+    before = {r["mode"]: r for r in baseline.get("results", [])}
+    lines = [f"기준: {baseline.get('environment', {}).get('git', '?')}",
+             f"{'mode':<7} {'metric':<19} {'before':>10} {'after':>10} {'change':>8}"]
+    for result in results:
+        old = before.get(result["mode"])
+        if old is None:
+            continue
+        for metric, higher_is_better in COMPARE_METRICS:
+            a, b = old.get(metric), result.get(metric)
+            if a is None or b is None:
+                continue
+            change = (b - a) / a * 100 if a else 0.0
+            worse = change < 0 if higher_is_better else change > 0
+            mark = " !" if worse and abs(change) >= 10 else ""
+            lines.append(f"{result['mode']:<7} {metric:<19} {a:>10} {b:>10} {change:>+7.1f}%{mark}")
+    return lines
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="분류 방식별 처리량/지연/메모리 측정")
+    parser.add_argument("--modes", default=",".join(MODES), help=f"측정할 방식 (쉼표로 구분, 기본값: {','.join(MODES)})")
+    parser.add_argument("--ads", type=int, default=200, help="합성 광고 수")
+    parser.add_argument("--input", help="측정에 사용할 광고 CSV (기본값: 합성 광고 CSV를 만듦)")
+    parser.add_argument("--workers", type=int, default=8, help="batch/packed 방식의 워커 스레드 수")
+    parser.add_argument("--max-in-flight", type=int, default=32, help="batch/packed/async 방식의 최대 동시 요청 수")
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="대역 서버의 요청당 평균 지연(ms)")
+    parser.add_argument("--per-kb-ms", type=float, default=0.0, help="대역 서버의 요청 본문 1KB당 추가 지연(ms)")
+    add_fault_arguments(parser)
+    parser.add_argument("--max-retries", type=int, default=None, help="GEMINI_MAX_RETRIES (기본값: 환경변수 또는 5)")
+    parser.add_argument("--retry-base-delay", type=float, default=None,
+                        help="재시도 백오프의 기본 대기 시간(초, 기본값: core.RETRY_BASE_DELAY)")
+    parser.add_argument("--output-mode", choices=OUTPUT_MODES,
+                        help="Gemini 응답 형식 GEMINI_OUTPUT_MODE (기본값: 환경변수 또는 text)")
+    parser.add_argument("--cascade-models",
+                        help="모델 cascade GEMINI_CASCADE_MODELS (쉼표로 구분, 예: gemini-2.5-flash-lite,gemini-2.5-flash)")
+    parser.add_argument("--api-keys", type=int, default=1,
+                        help="키 풀에 넣을 API 키 수 (대역 서버의 --key-rpm은 키마다 적용)")
+    parser.add_argument("--rpm", type=float, default=None, help="키 하나의 분당 요청 한도 GEMINI_RPM (기본값: 환경변수 또는 0)")
+    parser.add_argument("--output", help="결과를 JSON 파일로 저장")
+    parser.add_argument("--compare", help="이전에 저장한 결과 JSON과 비교")
+    parser.add_argument("--json", action="store_true", help="결과를 JSON으로 출력")
+    parser.add_argument("--run-mode", choices=MODES, help=argparse.SUPPRESS)  # 측정 프로세스 내부용
+    args = parser.parse_args()
+
+    if args.run_mode:
+        if args.retry_base_delay is not None:
+            from ive_classifier import core
+            core.RETRY_BASE_DELAY = args.retry_base_delay
+        print(json.dumps(run_mode(args.run_mode, args.input, args.workers, args.max_in_flight,
+                                  mock_api_keys(args.api_keys))))
+        return
+
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    unknown = [mode for mode in modes if mode not in MODES]
+    if unknown:
+        parser.error(f"알 수 없는 방식: {', '.join(unknown)}")
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="ive-bench-") as work_dir:
+        input_csv = os.path.abspath(args.input) if args.input else os.path.join(work_dir, "ads.csv")
+        if not args.input:
+            write_synthetic_csv(input_csv, args.ads)
+        with MockGeminiServer(latency_ms=args.latency_ms, per_kb_ms=args.per_kb_ms, **fault_options(args)) as server:
+            for mode in modes:
+                results.append(measure(server, mode, input_csv, work_dir, args))
+
+    report = {
+        "environment": {"git": _git_revision(), "python": platform.python_version(), "platform": platform.platform(),
+                        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z")},
+        "config": {key: value for key, value in vars(args).items()
+                   if key not in ("run_mode", "output", "compare", "json")},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print(f"{'mode':<7} {'ads':>5} {'failed':>6} {'ads/s':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+              f"{'p99 ms':>8} {'parse fail':>10} {'req/ad':>6} {'out tok/ad':>10} {'RSS MB':>7}")
+        for r in results:
+            print(f"{r['mode']:<7} {r['ads']:>5} {r['failed']:>6} {r['ads_per_s']:>8.1f} {r['requests_per_s']:>8.1f} "
+                  f"{r['latency_p50_ms']:>8.1f} {r['latency_p95_ms']:>8.1f} {r['latency_p99_ms']:>8.1f} "
+                  f"{r['parse_failure_rate']:>10.2%} {r['requests_per_ad']:>6.2f} {r['output_tokens_per_ad']:>10.1f} "
+                  f"{r['peak_rss_mb']:>7.1f}")
+
+        if any(len(r["tiers"]) > 1 for r in results):
+            print()
+            print(f"{'mode':<7} {'model':<24} {'accepted':>8} {'escalated':>9} {'invalid':>7} {'failed':>6} "
+                  f"{'p50 ms':>8} {'p95 ms':>8} {'cost USD':>10}")
+            for r in results:
+                for model, tier in r["tiers"].items():
+                    print(f"{r['mode']:<7} {model:<24} {tier['accepted']:>8} {tier['escalated']:>9} "
+                          f"{tier['invalid']:>7} {tier['failed']:>6} {tier['p50_ms']:>8.1f} {tier['p95_ms']:>8.1f} "
+                          f"{tier['cost_usd']:>10.6f}")
+
+        if any(len(r["requests_by_key"]) > 1 for r in results):
+            print()
+            print(f"{'mode':<7} {'key':<12} {'requests':>8} {'share':>6}")
+            for r in results:
+                total = sum(r["requests_by_key"].values()) or 1
+                for key, count in sorted(r["requests_by_key"].items()):
+                    print(f"{r['mode']:<7} {key:<12} {count:>8} {count / total:>6.1%}")
+
+    if baseline is not None:
+        print()
+        print("\n".join(compare(results, baseline)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+IVE 광고 분류기 (Streamlit 없이 사용할 수 있는 핵심 기능)
+
+    from ive_classifier import classify_ad, run_batch_csv
+
+    result = classify_ad(ad_data, api_key)
+    stats = run_batch_csv("ads.csv", "json_total.csv", api_key)
+
+명령줄에서는 `python -m ive_classifier classify|batch|stats`로 사용합니다.
+설정값(GEMINI_PROMPT_MODE 등)과 내부 함수는 ive_classifier.core에 있습니다.
+"""
+from ive_classifier.core import (
+    GeminiError,
+    GeminiAPIError,
+    GeminiResponseError,
+    CSV_HEADERS,
+    EXTENDED_CSV_HEADERS,
+    ClassificationResult,
+    ClassificationResultStore,
+    ResultWriter,
+    BatchJournal,
+    call_gemini_json,
+    call_gemini_json_async,
+    stream_gemini_json,
+    parse_gemini_response,
+    classify_ad,
+    classify_ad_async,
+    classify_ad_stream,
+    classify_ad_by_rules,
+    validate_classification,
+    classify_ads_packed,
+    classify_ads_batch,
+    classify_ads_async,
+    close_async_http_session,
+    run_batch_csv,
+    run_incremental_csv,
+    AdManifest,
+    iter_ads_csv,
+    write_results,
+    result_to_csv_row,
+    convert_to_csv_format,
+    get_classification_cache,
+    get_near_duplicate_index,
+    get_rate_limiter,
+    get_api_key_pool,
+    default_api_key,
+    ApiKeyPool,
+    get_gemini_single_flight,
+    get_metrics,
+    get_korean_ad_type,
+    get_korean_target_age,
+    get_korean_target_gender,
+    get_korean_categories,
+    get_korean_themes,
+    get_korean_motivation_key,
+    get_korean_engagement_key,
+    get_korean_promo_key,
+    get_korean_brand_key,
+    get_korean_commerce_key,
+    KOREAN_COLUMN_LABELS,
+    translate_column,
+)
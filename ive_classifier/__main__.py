@@ -0,0 +1,235 @@
+"""
+IVE 광고 분류 명령줄 도구 (Streamlit 없이 실행)
+
+실행:
+    python -m ive_classifier classify ad.json            # 광고 하나(또는 JSON 배열)를 분류하여 JSON 출력
+    echo '{"ads_name": "..."}' | python -m ive_classifier classify -
+    python -m ive_classifier batch ads.csv json_total.csv --workers 8 --pack --job-id 2024-06
+    python -m ive_classifier batch ads.csv json_total.csv --incremental   # 새 광고/바뀐 광고만 다시 분류
+    python -m ive_classifier batch feed.csv json_total.parquet --ordered   # 입력 순서대로 기록 (메모리 사용량은 행 수와 무관)
+    python -m ive_classifier stats
+    python -m ive_classifier serve --port 8080 --processes 4   # HTTP 분류 서비스 (ive_classifier.server)
+
+API 키는 --api-key 또는 GEMINI_API_KEY 환경변수(.env 포함)로 전달합니다.
+여러 키(프로젝트)의 할당량을 함께 쓰려면 쉼표로 구분하여 --api-key나 GEMINI_API_KEYS로 주거나,
+한 줄에 키 하나씩 적은 파일을 GEMINI_API_KEYS_FILE로 지정합니다.
+"""
+import os
+import sys
+import json
+import logging
+import argparse
+import contextlib
+from typing import Any, Dict, List
+
+import requests
+
+from ive_classifier import core
+
+
+def _api_key(args: argparse.Namespace) -> str:
+    api_key = args.api_key or core.default_api_key()
+    if not api_key:
+        raise SystemExit("GEMINI_API_KEYS/GEMINI_API_KEY 환경변수 또는 --api-key가 필요합니다.")
+    return api_key
+
+
+def _flag(enabled: bool):
+    # --no-* 옵션이 없으면 None을 넘겨 core의 환경변수 기본값을 따름
+    return None if enabled else False
+
+
+def _opt_in_flag(enabled: bool, disabled: bool):
+    # 규칙 기반 분류/유사 광고 재사용은 기본으로 꺼져 있으므로 --rules/--near-duplicates로 켜고,
+    # --no-*는 환경변수(IVE_RULE_FAST_PATH=1, IVE_NEAR_DUP=1)로 켜져 있어도 끔
+    return True if enabled else _flag(not disabled)
+
+
+def _load_ads(source: str) -> List[Dict[str, str]]:
+    """JSON 객체 하나 또는 객체 배열을 읽어 광고 목록으로 반환합니다."""
+    if source == "-":
+        data = json.load(sys.stdin)
+    else:
+        with open(source, encoding="utf-8") as f:
+            data = json.load(f)
+    ads = data if isinstance(data, list) else [data]
+    if not all(isinstance(ad, dict) for ad in ads):
+        raise SystemExit("광고는 JSON 객체 또는 객체 배열이어야 합니다.")
+    return [{key: "" if value is None else str(value) for key, value in ad.items()} for ad in ads]
+
+
+def cmd_classify(args: argparse.Namespace) -> int:
+    api_key = _api_key(args)
+    failed = 0
+    # --csv이면 헤더를 한 번만 쓰고 결과마다 한 행씩 바로 출력
+    with (core.ResultWriter(sys.stdout, "csv", batch_size=1, include_source=args.with_source) if args.csv else contextlib.nullcontext()) as writer:
+        for ad in _load_ads(args.ad):
+            try:
+                result: Dict[str, Any] = core.classify_ad(ad, api_key, use_cache=not args.no_cache,
+                                                         use_rules=_opt_in_flag(args.rules, args.no_rules),
+                                                         use_near_duplicates=_opt_in_flag(args.near_duplicates,
+                                                                                          args.no_near_duplicates))
+            except (core.GeminiError, requests.RequestException) as e:
+                print(f"분류 실패 (ads_idx={ad.get('ads_idx', '')}): {e}", file=sys.stderr)
+                failed += 1
+                continue
+            if writer is not None:
+                writer.write(result)
+            else:
+                print(json.dumps(result, ensure_ascii=False, indent=None if args.compact else 2), flush=True)
+    return 1 if failed else 0
+
+
+def cmd_batch(args: argparse.Namespace) -> int:
+    api_key = _api_key(args)
+
+    def progress(stats: Dict[str, Any]) -> None:
+        if stats["processed"] % args.progress_every == 0:
+            print(f"\r처리 {stats['processed']} / 성공 {stats['succeeded']} / 실패 {stats['failed']}",
+                  end="", file=sys.stderr, flush=True)
+
+    if args.manifest and not args.incremental:
+        raise SystemExit("--manifest는 --incremental과 함께 사용합니다.")
+    options = dict(max_workers=args.workers,
+                   max_in_flight=args.max_in_flight,
+                   use_cache=not args.no_cache,
+                   dedupe=not args.no_dedupe,
+                   pack=args.pack,
+                   output_format=args.format,
+                   progress_callback=progress if args.progress_every > 0 else None,
+                   use_rules=_opt_in_flag(args.rules, args.no_rules),
+                   use_near_duplicates=_opt_in_flag(args.near_duplicates, args.no_near_duplicates),
+                   include_source=args.with_source)
+    if args.incremental:
+        if args.job_id:
+            raise SystemExit("--incremental과 --job-id는 함께 사용할 수 없습니다. (매니페스트가 재시작을 대신함)")
+        stats = core.run_incremental_csv(args.input, args.output, api_key, manifest_path=args.manifest, **options)
+    else:
+        stats = core.run_batch_csv(args.input, args.output, api_key, job_id=args.job_id, ordered=args.ordered,
+                                   **options)
+    if args.progress_every > 0:
+        print(file=sys.stderr)
+    if args.metrics:
+        stats["metrics"] = core.get_metrics().summary()
+    print(json.dumps(stats, ensure_ascii=False, indent=2))
+    return 1 if stats["failed"] else 0
+
+
+def _completed_count(path: str) -> int:
+    # 실행 중인 작업의 저널일 수 있으므로 BatchJournal(잘린 줄 복구)로 열지 않고 읽기만 함
+    keys = set()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            (keys.discard if entry.get("failed") else keys.add)(entry.get("key", ""))  # 마지막 기록이 실패면 미완료
+    return len(keys)
+
+
+def cmd_stats(args: argparse.Namespace) -> int:
+    stats: Dict[str, Any] = {
+        "classification_cache": {"path": core.CLASSIFICATION_CACHE_PATH,
+                                 "entries": core.get_classification_cache().stats()["entries"]},
+        "near_duplicate_index": {"path": core.NEAR_DUP_PATH,
+                                 "entries": core.get_near_duplicate_index().stats()["entries"]},
+        "jobs": {},
+    }
+    if os.path.isdir(core.BATCH_JOBS_DIR):
+        for name in sorted(os.listdir(core.BATCH_JOBS_DIR)):
+            if name.endswith(".jsonl"):
+                stats["jobs"][name[:-len(".jsonl")]] = _completed_count(os.path.join(core.BATCH_JOBS_DIR, name))
+
+    if args.json:
+        print(json.dumps(stats, ensure_ascii=False, indent=2))
+        return 0
+    print(f"분류 결과 캐시   {stats['classification_cache']['entries']:>8}건  ({core.CLASSIFICATION_CACHE_PATH})")
+    print(f"유사 광고 색인   {stats['near_duplicate_index']['entries']:>8}건  ({core.NEAR_DUP_PATH})")
+    for job_id, completed in stats["jobs"].items():
+        print(f"배치 작업 {job_id:<12} 완료 {completed}건")
+    return 0
+
+
+def cmd_serve(args: argparse.Namespace) -> int:
+    from ive_classifier.server import serve
+
+    # 지정하지 않은 옵션은 server 모듈의 기본값(환경변수)을 따름
+    limits = {"max_concurrency": args.concurrency, "max_queue": args.queue,
+              "queue_timeout": args.queue_timeout, "batch_workers": args.batch_workers}
+    serve(args.host, args.port, processes=args.processes, api_key=_api_key(args),
+          **{name: value for name, value in limits.items() if value is not None})
+    return 0
+
+
+def _add_classify_options(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--api-key", help="Gemini API 키, 여럿이면 쉼표로 구분 (기본값: GEMINI_API_KEYS/GEMINI_API_KEY 환경변수)")
+    parser.add_argument("--no-cache", action="store_true", help="분류 결과 캐시를 사용하지 않음")
+    rules = parser.add_mutually_exclusive_group()
+    rules.add_argument("--rules", action="store_true",
+                       help="신뢰도가 충분한 광고는 Gemini 없이 규칙 기반으로 분류 (기본값: IVE_RULE_FAST_PATH, 꺼짐)")
+    rules.add_argument("--no-rules", action="store_true", help="규칙 기반 빠른 분류를 사용하지 않음")
+    near_duplicates = parser.add_mutually_exclusive_group()
+    near_duplicates.add_argument("--near-duplicates", action="store_true",
+                                 help="텍스트가 거의 같은 광고의 이전 결과를 재사용 (기본값: IVE_NEAR_DUP, 꺼짐)")
+    near_duplicates.add_argument("--no-near-duplicates", action="store_true", help="유사 광고 결과를 재사용하지 않음")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m ive_classifier", description="IVE 광고 분류기")
+    parser.add_argument("-v", "--verbose", action="store_true", help="실패한 요청 등 경고 로그 출력")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    classify = commands.add_parser("classify", help="광고 JSON을 분류하여 결과 JSON 출력")
+    classify.add_argument("ad", nargs="?", default="-", help="광고 JSON 파일 (객체 또는 배열, 기본값: 표준 입력)")
+    classify.add_argument("--compact", action="store_true", help="결과를 한 줄 JSON으로 출력")
+    classify.add_argument("--csv", action="store_true", help="json_total.csv 컬럼 형식으로 출력")
+    classify.add_argument("--with-source", action="store_true",
+                          help="--csv 출력 마지막에 classification_source, confidence 열을 추가")
+    _add_classify_options(classify)
+    classify.set_defaults(func=cmd_classify)
+
+    batch = commands.add_parser("batch", help="입력 CSV를 분류하여 json_total.csv 형식으로 저장")
+    batch.add_argument("input", help="입력 CSV 경로")
+    batch.add_argument("output", help="출력 경로 (.csv / .parquet / .arrow)")
+    batch.add_argument("--workers", type=int, default=8, help="동시에 실행할 워커 스레드 수")
+    batch.add_argument("--max-in-flight", type=int, default=None, help="동시에 진행할 최대 요청 수")
+    batch.add_argument("--pack", action="store_true", help="여러 광고를 한 요청으로 묶어 분류")
+    batch.add_argument("--no-dedupe", action="store_true", help="같은 광고를 한 번만 분류하는 중복 제거를 끔")
+    batch.add_argument("--job-id", help="작업 ID (같은 ID로 다시 실행하면 완료된 광고는 건너뜀)")
+    batch.add_argument("--incremental", action="store_true",
+                       help="매니페스트와 비교하여 새 광고와 바뀐 광고만 분류하고 기존 결과와 합쳐 저장")
+    batch.add_argument("--manifest", help="증분 매니페스트 경로 (기본값: 출력 경로 + .manifest.sqlite3)")
+    batch.add_argument("--ordered", action="store_true",
+                       help="출력을 입력 행 순서대로 기록 (--incremental은 항상 입력 순서)")
+    batch.add_argument("--format", choices=core.RESULT_FORMATS, help="출력 형식 (기본값: 확장자로 판단)")
+    batch.add_argument("--with-source", action="store_true",
+                       help="json_total.csv의 43열 뒤에 classification_source, confidence 열을 추가")
+    batch.add_argument("--progress-every", type=int, default=100, help="진행 상황 출력 간격 (0이면 출력 안 함)")
+    batch.add_argument("--metrics", action="store_true", help="단계별 시간, 토큰 사용량, 예상 비용을 결과에 포함")
+    _add_classify_options(batch)
+    batch.set_defaults(func=cmd_batch)
+
+    stats = commands.add_parser("stats", help="결과 캐시, 유사 광고 색인, 배치 작업 현황 출력")
+    stats.add_argument("--json", action="store_true", help="JSON으로 출력")
+    stats.set_defaults(func=cmd_stats)
+
+    serve = commands.add_parser("serve", help="분류 HTTP 서비스 실행 (POST /classify, /classify/batch)")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8080)
+    serve.add_argument("--processes", type=int, default=1, help="작업 프로세스 수 (같은 포트를 나눠 받음)")
+    serve.add_argument("--concurrency", type=int, default=None, help="프로세스당 동시에 처리할 요청 수")
+    serve.add_argument("--queue", type=int, default=None, help="차례를 기다릴 수 있는 요청 수 (넘으면 503)")
+    serve.add_argument("--queue-timeout", type=float, default=None, help="차례를 기다리는 최대 시간(초)")
+    serve.add_argument("--batch-workers", type=int, default=None, help="묶음 요청 하나를 처리하는 스레드 수")
+    serve.add_argument("--api-key", help="Gemini API 키, 여럿이면 쉼표로 구분 (기본값: GEMINI_API_KEYS/GEMINI_API_KEY 환경변수)")
+    serve.set_defaults(func=cmd_serve)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING if args.verbose else logging.ERROR,
+                        format="%(levelname)s %(message)s")
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,4534 @@
+"""
+IVE 광고 분류 핵심 모듈 (Streamlit 없이 사용)
+
+프롬프트, Gemini 클라이언트, 응답 해석, 결과 캐시, 배치 분류, 한국어 라벨 변환, CSV 변환을 담고 있습니다.
+화면(app.py), 명령줄(python -m ive_classifier), 배치 워커가 모두 이 모듈을 사용합니다.
+오류는 화면에 출력하지 않고 예외(GeminiError)나 배치 통계(stats["failed"])로 알려 줍니다.
+numpy(유사 광고 색인, 압축 결과)와 aiohttp(비동기 API)는 처음 사용할 때 불러오므로,
+광고 하나를 분류하는 워커는 requests만큼의 시작 비용만 듭니다.
+"""
+import os
+import sys
+import io
+import csv
+import copy
+import json
+import time
+import random
+import re
+import zlib
+import logging
+import operator
+import functools
+import itertools
+import heapq
+import bisect
+import collections
+import contextvars
+import email.utils
+import sqlite3
+import hashlib
+import unicodedata
+import weakref
+import threading
+import contextlib
+import queue
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+import requests
+import requests.adapters
+from typing import TYPE_CHECKING, Dict, Any, Optional, Union, List, Iterable, Iterator, AsyncIterator, Tuple, Callable
+from dotenv import load_dotenv
+
+if TYPE_CHECKING:
+    import asyncio
+    import aiohttp
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# =========================================================
+# 환경 변수 로드
+# =========================================================
+load_dotenv()
+
+def shared_resource(factory: Callable[[], Any]) -> Callable[[], Any]:
+    """
+    인자 없는 팩토리를 프로세스당 한 번만 실행하고 같은 객체를 돌려주도록 감쌉니다.
+    (연결 풀, 캐시 연결, 속도 제한 상태처럼 모든 스레드가 공유해야 하는 자원용)
+    .clear()를 호출하면 다음 호출 때 새로 만듭니다.
+    """
+    lock = threading.Lock()
+    instance: List[Any] = []
+
+    @functools.wraps(factory)
+    def get():
+        if not instance:
+            with lock:
+                if not instance:
+                    instance.append(factory())
+        return instance[0]
+
+    def clear() -> None:
+        with lock:
+            instance.clear()
+
+    get.clear = clear
+    return get
+
+# =========================================================
+# 분류 프롬프트 (원본과 동일)
+# =========================================================
+@shared_resource
+def create_classification_prompt() -> str:
+    return """
+1. 역할 정의
+당신은 광고 텍스트를 분석해 사전 정의된 파라미터 스키마에 따라 JSON으로 분류하는 분류기입니다.
+출력은 반드시 유효한 JSON 한 덩어리로만 반환해야 하며, 설명 문장은 notes 필드에만 기록합니다.
+
+2. 출력 스키마
+{
+  "ad_type": "",
+  "ad_type_category": [],
+  "ad_theme": [],
+  "target_age": "",
+  "target_gender": "",
+  "motivation": {
+    "fun": 0, "social": 0, "rewards": 0, "savings": 0, "trust": 0,
+    "convenience": 0, "growth": 0, "status_display": 0, "curiosity": 0,
+    "habit_building": 0, "safety_net": 0
+  },
+  "engagement": {
+    "casual_score": 0.0, "hardcore_score": 0.0, "frequency_score": 0.0,
+    "multi_app_usage": 0, "retention_potential": 0.0,
+    "session_length_expectation": "short"
+  },
+  "promo": {
+    "install_reward_sensitive": 0, "coupon_event_sensitive": 0,
+    "fomo_sensitive": 0, "exclusive_benefit_sensitive": 0,
+    "trial_experience_sensitive": 0
+  },
+  "brand": {
+    "brand_loyalty": 0.0, "nostalgia": 0, "trust_in_official": 0.0,
+    "award_proof_sensitive": 0, "local_trust_factor": 0.0,
+    "global_trust_factor": 0.0
+  },
+  "commerce": {
+    "price_sensitivity": 0.0, "premium_willingness": 0.0,
+    "transaction_frequency": 0.0, "risk_tolerance": 0.0,
+    "recurring_payment": 0, "big_purchase_intent": 0.0
+  },
+  "notes": []
+}
+
+3. 분류 규칙
+(A) 광고 유형 ad_type
+1:설치형 → 1
+2:실행형 → 2
+3:참여형 → 3
+4:클릭형 → 4
+5:페북 → 5
+6:트위터 → 6
+7:인스타 → 7
+8:노출형 → 8
+9:퀘스트 → 9
+10:유튜브 → 10
+11:네이버 → 11
+12:CPS(물건구매) → 12
+
+(B) 광고 카테고리 ad_type_category
+0: 카테고리 선택안함 → 0
+1: 앱(간편적립) → 1
+2: 경험하기(게임적립)/앱(간편적립) - cpi,cpe → 2
+3: 구독(간편적립) → 3
+4: 간편미션-퀴즈(간편적립) → 4
+5: 경험하기(게임적립) - cpa → 5
+6: 멀티보상(게임적립) → 6
+7: 금융(참여적립) → 7
+8: 무료참여(참여적립) → 8
+10: 유료참여(참여적립) → 10
+11: 쇼핑-상품별카테고리(쇼핑적립) → 11
+12: 제휴몰(쇼핑적립) → 12
+13: 간편미션(간편적립) → 13
+`
+(C) 광고 테마 ad_theme
+서사·정서·소구 포인트 태깅, 복수 가능
+예: 판타지 RPG → fantasy, competition, growth
+예: 보험 → trust, safety_net, security_privacy
+예: 리워드 → rewards, savings_benefit, urgency
+
+(D) 연령 target_age
+명시 있으면 그대로 반영 (예: 13~18세 → teens)
+단서 없으면 → all_ages
+보험, 금융 → 기본 thirties 이상 추정 가능
+
+(E) 성별 target_gender
+명시 없으면 기본 neutral
+여성용 뷰티/패션 강조 → female_focus
+남성 전용 서비스(면도, 밀리터리) → male_focus
+
+4. 파라미터 값 판정 기준
+핵심 원칙: 명시적 키워드가 없더라도, 광고 유형(ad_type)과 문맥을 바탕으로 관련성이 높은 항목에 대해서는 0 대신 합리적인 기본 점수(예: 0.2~0.5)를 적극적으로 부여한다.
+
+Motivation
+- rewards: '적립', '보상' 언급 시 1. 'shopping', 'game' 유형 광고는 문맥상 암시만 있어도 0.3 이상 추론.
+- savings: '할인', '최저가' 언급 시 1. 'shopping' 유형 광고는 가격 소구 가능성이 높으므로 기본 0.3 이상 추론.
+- fun: 'game' 광고는 명시적 단어 없어도 기본 0.7 이상 부여. 엔터테인먼트, 'content' 유형도 0.3 이상 추론.
+- trust: 'finance', 'healthcare' 광고는 신뢰가 중요하므로 기본 0.5 이상 부여. '공식', '인증' 등 언급 시 1.
+- growth: 'education', 'game'(특히 RPG) 유형은 성장 요소가 내재되어 있으므로 기본 0.4 이상 추론.
+- curiosity: '무료 체험', '새로운 기능' 등 언급 시 1. 신규 앱/서비스 광고는 호기심 유발 가능성이 높으므로 0.2 이상 추론.
+
+Commerce
+- price_sensitivity: 'shopping' 광고는 대부분 가격에 민감한 사용자를 타겟하므로 기본 0.6 이상 부여. '최저가', '할인' 강조 시 0.9 이상.
+- risk_tolerance: 'finance' 중 투자, 가상화폐 관련 광고는 리스크 감수 성향이 중요하므로 0.8 이상 부여. '보험'은 리스크 회피이므로 이 항목은 0.1 이하로 유지.
+- big_purchase_intent: 'finance'(대출, 보험), 'real_estate' 등 고가 상품/서비스는 0.7 이상 부여.
+
+Brand
+- brand_loyalty, trust_in_official: '아모레퍼시픽', '삼성' 등 대중에게 알려진 기업/브랜드 이름이 언급되면, '유명 브랜드'라는 직접적 표현이 없어도 0.5 이상 부여. 'finance' 유형은 기본 0.3 이상 추론.
+- local_trust_factor: 광고 주체가 국내 기업으로 명확히 인지되면 1 부여.
+
+5. 출력 규칙
+항상 JSON만 출력 (추가 설명 금지).
+notes 필드에 분류 근거 키워드를 짧게 기록.
+가장 중요한 것은 문맥을 파악하여 0으로 비워두기보다, 관련성이 조금이라도 있다면 적극적으로 값을 추론해 채우는 것이다.
+
+6. 사용자 지정 정보 활용
+- "사용자 지정 광고 유형"이 제공된 경우, 해당 값을 ad_type으로 사용하되 문맥상 부적절하면 재분류
+- "사용자 지정 광고 카테고리"가 제공된 경우, 해당 값을 ad_type_category에 포함
+- 사용자 지정 정보가 없으면 광고 텍스트를 바탕으로 자동 분류
+
+다음 광고 텍스트를 분석하여 위 스키마에 맞는 JSON을 반환하세요:
+""".strip()
+
+# =========================================================
+# 요청 속도 제한 (토큰 버킷, 재시도, 동시성 조절)
+# =========================================================
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "0"))             # 분당 요청 수 한도, 0이면 제한 없음
+GEMINI_TPM = float(os.getenv("GEMINI_TPM", "0"))             # 분당 입력 토큰 한도, 0이면 제한 없음
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "5"))
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+THROTTLE_STATUS_CODES = (429, 503)                           # 할당량/과부하 신호로 보는 상태 코드
+RETRY_BASE_DELAY = 1.0                                       # 초
+RETRY_MAX_DELAY = 60.0                                       # 초
+
+def estimate_tokens(text: str) -> int:
+    """토큰 수를 보수적으로 추정합니다. (ASCII는 약 4자당 1토큰, 한글 등은 1자당 1토큰)"""
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return ascii_chars // 4 + (len(text) - ascii_chars) + 1
+
+def retry_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """
+    재시도 전 대기 시간(초)을 계산합니다.
+    Retry-After 헤더(초 또는 HTTP 날짜)가 있으면 따르고, 없으면 지수 백오프에 full jitter를 적용합니다.
+    """
+    if retry_after:
+        try:
+            return min(max(float(retry_after), 0.0), RETRY_MAX_DELAY * 5)
+        except ValueError:
+            try:
+                retry_at = email.utils.parsedate_to_datetime(retry_after).timestamp()
+                return min(max(retry_at - time.time(), 0.0), RETRY_MAX_DELAY * 5)
+            except (TypeError, ValueError):
+                pass
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+
+class TokenBucket:
+    """분당 허용량을 초 단위로 고르게 채우는 토큰 버킷. per_minute가 0 이하이면 제한하지 않습니다."""
+
+    def __init__(self, per_minute: float, burst: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = burst if burst is not None else max(per_minute / 6.0, 1.0)  # 기본 10초 분량까지 몰아 쓰기 허용
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def reserve(self, amount: float, now: float) -> float:
+        """amount만큼 미리 차감하고, 사용 가능해질 때까지 기다려야 하는 시간(초)을 반환합니다."""
+        if self.rate <= 0:
+            return 0.0
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= amount
+        return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+class RateLimiter:
+    """
+    API 키 하나에 대해 모든 워커가 공유하는 Gemini 요청 속도 제한기입니다.
+    분당 요청 수(RPM)와 분당 입력 토큰 수(TPM)를 함께 지키며,
+    429 응답의 Retry-After 동안은 이 키로 보내는 모든 워커의 새 요청을 멈춥니다.
+    """
+
+    def __init__(self, rpm: float = GEMINI_RPM, tpm: float = GEMINI_TPM):
+        self._requests = TokenBucket(rpm)
+        self._tokens = TokenBucket(tpm)
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+        self.requests = 0
+        self.retries = 0
+        self.throttle_events = 0
+        self.server_errors = 0
+
+    def reserve(self, tokens: int) -> float:
+        """요청 1건과 입력 토큰을 예약하고, 보내기 전까지 기다려야 하는 시간(초)을 반환합니다."""
+        with self._lock:
+            now = time.monotonic()
+            self.requests += 1
+            wait_seconds = max(self._requests.reserve(1, now), self._tokens.reserve(tokens, now))
+            return max(wait_seconds, self._paused_until - now)
+
+    def paused_for(self, now: float) -> float:
+        """429 응답으로 멈춘 시간이 now 기준으로 얼마나 남았는지(초) 반환합니다."""
+        return max(self._paused_until - now, 0.0)
+
+    def acquire(self, tokens: int) -> None:
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self, tokens: int) -> None:
+        import asyncio
+
+        delay = self.reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def record_retry(self, status_code: int, delay: float) -> None:
+        """재시도할 응답을 기록합니다. 스로틀링 응답이면 delay 동안 모든 워커를 멈춥니다."""
+        with self._lock:
+            self.retries += 1
+            if status_code in THROTTLE_STATUS_CODES:
+                self.throttle_events += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            else:
+                self.server_errors += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "retries": self.retries,
+                "throttle_events": self.throttle_events,
+                "server_errors": self.server_errors,
+                "paused_seconds": max(self._paused_until - time.monotonic(), 0.0)
+            }
+
+class AdaptiveConcurrency:
+    """
+    관측된 스로틀링에 따라 동시 요청 수를 조절합니다 (AIMD).
+    성공할 때마다 한도를 조금씩 늘리고, 스로틀링이 관측되면 절반으로 줄입니다.
+    """
+
+    def __init__(self, maximum: int, minimum: int = 1, decrease_interval: float = 1.0):
+        self.maximum = max(maximum, 1)
+        self.minimum = max(min(minimum, self.maximum), 1)
+        self.decrease_interval = decrease_interval
+        self._limit = float(self.maximum)
+        self._last_decrease = 0.0
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def on_success(self) -> None:
+        # 한도만큼 성공하면 약 1 증가
+        self._limit = min(float(self.maximum), self._limit + 1.0 / self._limit)
+
+    def on_throttle(self) -> None:
+        # 한 번의 폭주로 여러 응답이 동시에 429를 받아도 한 번만 줄임
+        now = time.monotonic()
+        if now - self._last_decrease >= self.decrease_interval:
+            self._limit = max(float(self.minimum), self._limit / 2)
+            self._last_decrease = now
+
+    def observe(self, limiter: Union["RateLimiter", "ApiKeyPool"], seen_throttle_events: int) -> int:
+        """limiter(속도 제한기 또는 키 풀)의 스로틀링 횟수 변화를 반영하고, 새로 관측한 누적 횟수를 반환합니다."""
+        events = limiter.throttle_events
+        if events > seen_throttle_events:
+            self.on_throttle()
+        else:
+            self.on_success()
+        return events
+
+@shared_resource
+def get_rate_limiter() -> RateLimiter:
+    """프로세스 전체에서 공유하는 요청 속도 제한기를 반환합니다."""
+    return RateLimiter()
+
+# =========================================================
+# API 키 풀 (키별 할당량 분산)
+# =========================================================
+GEMINI_KEY_FORBIDDEN_COOLDOWN = float(os.getenv("GEMINI_KEY_FORBIDDEN_COOLDOWN", "600"))  # 403을 받은 키를 쉬게 할 시간(초)
+KEY_COOLDOWN_STATUS_CODES = (429, 403)  # 다른 키가 있으면 바로 다른 키로 다시 보내는 상태 코드
+
+def split_api_keys(api_key: str) -> Tuple[str, ...]:
+    """쉼표/공백/줄바꿈으로 구분한 API 키 목록을 나눕니다. (중복 제거, 순서 유지)"""
+    return tuple(dict.fromkeys(key for key in re.split(r"[\s,]+", api_key) if key))
+
+def default_api_key() -> str:
+    """
+    환경변수의 API 키를 반환합니다. 여러 키는 쉼표로 이어 붙이며, 모든 api_key 인자에 그대로 넘길 수 있습니다.
+    GEMINI_API_KEYS_FILE(한 줄에 키 하나, 시크릿 파일용) > GEMINI_API_KEYS(쉼표로 구분) > GEMINI_API_KEY 순으로 찾습니다.
+    """
+    keys_file = os.getenv("GEMINI_API_KEYS_FILE", "")
+    if keys_file:
+        with open(keys_file, encoding="utf-8") as f:
+            text = "\n".join(line for line in f if not line.lstrip().startswith("#"))
+    else:
+        text = os.getenv("GEMINI_API_KEYS", "") or os.getenv("GEMINI_API_KEY", "")
+    return ",".join(split_api_keys(text))
+
+def key_label(api_key: str) -> str:
+    """통계와 로그에 쓸 키 표시 (끝 4자리만 노출)"""
+    return "…" + api_key[-4:]
+
+class ApiKeyPool:
+    """
+    여러 Gemini API 키(프로젝트)에 요청을 나눠 보내는 키 풀입니다.
+    키마다 속도 제한기를 따로 두므로 GEMINI_RPM/GEMINI_TPM은 키 하나의 한도이고, 전체 한도는 키 수만큼 늘어납니다.
+    요청은 쉬는 중이 아닌 키 중 진행 중인 요청(속도 제한 대기 포함)이 가장 적은 키로 보냅니다.
+    429를 받은 키는 재시도 대기 시간만큼(연속으로 받을수록 길게), 403을 받은 키는 GEMINI_KEY_FORBIDDEN_COOLDOWN 동안 쉬게 합니다.
+    모든 키가 429로 쉬는 중이면 가장 먼저 풀리는 키를 기다리고, 403으로 쉬는 키만 남았으면 그 키로 보내 오류를 그대로 전달합니다.
+    """
+
+    def __init__(self, keys: Iterable[str], limiters: Optional[List[RateLimiter]] = None):
+        self.keys = tuple(keys)
+        if not self.keys:
+            raise ValueError("API 키가 하나 이상 필요합니다.")
+        self.limiters = limiters or [RateLimiter() for _ in self.keys]
+        self._lock = threading.Lock()
+        self._in_flight = [0] * len(self.keys)
+        self._strikes = [0] * len(self.keys)            # 연속 429 횟수 (성공하면 0)
+        self._disabled_until = [0.0] * len(self.keys)   # 403으로 쉬는 키가 풀리는 시각
+        self._responses = [collections.Counter() for _ in self.keys]
+
+    @property
+    def throttle_events(self) -> int:
+        return sum(limiter.throttle_events for limiter in self.limiters)
+
+    def _load(self, index: int, now: float) -> Tuple[bool, float, int, int]:
+        # 잠금 안에서 호출됨. 작을수록 먼저 고름: 403으로 쉬는 키는 마지막, 429로 쉬는 키는 먼저 풀리는 순, 진행 중인 요청 수, 보낸 요청 수
+        return (self._disabled_until[index] > now, self.limiters[index].paused_for(now),
+                self._in_flight[index], self.limiters[index].requests)
+
+    def checkout(self) -> int:
+        """요청을 보낼 키의 번호를 골라 진행 중으로 표시합니다. 응답을 받으면 release로 돌려줍니다."""
+        with self._lock:
+            now = time.monotonic()
+            index = min(range(len(self.keys)), key=lambda i: self._load(i, now))
+            self._in_flight[index] += 1
+            return index
+
+    def release(self, index: int, status_code: Optional[int] = None) -> None:
+        """
+        checkout한 키를 돌려주고 응답 상태를 기록합니다. 403이면 키를 쉬게 합니다.
+        status_code가 None이면(요청 실패, 컨텍스트 캐시 만료 등) 키 상태에 반영하지 않습니다.
+        """
+        with self._lock:
+            self._in_flight[index] -= 1
+            if status_code is None:
+                return
+            counts = self._responses[index]
+            if status_code == 200:
+                counts["ok"] += 1
+                self._strikes[index] = 0
+                self._disabled_until[index] = 0.0
+            elif status_code == 429:
+                counts["throttled"] += 1
+                # 이미 쉬는 중에 도착한 429(함께 보낸 요청들)는 한 번으로 셈
+                if self.limiters[index].paused_for(time.monotonic()) <= 0:
+                    self._strikes[index] += 1
+            elif status_code == 403:
+                counts["forbidden"] += 1
+                self._disabled_until[index] = time.monotonic() + GEMINI_KEY_FORBIDDEN_COOLDOWN
+                logger.warning("Gemini API 키 %s가 403을 반환하여 %.0f초 동안 사용하지 않습니다.",
+                               key_label(self.keys[index]), GEMINI_KEY_FORBIDDEN_COOLDOWN)
+            else:
+                counts["errors"] += 1
+
+    def cooldown(self, index: int, delay: float) -> float:
+        """
+        429를 받은 키를 쉬게 할 시간(초)을 반환합니다. 키가 하나이면 재시도 대기 시간(delay) 그대로이고,
+        여러 개이면 다른 키로 요청이 몰리는 동안 같은 키를 바로 다시 쓰지 않도록 연속 429 횟수만큼 늘립니다.
+        """
+        if len(self.keys) == 1:
+            return delay
+        with self._lock:
+            strikes = self._strikes[index]
+        return max(delay, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** max(strikes - 1, 0))))
+
+    def has_alternative(self, index: int) -> bool:
+        """index 말고 지금 바로 보낼 수 있는(쉬는 중이 아닌) 키가 있는지 반환합니다."""
+        with self._lock:
+            now = time.monotonic()
+            return any(i != index and self._disabled_until[i] <= now and self.limiters[i].paused_for(now) <= 0
+                       for i in range(len(self.keys)))
+
+    def stats(self) -> Dict[str, Any]:
+        """키별 통계와, RateLimiter.stats()와 같은 형식의 전체 합계를 반환합니다."""
+        limiter_stats = [limiter.stats() for limiter in self.limiters]
+        with self._lock:
+            now = time.monotonic()
+            keys = [
+                {"key": key_label(key),
+                 "in_flight": self._in_flight[i],
+                 "requests": limiter_stats[i]["requests"],
+                 **{name: self._responses[i][name] for name in ("ok", "throttled", "forbidden", "errors")},
+                 "cooldown_seconds": round(max(limiter_stats[i]["paused_seconds"], self._disabled_until[i] - now, 0.0), 1),
+                 "disabled": self._disabled_until[i] > now}
+                for i, key in enumerate(self.keys)
+            ]
+        totals = {name: sum(stats[name] for stats in limiter_stats)
+                  for name in ("requests", "retries", "throttle_events", "server_errors")}
+        return {**totals, "paused_seconds": min(stats["paused_seconds"] for stats in limiter_stats), "keys": keys}
+
+@shared_resource
+def _api_key_pools() -> Tuple[Dict[Tuple[str, ...], ApiKeyPool], threading.Lock]:
+    """(키 목록) -> 키 풀 표와 그 잠금"""
+    return {}, threading.Lock()
+
+def get_api_key_pool(api_key: str) -> ApiKeyPool:
+    """
+    api_key(쉼표로 구분한 여러 키 가능)에 대한 프로세스 공유 키 풀을 반환합니다.
+    키가 하나이면 공유 속도 제한기(get_rate_limiter)를 그대로 사용합니다.
+    """
+    keys = split_api_keys(api_key) or (api_key,)
+    pools, lock = _api_key_pools()
+    with lock:
+        pool = pools.get(keys)
+        if pool is None:
+            pool = pools[keys] = ApiKeyPool(keys, [get_rate_limiter()] if len(keys) == 1 else None)
+        return pool
+
+# =========================================================
+# 단계별 계측과 토큰 사용량
+# =========================================================
+METRICS_PATH = os.getenv("IVE_METRICS_PATH", "")  # 설정하면 분류한 광고마다 한 줄씩 JSONL로 기록
+GEMINI_INPUT_PRICE_PER_M = float(os.getenv("GEMINI_INPUT_PRICE_PER_M", "0.10"))    # USD / 입력 100만 토큰
+GEMINI_OUTPUT_PRICE_PER_M = float(os.getenv("GEMINI_OUTPUT_PRICE_PER_M", "0.40"))  # USD / 출력 100만 토큰 (thinking 포함)
+# 상위 모델의 (입력, 출력) 100만 토큰당 가격. 표에 없는 모델(기본 모델 포함)은 위의 GEMINI_*_PRICE_PER_M을 사용
+GEMINI_MODEL_PRICES: Dict[str, Tuple[float, float]] = {
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-pro": (1.25, 10.00),
+}
+# http_wait는 응답(스트리밍이면 헤더)을 받을 때까지, stream_read는 스트리밍 응답 조각을 기다린 시간의 합
+METRIC_STAGES = ("prompt_build", "rate_limit_wait", "http_wait", "stream_read", "retry_backoff", "json_parse", "flatten")
+METRIC_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)  # 초
+METRIC_RECENT = 2048   # 분위수 계산에 사용하는 최근 관측값 수
+METRIC_SLOWEST = 20    # 보관할 가장 느린 광고 수
+# parse_gemini_response 결과: 바로 해석 / 잘린 배열에서 완성된 원소만 사용 / 중괄호 범위만 잘라 해석 / 실패
+PARSE_OUTCOMES = ("direct", "salvaged", "sliced", "failed")
+# usageMetadata 필드 -> 지표 이름
+USAGE_FIELDS = (("promptTokenCount", "prompt"), ("candidatesTokenCount", "candidates"),
+                ("thoughtsTokenCount", "thoughts"), ("cachedContentTokenCount", "cached"),
+                ("totalTokenCount", "total"))
+# 모델 단계(cascade)별 호출 결과: 검증 통과 / 다음 모델로 넘김 / 마지막 모델이라 검증 실패에도 사용 / 마지막 모델도 해석 실패
+TIER_OUTCOMES = ("accepted", "escalated", "invalid", "failed")
+
+def usage_cost(usage: Dict[str, int], model: Optional[str] = None) -> float:
+    """토큰 사용량의 예상 비용(USD). 컨텍스트 캐시 할인은 반영하지 않습니다."""
+    input_price, output_price = GEMINI_MODEL_PRICES.get(model or "", (GEMINI_INPUT_PRICE_PER_M,
+                                                                      GEMINI_OUTPUT_PRICE_PER_M))
+    output_tokens = usage.get("candidates", 0) + usage.get("thoughts", 0)
+    return (usage.get("prompt", 0) * input_price + output_tokens * output_price) / 1_000_000
+
+class _Histogram:
+    """Prometheus 히스토그램(누적 구간별 개수)과 분위수 계산용 최근 관측값"""
+
+    def __init__(self):
+        self.buckets = [0] * len(METRIC_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.recent: "collections.deque[float]" = collections.deque(maxlen=METRIC_RECENT)
+
+    def observe(self, seconds: float, count: int = 1) -> None:
+        """count개 항목을 처리하는 데 걸린 시간을 기록합니다. (항목당 seconds / count로 집계)"""
+        each = seconds / count
+        i = bisect.bisect_left(METRIC_BUCKETS, each)
+        if i < len(self.buckets):
+            self.buckets[i] += count
+        self.count += count
+        self.sum += seconds
+        self.max = max(self.max, each)
+        self.recent.append(each)
+
+    def summary(self) -> Dict[str, Any]:
+        recent = sorted(self.recent)
+
+        def quantile(q: float) -> float:
+            return recent[min(int(q * len(recent)), len(recent) - 1)] * 1000 if recent else 0.0
+
+        return {"count": self.count,
+                "mean_ms": round(self.sum / self.count * 1000, 2) if self.count else 0.0,
+                "p50_ms": round(quantile(0.50), 2),
+                "p95_ms": round(quantile(0.95), 2),
+                "max_ms": round(self.max * 1000, 2)}
+
+class AdTrace:
+    """광고 한 건을 분류하는 동안의 단계별 시간, 토큰 사용량, 응답 해석 결과"""
+
+    def __init__(self, ad_data: Dict[str, str]):
+        self.ads_idx = ad_data.get("ads_idx", "")
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.usage: Dict[str, int] = {}
+        self.cost = 0.0
+        self.parse: Optional[str] = None
+        self.model: Optional[str] = None   # 결과를 만든 모델 (cascade 단계)
+        self.escalations = 0
+        self.source: Optional[str] = None
+        self.error: Optional[str] = None
+        self._finished = False
+
+    def done(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """분류 결과의 출처를 기록하고 결과를 그대로 반환합니다."""
+        self.source = self.source or result.get("classification_source")
+        return result
+
+    def finish(self) -> None:
+        if not self._finished:
+            self._finished = True
+            get_metrics().record_ad(self, time.perf_counter() - self.started)
+
+_current_trace: "contextvars.ContextVar[Optional[AdTrace]]" = contextvars.ContextVar("ive_ad_trace", default=None)
+
+@contextlib.contextmanager
+def ad_trace(ad_data: Dict[str, str]) -> Iterator[AdTrace]:
+    """
+    이 블록 안(같은 스레드 또는 asyncio 작업)에서 기록되는 단계 시간과 토큰 사용량을 광고 한 건의 기록으로 모읍니다.
+    블록이 끝나면 지표에 반영하고, IVE_METRICS_PATH가 있으면 JSONL 한 줄을 씁니다.
+    """
+    trace = AdTrace(ad_data)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    except Exception as e:
+        trace.error = type(e).__name__
+        raise
+    finally:
+        _current_trace.reset(token)
+        trace.finish()
+
+def _traced(trace: AdTrace, iterator: Iterator[Any]) -> Iterator[Any]:
+    # 제너레이터는 호출한 쪽의 컨텍스트에서 실행되므로, 다음 값을 만드는 동안에만 trace를 현재 기록으로 둠
+    try:
+        while True:
+            token = _current_trace.set(trace)
+            try:
+                item = next(iterator, _MISSING)
+            finally:
+                _current_trace.reset(token)
+            if item is _MISSING:
+                return
+            yield item
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            close()
+
+def record_stage(stage: str, seconds: float, count: int = 1) -> None:
+    """단계 소요 시간을 지표와 현재 광고 기록(있으면)에 더합니다."""
+    get_metrics().observe_stage(stage, seconds, count)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.stages[stage] = trace.stages.get(stage, 0.0) + seconds
+
+@contextlib.contextmanager
+def measure_stage(stage: str) -> Iterator[None]:
+    """with 블록의 실행 시간을 stage 단계로 기록합니다."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+def record_usage(usage_metadata: Optional[Dict[str, Any]], model: Optional[str] = None) -> None:
+    """Gemini 응답의 usageMetadata(토큰 수)를 지표와 현재 광고 기록에 더합니다."""
+    if not usage_metadata:
+        return
+    usage = {name: int(usage_metadata.get(field, 0) or 0) for field, name in USAGE_FIELDS}
+    get_metrics().add_usage(usage, model)
+    trace = _current_trace.get()
+    if trace is not None:
+        for name, value in usage.items():
+            trace.usage[name] = trace.usage.get(name, 0) + value
+        trace.cost += usage_cost(usage, model)
+
+def record_parse(outcome: str) -> None:
+    get_metrics().count_parse(outcome)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.parse = outcome
+
+def record_tier(model: str, seconds: float, outcome: str) -> None:
+    """모델 단계 하나의 호출 시간과 결과(TIER_OUTCOMES)를 지표와 현재 광고 기록에 남깁니다."""
+    get_metrics().observe_tier(model, seconds, outcome)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.model = model
+        trace.escalations += outcome == "escalated"
+
+class ClassificationMetrics:
+    """
+    프로세스 전체의 분류 지표: 단계별 시간 히스토그램, 광고 출처별 수, 토큰 사용량과 예상 비용,
+    응답 해석 결과(대체 해석 빈도), 모델 단계별 호출 수/시간/비용, 가장 느린 광고 목록.
+    summary()는 화면/통계용 dict, prometheus_text()는 Prometheus 텍스트 형식을 반환합니다.
+    """
+
+    def __init__(self, path: str = METRICS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stages = {stage: _Histogram() for stage in METRIC_STAGES}
+            self.ad_latency = _Histogram()
+            self.ads: Dict[str, int] = {}
+            self.ad_errors = 0
+            self.gemini_responses = 0
+            self.tokens = {name: 0 for _, name in USAGE_FIELDS}
+            self.model_tokens: Dict[str, Dict[str, int]] = {}  # 모델별 토큰 (비용 계산용)
+            self.tiers: Dict[str, Dict[str, Any]] = {}          # 모델 -> 단계 결과별 수와 호출 시간
+            self.parse_outcomes = {outcome: 0 for outcome in PARSE_OUTCOMES}
+            self._slowest: List[Tuple[float, int, Dict[str, Any]]] = []  # 최소 힙: (소요 시간, 순번, 기록)
+            self._sequence = 0
+
+    def observe_stage(self, stage: str, seconds: float, count: int = 1) -> None:
+        with self._lock:
+            self.stages[stage].observe(seconds, count)
+
+    def add_usage(self, usage: Dict[str, int], model: Optional[str] = None) -> None:
+        with self._lock:
+            self.gemini_responses += 1
+            model_tokens = self.model_tokens.setdefault(model or "", {name: 0 for _, name in USAGE_FIELDS})
+            for name, value in usage.items():
+                self.tokens[name] += value
+                model_tokens[name] += value
+
+    def observe_tier(self, model: str, seconds: float, outcome: str) -> None:
+        with self._lock:
+            tier = self.tiers.get(model)
+            if tier is None:
+                tier = self.tiers[model] = {"outcomes": {name: 0 for name in TIER_OUTCOMES}, "latency": _Histogram()}
+            tier["outcomes"][outcome] += 1
+            tier["latency"].observe(seconds)
+
+    def _cost(self) -> float:
+        return sum(usage_cost(tokens, model) for model, tokens in self.model_tokens.items())
+
+    def count_parse(self, outcome: str) -> None:
+        with self._lock:
+            self.parse_outcomes[outcome] += 1
+
+    def count_ads(self, source: str, count: int = 1) -> None:
+        """광고 기록(AdTrace) 없이 분류된 광고 수를 더합니다. (묶음 요청, 배치의 규칙 기반 결과)"""
+        with self._lock:
+            self.ads[source] = self.ads.get(source, 0) + count
+
+    def record_ad(self, trace: AdTrace, seconds: float) -> None:
+        source = trace.source or ("error" if trace.error else "unknown")
+        record = {
+            "ts": round(time.time(), 3),
+            "ads_idx": trace.ads_idx,
+            "source": source,
+            "error": trace.error,
+            "total_ms": round(seconds * 1000, 2),
+            "stages_ms": {stage: round(value * 1000, 2) for stage, value in trace.stages.items()},
+            "tokens": trace.usage,
+            "cost_usd": round(trace.cost, 8),
+            "parse": trace.parse,
+            "model": trace.model,
+            "escalations": trace.escalations,
+        }
+        with self._lock:
+            if trace.error:
+                self.ad_errors += 1
+            else:
+                self.ads[source] = self.ads.get(source, 0) + 1
+            self.ad_latency.observe(seconds)
+            self._sequence += 1
+            entry = (seconds, self._sequence, record)
+            if len(self._slowest) < METRIC_SLOWEST:
+                heapq.heappush(self._slowest, entry)
+            elif seconds > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, entry)
+            if self.path:
+                self._write_line(record)
+
+    def _write_line(self, record: Dict[str, Any]) -> None:
+        # 잠금 안에서 호출됨. 한 줄씩 append로 기록하므로 여러 프로세스가 같은 파일에 써도 줄이 섞이지 않음
+        if self._file is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            model_ads = self.ads.get("model", 0) + self.ads.get("packed", 0)
+            cost = self._cost()
+            parsed = sum(self.parse_outcomes.values())
+            fallbacks = self.parse_outcomes["salvaged"] + self.parse_outcomes["sliced"]
+            return {
+                "ads": dict(self.ads),
+                "ad_errors": self.ad_errors,
+                "ad_latency": self.ad_latency.summary(),
+                "stages": {stage: hist.summary() for stage, hist in self.stages.items()},
+                "gemini_responses": self.gemini_responses,
+                "tokens": dict(self.tokens),
+                "cost_usd": round(cost, 6),
+                "cost_per_model_ad_usd": round(cost / model_ads, 8) if model_ads else 0.0,
+                "tokens_per_model_ad": round(self.tokens["total"] / model_ads, 1) if model_ads else 0.0,
+                "parse": dict(self.parse_outcomes),
+                "parse_fallback_rate": round(fallbacks / parsed, 4) if parsed else 0.0,
+                "parse_failure_rate": round(self.parse_outcomes["failed"] / parsed, 4) if parsed else 0.0,
+                "tiers": {
+                    model: {
+                        **tier["outcomes"],
+                        "latency": tier["latency"].summary(),
+                        "tokens": dict(self.model_tokens.get(model, {})),
+                        "cost_usd": round(usage_cost(self.model_tokens.get(model, {}), model), 6),
+                    }
+                    for model, tier in self.tiers.items()
+                },
+                "slowest": [record for _, _, record in sorted(self._slowest, reverse=True)],
+            }
+
+    def prometheus_text(self) -> str:
+        """Prometheus 텍스트 노출 형식(0.0.4)으로 지표를 반환합니다."""
+        lines: List[str] = []
+
+        def histogram(name: str, help_text: str, items: List[Tuple[str, _Histogram]]) -> None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, hist in items:
+                cumulative = 0
+                for bound, count in zip(METRIC_BUCKETS, hist.buckets):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{{labels}le="+Inf"}} {hist.count}')
+                plain = "{" + labels.rstrip(",") + "}" if labels else ""
+                lines.append(f"{name}_sum{plain} {hist.sum:.6f}")
+                lines.append(f"{name}_count{plain} {hist.count}")
+
+        def counter(name: str, help_text: str, values: List[Tuple[str, Any]]) -> None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in values:
+                lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+
+        with self._lock:
+            histogram("ive_stage_seconds", "Time spent per classification stage (per ad for flatten).",
+                      [(f'stage="{stage}",', hist) for stage, hist in self.stages.items()])
+            histogram("ive_ad_seconds", "End-to-end classify_ad latency.", [("", self.ad_latency)])
+            counter("ive_ads_total", "Classified ads by result source.",
+                    [(f'source="{source}"', count) for source, count in sorted(self.ads.items())])
+            counter("ive_ad_errors_total", "Ads that failed to classify.", [("", self.ad_errors)])
+            counter("ive_gemini_responses_total", "Gemini responses with usageMetadata.",
+                    [("", self.gemini_responses)])
+            counter("ive_gemini_tokens_total", "Gemini tokens from usageMetadata.",
+                    [(f'kind="{name}"', value) for name, value in self.tokens.items()])
+            counter("ive_gemini_cost_usd_total", "Estimated Gemini cost in USD.",
+                    [(f'model="{model}"' if model else "", f"{usage_cost(tokens, model):.8f}")
+                     for model, tokens in sorted(self.model_tokens.items())])
+            counter("ive_parse_total", "Gemini response parse outcomes.",
+                    [(f'outcome="{outcome}"', count) for outcome, count in self.parse_outcomes.items()])
+            histogram("ive_tier_seconds", "Gemini call latency per cascade model.",
+                      [(f'model="{model}",', tier["latency"]) for model, tier in sorted(self.tiers.items())])
+            counter("ive_tier_calls_total", "Cascade model calls by outcome.",
+                    [(f'model="{model}",outcome="{outcome}"', count)
+                     for model, tier in sorted(self.tiers.items()) for outcome, count in tier["outcomes"].items()])
+        return "\n".join(lines) + "\n"
+
+@shared_resource
+def get_metrics() -> ClassificationMetrics:
+    """프로세스 전체에서 공유하는 분류 지표를 반환합니다."""
+    return ClassificationMetrics()
+
+# =========================================================
+# Gemini API 호출 함수 (원본과 동일)
+# =========================================================
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta")
+GEMINI_MODEL = "gemini-2.5-flash-lite"
+GENERATION_CONFIG = {
+    "temperature": 0.1,
+    "maxOutputTokens": 2000
+}
+
+# 분류 지시문 전달 방식
+#   inline: 지시문과 광고 텍스트를 하나의 user 메시지로 전송 (기존 방식)
+#   system: 지시문을 systemInstruction으로 분리하여 전송
+#   cached: 지시문을 컨텍스트 캐시(cachedContents)에 한 번 등록하고 이름으로 참조
+PROMPT_MODES = ("inline", "system", "cached")
+GEMINI_PROMPT_MODE = os.getenv("GEMINI_PROMPT_MODE", "system")
+CONTEXT_CACHE_TTL = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL", "3600"))  # 초 단위
+
+# 연결 풀 크기 (keep-alive 연결을 재사용하여 매 요청마다 TCP+TLS 핸드셰이크를 피함)
+HTTP_POOL_SIZE = 64
+ASYNC_HTTP_POOL_SIZE = 256
+
+_async_http_sessions: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aiohttp.ClientSession]" = weakref.WeakKeyDictionary()
+
+@shared_resource
+def _context_cache_registry() -> Tuple[Dict[Tuple[str, str, str], Tuple[Optional[str], float]], threading.Lock]:
+    """(API 키 해시, 모델, 지시문 해시) -> (cachedContents 이름 또는 None, 로컬 만료 시각) 표와 그 잠금"""
+    return {}, threading.Lock()
+
+@shared_resource
+def _context_cache_flight() -> "SingleFlight":
+    """같은 지시문의 컨텍스트 캐시 등록 요청을 하나로 합침 (등록 중에도 표의 잠금은 잡지 않음)"""
+    return SingleFlight()
+
+@shared_resource
+def get_http_session() -> requests.Session:
+    """프로세스 전체에서 공유하는 keep-alive requests 세션을 반환합니다."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def get_async_http_session() -> "aiohttp.ClientSession":
+    """현재 이벤트 루프에서 공유하는 aiohttp 세션을 반환합니다."""
+    import asyncio
+    import aiohttp
+
+    loop = asyncio.get_running_loop()
+    session = _async_http_sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(limit=ASYNC_HTTP_POOL_SIZE, keepalive_timeout=60, ttl_dns_cache=300)
+        session = aiohttp.ClientSession(connector=connector)
+        _async_http_sessions[loop] = session
+    return session
+
+async def close_async_http_session() -> None:
+    """현재 이벤트 루프의 aiohttp 세션을 닫습니다. 이벤트 루프 종료 전에 호출하세요."""
+    import asyncio
+
+    session = _async_http_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
+
+class GeminiError(Exception):
+    """Gemini 요청 또는 응답 처리에 실패했습니다."""
+
+class GeminiAPIError(GeminiError):
+    """Gemini API가 200이 아닌 상태 코드를 반환했습니다. (재시도 후)"""
+
+    def __init__(self, status_code: int, message: str = ""):
+        super().__init__(f"Gemini API 오류: status={status_code}" + (f" ({message})" if message else ""))
+        self.status_code = status_code
+
+class GeminiResponseError(GeminiError):
+    """Gemini 응답에서 JSON 결과를 꺼내지 못했습니다."""
+
+def _gemini_url(model: str, method: str = "generateContent") -> str:
+    return f"{GEMINI_API_BASE}/models/{model}:{method}"
+
+def _gemini_request_body(prompt_text: str,
+                         generation_config: Optional[Dict[str, Any]] = None,
+                         system_instruction: Optional[str] = None,
+                         cached_content: Optional[str] = None) -> Dict[str, Any]:
+    body = {
+        "contents": [
+            {"role": "user", "parts": [{"text": prompt_text}]}
+        ],
+        "generationConfig": generation_config if generation_config is not None else GENERATION_CONFIG
+    }
+    if cached_content:
+        body["cachedContent"] = cached_content
+    elif system_instruction:
+        body["systemInstruction"] = {"parts": [{"text": system_instruction}]}
+    return body
+
+def _encode_body(body: Dict[str, Any]) -> bytes:
+    # 한글을 \uXXXX(6바이트)로 이스케이프하지 않고 UTF-8(3바이트)로 보내 요청 크기를 줄임
+    return json.dumps(body, ensure_ascii=False).encode("utf-8")
+
+def _input_tokens(body: Dict[str, Any]) -> int:
+    """속도 제한용 입력 토큰 추정치 (컨텍스트 캐시로 참조한 지시문은 제외)"""
+    texts = [part.get("text", "") for content in body.get("contents", []) for part in content.get("parts", [])]
+    texts += [part.get("text", "") for part in body.get("systemInstruction", {}).get("parts", [])]
+    return sum(estimate_tokens(text) for text in texts)
+
+def _context_cache_key(system_instruction: str, api_key: str, model: str) -> Tuple[str, str, str]:
+    return (hashlib.sha256(api_key.encode("utf-8")).hexdigest(),
+            model,
+            hashlib.sha256(system_instruction.encode("utf-8")).hexdigest())
+
+def get_context_cache_name(system_instruction: str,
+                           api_key: str,
+                           model: str = GEMINI_MODEL,
+                           ttl_seconds: int = CONTEXT_CACHE_TTL) -> Optional[str]:
+    """
+    분류 지시문을 Gemini 컨텍스트 캐시에 등록하고 리소스 이름(cachedContents/...)을 반환합니다.
+    등록된 이름은 만료 직전까지 재사용합니다. 등록에 실패하면 None을 반환하며,
+    이 경우 호출자는 systemInstruction으로 지시문을 직접 전송합니다.
+    등록 요청은 같은 키끼리 하나로 합치고, 그동안 다른 키의 조회/등록은 기다리지 않습니다.
+    """
+    key = _context_cache_key(system_instruction, api_key, model)
+    context_caches, lock = _context_cache_registry()
+
+    def cached() -> Tuple[bool, Optional[str]]:
+        with lock:
+            entry = context_caches.get(key)
+        return (True, entry[0]) if entry is not None and entry[1] > time.time() else (False, None)
+
+    def register() -> Optional[str]:
+        found, name = cached()  # 앞서 등록을 마친 호출이 방금 넣었을 수 있음
+        if found:
+            return name
+        body = {
+            "model": f"models/{model}",
+            "systemInstruction": {"parts": [{"text": system_instruction}]},
+            "ttl": f"{ttl_seconds}s"
+        }
+        retry_after = 30  # 네트워크 오류, 5xx, 429처럼 일시적인 실패는 곧 다시 시도
+        try:
+            resp = get_http_session().post(f"{GEMINI_API_BASE}/cachedContents", params={"key": api_key},
+                                           headers={"Content-Type": "application/json; charset=utf-8"},
+                                           data=_encode_body(body), timeout=30)
+            name = resp.json().get("name") if resp.status_code == 200 else None
+            if 400 <= resp.status_code < 500 and resp.status_code != 429:
+                retry_after = 300  # 거절(예: 최소 토큰 수 미달)은 바로 다시 해도 같으므로 5분 뒤에 시도
+        except (requests.RequestException, ValueError):
+            name = None
+
+        # 성공 시 만료 1분 전까지 재사용
+        expires_at = time.time() + (max(ttl_seconds - 60, 1) if name else retry_after)
+        with lock:
+            context_caches[key] = (name, expires_at)
+        return name
+
+    found, name = cached()
+    if found:
+        return name
+    return _context_cache_flight().do("\x1f".join(key), register)
+
+def invalidate_context_cache(system_instruction: str, api_key: str, model: str = GEMINI_MODEL) -> None:
+    """서버에서 만료되었거나 삭제된 컨텍스트 캐시 이름을 잊습니다."""
+    context_caches, lock = _context_cache_registry()
+    with lock:
+        context_caches.pop(_context_cache_key(system_instruction, api_key, model), None)
+
+def gemini_prompt_args(instructions: str, user_text: str, prompt_mode: Optional[str] = None) -> Dict[str, Any]:
+    """
+    GEMINI_PROMPT_MODE에 따라 call_gemini_json에 넘길 프롬프트 인자를 만듭니다.
+    inline이면 지시문과 본문을 합치고, 그 외에는 지시문을 systemInstruction(또는 컨텍스트 캐시)으로 분리합니다.
+    """
+    prompt_mode = prompt_mode or GEMINI_PROMPT_MODE
+    if prompt_mode not in PROMPT_MODES:
+        raise ValueError(f"지원하지 않는 프롬프트 전달 방식입니다: {prompt_mode}")
+    if prompt_mode == "inline":
+        return {"prompt_text": instructions + "\n\n" + user_text}
+    return {
+        "prompt_text": user_text,
+        "system_instruction": instructions,
+        "use_context_cache": prompt_mode == "cached"
+    }
+
+def _salvage_json_array(text: str) -> List[Any]:
+    """잘린 JSON 배열에서 끝까지 완성된 원소만 추출합니다."""
+    decoder = json.JSONDecoder()
+    items: List[Any] = []
+    pos = text.find("[") + 1
+    while True:
+        while pos < len(text) and text[pos] in " \t\r\n,":
+            pos += 1
+        if pos >= len(text) or text[pos] == "]":
+            break
+        try:
+            item, pos = decoder.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            break
+        items.append(item)
+    return items
+
+class IncrementalJSONParser:
+    """
+    조각으로 도착하는 JSON 객체 텍스트에서 최상위 필드가 완성될 때마다 (키, 값)을 꺼냅니다.
+    첫 "{" 앞의 코드펜스나 설명, 객체가 닫힌 뒤의 텍스트는 무시합니다.
+    """
+
+    _SPECIAL = re.compile(r'["\\{}\[\],]')
+    _STRING_SPECIAL = re.compile(r'["\\]')
+
+    def __init__(self):
+        self.text = ""
+        self.done = False
+        self.failed = False  # 해석하지 못한 필드가 있었는지
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._field_start = -1
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """텍스트 조각을 추가하고, 이번에 완성된 최상위 필드 목록을 반환합니다."""
+        self.text += chunk
+        text = self.text
+        fields: List[Tuple[str, Any]] = []
+        pos = self._pos
+        while not self.done:
+            # 문자열 안에서는 따옴표/역슬래시만, 밖에서는 구조 문자만 찾아 건너뜀
+            match = (self._STRING_SPECIAL if self._in_string else self._SPECIAL).search(text, pos)
+            if match is None:
+                pos = len(text)
+                break
+            ch, pos = match.group(), match.end()
+            if self._in_string:
+                if ch == "\\":
+                    if pos >= len(text):  # 이스케이프 대상 문자가 아직 도착하지 않음
+                        pos -= 1
+                        break
+                    pos += 1
+                else:
+                    self._in_string = False
+            elif self._depth == 0:
+                if ch == "{":
+                    self._depth = 1
+                    self._field_start = pos
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    fields.extend(self._complete_field(pos - 1))
+                    self.done = True
+            elif self._depth == 1:  # 최상위 ","
+                fields.extend(self._complete_field(pos - 1))
+                self._field_start = pos
+        self._pos = pos
+        return fields
+
+    def _complete_field(self, end: int) -> List[Tuple[str, Any]]:
+        segment = self.text[self._field_start:end].strip()
+        if not segment:
+            return []
+        try:
+            return list(json.loads("{" + segment + "}").items())
+        except json.JSONDecodeError:
+            self.failed = True  # 형식이 깨진 필드는 건너뛰고, 스트림이 끝난 뒤 전체 텍스트로 다시 해석
+            return []
+
+def parse_gemini_response(data: Dict[str, Any]) -> Union[Dict[str, Any], List[Any]]:
+    """
+    Gemini 응답 본문에서 JSON 결과를 안전하게 추출합니다.
+    JSON 코드펜스가 있을 경우 제거합니다. 결과를 꺼내지 못하면 GeminiResponseError를 발생시킵니다.
+    해석 방식(바로 해석/잘린 배열 복구/중괄호 범위 추출/실패)은 지표(record_parse)에 기록합니다.
+    """
+    try:
+        result, outcome = _parse_gemini_text(data)
+    except GeminiResponseError:
+        record_parse("failed")
+        raise
+    record_parse(outcome)
+    return result
+
+def _parse_gemini_text(data: Dict[str, Any]) -> Tuple[Union[Dict[str, Any], List[Any]], str]:
+    cands = data.get("candidates", [])
+    if not cands:
+        raise GeminiResponseError("Gemini 응답에 candidates가 없습니다.")
+
+    parts = cands[0].get("content", {}).get("parts", [])
+    if not parts:
+        raise GeminiResponseError("Gemini 응답에 parts가 없습니다.")
+
+    text = parts[0].get("text", "")
+    if not text:
+        raise GeminiResponseError("Gemini 응답에 text가 없습니다.")
+
+    raw = text.strip()
+    cleaned = raw.replace("```json", "").replace("```", "").strip()
+
+    # 최종 JSON 파싱
+    try:
+        return json.loads(cleaned), "direct"
+    except json.JSONDecodeError:
+        # 여러 광고를 묶은 응답(JSON 배열)이 잘린 경우 완성된 원소만 사용
+        if cleaned.startswith("["):
+            items = _salvage_json_array(cleaned)
+            if items:
+                return items, "salvaged"
+        # 간단 복구: 앞/뒤 설명 제거 가능성이 있으므로 중괄호 범위만 추출 시도
+        try:
+            first = cleaned.find("{")
+            last = cleaned.rfind("}")
+            if first != -1 and last != -1 and last > first:
+                sliced = cleaned[first:last+1]
+                return json.loads(sliced), "sliced"
+        except Exception:
+            pass
+        raise GeminiResponseError(f"JSON 파싱 실패. 원문 일부: {cleaned[:500]}")
+
+def _post_gemini(prompt_text: str,
+                 api_key: str,
+                 model: str = GEMINI_MODEL,
+                 timeout: int = 30,
+                 generation_config: Optional[Dict[str, Any]] = None,
+                 system_instruction: Optional[str] = None,
+                 use_context_cache: bool = False,
+                 stream: bool = False) -> requests.Response:
+    """
+    generateContent(stream이면 streamGenerateContent SSE) 요청을 보내고 응답을 반환합니다.
+    api_key에 여러 키(쉼표로 구분)를 주면 키 풀(get_api_key_pool)에서 가장 한가한 키로 보냅니다.
+    요청 전 그 키의 속도 제한기를 거치며, 429/5xx 응답은 백오프 후 재시도합니다.
+    429/403을 받았는데 쉬는 중이 아닌 다른 키가 있으면 기다리지 않고 다른 키로 다시 보냅니다.
+    컨텍스트 캐시가 만료/삭제되었으면 지시문을 직접 보내 다시 시도합니다.
+    """
+    headers = {"Content-Type": "application/json; charset=utf-8"}
+    method = "streamGenerateContent" if stream else "generateContent"
+    pool = get_api_key_pool(api_key)
+    use_context_cache = bool(system_instruction and use_context_cache)
+    attempt = 0
+    while True:
+        index = pool.checkout()
+        key = pool.keys[index]
+        try:
+            # 컨텍스트 캐시는 키(프로젝트)마다 따로 등록됨
+            cached_content = get_context_cache_name(system_instruction, key, model) if use_context_cache else None
+            body = _gemini_request_body(prompt_text, generation_config, system_instruction, cached_content)
+            with measure_stage("rate_limit_wait"):
+                pool.limiters[index].acquire(_input_tokens(body))
+            with measure_stage("http_wait"):
+                resp = get_http_session().post(_gemini_url(model, method),
+                                               params={"alt": "sse", "key": key} if stream else {"key": key},
+                                               headers=headers, data=_encode_body(body), timeout=timeout,
+                                               stream=stream)
+        except BaseException:
+            pool.release(index)
+            raise
+
+        if cached_content and resp.status_code in (400, 403, 404):
+            # 컨텍스트 캐시가 만료/삭제된 경우 지시문을 직접 보내 다시 시도
+            resp.close()
+            pool.release(index)
+            invalidate_context_cache(system_instruction, key, model)
+            use_context_cache = False
+            continue
+        pool.release(index, resp.status_code)
+        switch_key = resp.status_code in KEY_COOLDOWN_STATUS_CODES and pool.has_alternative(index)
+        if (resp.status_code in RETRY_STATUS_CODES or switch_key) and attempt < GEMINI_MAX_RETRIES:
+            resp.close()
+            delay = retry_delay(attempt, resp.headers.get("Retry-After"))
+            if resp.status_code in RETRY_STATUS_CODES:
+                pool.limiters[index].record_retry(resp.status_code, pool.cooldown(index, delay))
+            if not switch_key:
+                with measure_stage("retry_backoff"):
+                    time.sleep(delay)
+            attempt += 1
+            continue
+        return resp
+
+def call_gemini_json(prompt_text: str,
+                     api_key: str,
+                     model: str = GEMINI_MODEL,
+                     timeout: int = 30,
+                     generation_config: Optional[Dict[str, Any]] = None,
+                     system_instruction: Optional[str] = None,
+                     use_context_cache: bool = False
+                     ) -> Union[Dict[str, Any], List[Any]]:
+    """
+    Gemini에 프롬프트를 전달하고, JSON 응답을 안전하게 추출합니다.
+    공유 세션을 사용하므로 연결이 재사용됩니다.
+    system_instruction이 있으면 systemInstruction으로 보내고, use_context_cache가 켜져 있으면
+    컨텍스트 캐시에 등록된 지시문을 이름으로 참조합니다.
+    요청 전 공유 속도 제한기를 거치며, 429/5xx 응답은 백오프 후 재시도합니다.
+    재시도 후에도 실패하면 GeminiAPIError, 응답을 해석하지 못하면 GeminiResponseError를 발생시킵니다.
+    단계별 시간(대기/HTTP/해석)과 usageMetadata의 토큰 수는 지표(get_metrics)에 기록됩니다.
+    """
+    resp = _post_gemini(prompt_text, api_key, model, timeout, generation_config, system_instruction, use_context_cache)
+    if resp.status_code != 200:
+        raise GeminiAPIError(resp.status_code, resp.text[:200])
+
+    with measure_stage("json_parse"):
+        data = resp.json()
+        record_usage(data.get("usageMetadata"), model)
+        return parse_gemini_response(data)
+
+def stream_gemini_json(prompt_text: str,
+                       api_key: str,
+                       model: str = GEMINI_MODEL,
+                       timeout: int = 30,
+                       generation_config: Optional[Dict[str, Any]] = None,
+                       system_instruction: Optional[str] = None,
+                       use_context_cache: bool = False
+                       ) -> Iterator[Tuple[str, Any]]:
+    """
+    call_gemini_json의 스트리밍 버전입니다. streamGenerateContent(SSE)로 요청하고,
+    JSON 객체의 최상위 필드(target_age, motivation 등)가 완성될 때마다 (키, 값)을 바로 반환합니다.
+    스트림이 끝났는데 점진 해석에 실패한 필드가 있으면 전체 텍스트를 parse_gemini_response로 해석하여 나머지를 반환합니다.
+    오류는 call_gemini_json과 같은 예외로 알립니다.
+    """
+    resp = _post_gemini(prompt_text, api_key, model, timeout, generation_config, system_instruction,
+                        use_context_cache, stream=True)
+    if resp.status_code != 200:
+        with resp:
+            raise GeminiAPIError(resp.status_code, resp.text[:200])
+
+    parser = IncrementalJSONParser()
+    seen = set()
+    usage_metadata = None
+    read_seconds = 0.0
+    with resp:
+        lines = resp.iter_lines(chunk_size=None)
+        while True:
+            # 화면이 조각을 그리는 시간은 빼고 응답을 기다린 시간만 더함
+            started = time.perf_counter()
+            line = next(lines, None)
+            read_seconds += time.perf_counter() - started
+            if line is None:
+                break
+            if not line.startswith(b"data:"):
+                continue
+            try:
+                chunk = json.loads(line[5:])
+            except ValueError as e:  # UnicodeDecodeError 포함
+                raise GeminiResponseError(f"스트림 조각 JSON 파싱 실패: {line[5:205]!r}") from e
+            if not isinstance(chunk, dict):
+                raise GeminiResponseError(f"스트림 조각이 JSON 객체가 아닙니다: {line[5:205]!r}")
+            usage_metadata = chunk.get("usageMetadata") or usage_metadata  # 누적값이므로 마지막 것을 사용
+            for part in (chunk.get("candidates") or [{}])[0].get("content", {}).get("parts", []):
+                for key, value in parser.feed(part.get("text", "")):
+                    seen.add(key)
+                    yield key, value
+    record_stage("stream_read", read_seconds)
+    record_usage(usage_metadata, model)
+
+    if parser.done and not parser.failed:
+        record_parse("direct")
+    else:
+        # 스트림이 중간에 끊겼거나 형식이 예상과 다름: 받은 텍스트 전체로 한 번 더 해석
+        data = {"candidates": [{"content": {"parts": [{"text": parser.text}]}}]}
+        result = parse_gemini_response(data)
+        if isinstance(result, dict):
+            for key, value in result.items():
+                if key not in seen:
+                    yield key, value
+
+async def call_gemini_json_async(prompt_text: str,
+                                 api_key: str,
+                                 model: str = GEMINI_MODEL,
+                                 timeout: int = 30,
+                                 generation_config: Optional[Dict[str, Any]] = None,
+                                 system_instruction: Optional[str] = None,
+                                 use_context_cache: bool = False
+                                 ) -> Union[Dict[str, Any], List[Any]]:
+    """call_gemini_json의 asyncio 버전. 이벤트 루프별 공유 연결 풀과 같은 키 풀을 사용합니다."""
+    import asyncio
+    import aiohttp
+
+    session = get_async_http_session()
+    pool = get_api_key_pool(api_key)
+    use_context_cache = bool(system_instruction and use_context_cache)
+    attempt = 0
+    while True:
+        index = pool.checkout()
+        key = pool.keys[index]
+        try:
+            cached_content = None
+            if use_context_cache:
+                # 등록은 드물게 일어나므로 동기 함수를 스레드에서 실행
+                cached_content = await asyncio.to_thread(get_context_cache_name, system_instruction, key, model)
+            body = _gemini_request_body(prompt_text, generation_config, system_instruction, cached_content)
+            with measure_stage("rate_limit_wait"):
+                await pool.limiters[index].acquire_async(_input_tokens(body))
+            with measure_stage("http_wait"):
+                async with session.post(_gemini_url(model),
+                                        params={"key": key},
+                                        headers={"Content-Type": "application/json; charset=utf-8"},
+                                        data=_encode_body(body),
+                                        timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+                    status = resp.status
+                    retry_after = resp.headers.get("Retry-After")
+                    raw = await resp.read()
+        except BaseException:
+            pool.release(index)
+            raise
+
+        if cached_content and status in (400, 403, 404):
+            # 컨텍스트 캐시가 만료/삭제된 경우 지시문을 직접 보내 다시 시도
+            pool.release(index)
+            invalidate_context_cache(system_instruction, key, model)
+            use_context_cache = False
+            continue
+        pool.release(index, status)
+        switch_key = status in KEY_COOLDOWN_STATUS_CODES and pool.has_alternative(index)
+        if (status in RETRY_STATUS_CODES or switch_key) and attempt < GEMINI_MAX_RETRIES:
+            delay = retry_delay(attempt, retry_after)
+            if status in RETRY_STATUS_CODES:
+                pool.limiters[index].record_retry(status, pool.cooldown(index, delay))
+            if not switch_key:
+                with measure_stage("retry_backoff"):
+                    await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        break
+
+    if status != 200:
+        raise GeminiAPIError(status, raw[:200].decode("utf-8", "replace"))
+
+    with measure_stage("json_parse"):
+        data = json.loads(raw)
+        record_usage(data.get("usageMetadata"), model)
+        return parse_gemini_response(data)
+
+# =========================================================
+# 분류 결과 캐시 (SQLite)
+# =========================================================
+CLASSIFICATION_CACHE_PATH = os.getenv("IVE_CACHE_PATH", os.path.join(".cache", "classification_cache.sqlite3"))
+CLASSIFICATION_CACHE_TTL = int(os.getenv("IVE_CACHE_TTL", str(30 * 24 * 3600)))  # 초 단위, 기본 30일
+CLASSIFICATION_CACHE_MAX_ENTRIES = int(os.getenv("IVE_CACHE_MAX_ENTRIES", "200000"))
+
+def classification_cache_key(prompt_text: str,
+                             model: str = GEMINI_MODEL,
+                             generation_config: Optional[Dict[str, Any]] = None,
+                             prompt_mode: Optional[str] = None) -> str:
+    """
+    전체 프롬프트, 모델명, generationConfig로 캐시 키(SHA-256)를 만듭니다.
+    프롬프트나 모델이 바뀌면 키가 달라지므로 이전 항목은 자동으로 무효화됩니다.
+    지시문을 systemInstruction으로 분리해 보낸 결과(system/cached)는 inline 결과와 구분합니다.
+    """
+    payload = json.dumps({
+        "prompt": prompt_text,
+        "model": model,
+        "generationConfig": generation_config if generation_config is not None else GENERATION_CONFIG,
+        "systemInstruction": (prompt_mode or GEMINI_PROMPT_MODE) != "inline"
+    }, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ClassificationCache:
+    """
+    Gemini 분류 결과를 SQLite 파일에 저장하는 내용 주소 기반 캐시입니다.
+    TTL이 지난 항목은 조회 시 삭제되고, 항목 수가 max_entries를 넘으면 오래 사용되지 않은 항목부터 제거합니다.
+    """
+
+    def __init__(self,
+                 path: str = CLASSIFICATION_CACHE_PATH,
+                 ttl_seconds: int = CLASSIFICATION_CACHE_TTL,
+                 max_entries: int = CLASSIFICATION_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS classification_cache (
+                key TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_classification_cache_accessed ON classification_cache (accessed_at)"
+        )
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM classification_cache").fetchone()[0]
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """캐시된 결과를 반환합니다. 없거나 만료되었으면 None을 반환합니다."""
+        return self.get_any((key,))
+
+    def get_any(self, keys: Iterable[str]) -> Optional[Dict[str, Any]]:
+        """
+        keys를 차례로 찾아 처음 찾은 결과를 반환합니다. 모두 없거나 만료되었으면 None을 반환합니다.
+        한 광고를 여러 키로 찾는 경우이므로 적중/미스는 키 수와 관계없이 한 번만 셉니다.
+        """
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                row = self._conn.execute(
+                    "SELECT result, created_at FROM classification_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and self.ttl_seconds > 0 and now - row[1] > self.ttl_seconds:
+                    self._conn.execute("DELETE FROM classification_cache WHERE key = ?", (key,))
+                    self._entries -= 1
+                    row = None
+                if row is not None:
+                    break
+            else:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE classification_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, result: Dict[str, Any]) -> None:
+        """분류 결과를 저장합니다."""
+        now = time.time()
+        payload = json.dumps(result, ensure_ascii=False)
+        with self._lock:
+            inserted = self._conn.execute(
+                "INSERT OR IGNORE INTO classification_cache (key, result, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, payload, now, now)
+            ).rowcount
+            if inserted:
+                self._entries += 1
+            else:
+                self._conn.execute(
+                    "UPDATE classification_cache SET result = ?, created_at = ?, accessed_at = ? WHERE key = ?",
+                    (payload, now, now, key)
+                )
+            if self.max_entries > 0 and self._entries > self.max_entries:
+                self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        # 만료 항목을 먼저 지우고, 그래도 많으면 오래 사용되지 않은 항목부터 90% 수준까지 정리
+        if self.ttl_seconds > 0:
+            self._conn.execute("DELETE FROM classification_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM classification_cache").fetchone()[0]
+        excess = self._entries - int(self.max_entries * 0.9)
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM classification_cache WHERE key IN "
+                "(SELECT key FROM classification_cache ORDER BY accessed_at LIMIT ?)", (excess,)
+            )
+            self._entries -= excess
+
+    def clear(self) -> None:
+        """모든 캐시 항목과 카운터를 초기화합니다."""
+        with self._lock:
+            self._conn.execute("DELETE FROM classification_cache")
+            self._entries = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """적중/미스 횟수와 저장된 항목 수를 반환합니다."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": self._entries
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+@shared_resource
+def get_classification_cache() -> ClassificationCache:
+    """프로세스 전체에서 공유하는 분류 결과 캐시를 반환합니다."""
+    return ClassificationCache()
+
+# =========================================================
+# 같은 프롬프트의 동시 요청 합치기 (single-flight)
+# =========================================================
+class _Abandoned(Exception):
+    """
+    실행하던 호출자가 결과 없이 멈춤 (기다리던 호출은 직접 다시 실행)
+    스트림을 끝까지 받지 않았거나, 작업 취소(asyncio.CancelledError)/KeyboardInterrupt처럼
+    그 호출자에게만 해당하는 BaseException으로 중단된 경우입니다.
+    """
+
+def _shared_error(error: BaseException) -> BaseException:
+    # 기다리던 호출에 넘길 예외. 실행한 호출자만의 중단(Exception이 아닌 BaseException)은 다시 실행하도록 바꿈
+    return error if isinstance(error, Exception) else _Abandoned()
+
+class SingleFlight:
+    """
+    같은 키의 동시 호출을 하나로 합칩니다. 먼저 온 호출만 실제로 실행하고, 그 사이에 들어온 같은 키의 호출은
+    그 결과(또는 예외)를 기다려 함께 받습니다. 끝난 호출의 결과는 남기지 않습니다. (보관은 결과 캐시가 담당)
+    기다린 호출은 결과의 깊은 복사본을 받으므로 각 호출자가 결과를 고쳐도 서로 영향이 없습니다.
+    스레드와 이벤트 루프 사이에서도 합쳐집니다. (do, do_async, do_stream이 같은 진행 중 호출을 공유)
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._calls: Dict[str, List[Any]] = {}  # 키 -> [Future, 기다리는 호출 수]
+
+    def _join(self, key: str) -> Tuple[List[Any], bool]:
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call[1] += 1
+                self.coalesced += 1
+                return call, False
+            call = self._calls[key] = [Future(), 0]
+            self.calls += 1
+            return call, True
+
+    def _finish(self, key: str, call: List[Any], result: Any = None, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            del self._calls[key]
+            waiters = call[1]
+        if error is not None:
+            call[0].set_exception(error)
+        else:
+            # 실행한 호출자가 결과를 고치기 전의 복사본을 넘김 (기다린 호출이 없으면 복사하지 않음)
+            call[0].set_result(copy.deepcopy(result) if waiters else None)
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """key로 진행 중인 호출이 있으면 그 결과를 기다리고, 없으면 fn()을 실행합니다."""
+        call, leader = self._join(key)
+        if not leader:
+            try:
+                return copy.deepcopy(call[0].result())
+            except _Abandoned:
+                return self.do(key, fn)
+        try:
+            result = fn()
+        except BaseException as e:
+            self._finish(key, call, error=_shared_error(e))
+            raise
+        self._finish(key, call, result)
+        return result
+
+    async def do_async(self, key: str, fn: Callable[[], Any]) -> Any:
+        """do의 asyncio 버전. fn은 코루틴을 반환하는 함수입니다."""
+        import asyncio
+
+        call, leader = self._join(key)
+        if not leader:
+            try:
+                # shield: 기다리던 작업이 취소되어도 공유 Future는 취소하지 않음 (다른 호출도 기다리는 중)
+                shared = asyncio.wrap_future(call[0])
+                shared.add_done_callback(lambda f: f.cancelled() or f.exception())  # 취소 후 남은 예외 경고 방지
+                return copy.deepcopy(await asyncio.shield(shared))
+            except _Abandoned:
+                return await self.do_async(key, fn)
+        try:
+            result = await fn()
+        except BaseException as e:  # 실행한 작업이 취소되면 기다리던 호출 중 하나가 다시 실행
+            self._finish(key, call, error=_shared_error(e))
+            raise
+        self._finish(key, call, result)
+        return result
+
+    def do_stream(self, key: str, fn: Callable[[], Iterator[Any]]) -> Iterator[Any]:
+        """
+        do의 스트리밍 버전. fn은 중간 값을 내보내고 최종 결과를 return하는 제너레이터 함수이며,
+        이 함수도 `result = yield from single_flight.do_stream(key, fn)`처럼 중간 값을 내보낸 뒤 결과를 반환합니다.
+        진행 중인 호출을 기다린 경우에는 중간 값 없이 결과만 반환합니다.
+        실행한 호출자가 끝까지 받지 않고 멈추면 기다리던 호출은 직접 다시 실행합니다.
+        """
+        call, leader = self._join(key)
+        if not leader:
+            try:
+                return copy.deepcopy(call[0].result())
+            except _Abandoned:
+                return (yield from self.do_stream(key, fn))
+        try:
+            result = yield from fn()
+        except BaseException as e:  # GeneratorExit 포함
+            self._finish(key, call, error=_shared_error(e))
+            raise
+        self._finish(key, call, result)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """실행한 호출 수, 합쳐진(기다려서 결과를 받은) 호출 수, 진행 중인 호출 수를 반환합니다."""
+        with self._lock:
+            return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._calls)}
+
+@shared_resource
+def get_gemini_single_flight() -> SingleFlight:
+    """프로세스 전체에서 공유하는 Gemini 분류 요청 합치기 객체를 반환합니다."""
+    return SingleFlight()
+
+# =========================================================
+# 유사 광고 재사용 (MinHash/LSH)
+# =========================================================
+NEAR_DUP_ENABLED = os.getenv("IVE_NEAR_DUP", "0") == "1"   # 기본 꺼짐: 요청마다 켜거나 IVE_NEAR_DUP=1
+NEAR_DUP_PATH = os.getenv("IVE_NEAR_DUP_PATH", os.path.join(".cache", "near_duplicates.sqlite3"))
+NEAR_DUP_MAX_DISTANCE = float(os.getenv("IVE_NEAR_DUP_DISTANCE", "0.2"))  # 자카드 거리 (1 - 유사도)
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16                  # 밴드 16개 × 4행: 유사도 0.8인 쌍을 99.9% 확률로 후보에 올림
+SHINGLE_SIZE = 4                # 문자 단위 shingle 길이
+NEAR_DUP_MAX_CANDIDATES = 32    # 밴드가 많이 겹치는 순으로 이 개수만 시그니처 비교
+MINHASH_SEED = 20250101         # 인덱스 파일과 함께 고정되어야 하는 값 (바꾸면 인덱스를 다시 만듦)
+# shingle을 만드는 광고 필드 (format_ad_text와 같은 필드). 고정 라벨("광고명:", "요약:" 등)은 모든 광고에
+# 똑같이 들어 있어 짧은 광고끼리의 유사도를 부풀리므로 값만 사용
+SHINGLE_FIELDS = ("ads_name", "ads_summary", "ads_guide", "ads_limit", "ads_reward_price",
+                  "ads_age_min", "ads_age_max", "ads_sdate", "ads_edate", "ad_type", "ad_type_category")
+
+def ad_shingles(ad_data: Dict[str, str]) -> set:
+    """광고 필드 값(라벨 제외)을 정규화하여 문자 shingle 집합으로 만듭니다."""
+    text = _normalize_ad_content("\n".join(str(ad_data.get(field) or "") for field in SHINGLE_FIELDS))
+    if len(text) <= SHINGLE_SIZE:
+        return {text}
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+class MinHasher:
+    """shingle 집합의 MinHash 시그니처를 만듭니다. shingle은 crc32로, 순열은 multiply-shift 해시로 흉내 냅니다."""
+
+    def __init__(self, permutations: int = MINHASH_PERMUTATIONS, seed: int = MINHASH_SEED):
+        import numpy as np
+
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 2 ** 63, size=permutations, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2 ** 63, size=permutations, dtype=np.uint64)
+
+    def signature(self, shingles: Iterable[str]) -> "np.ndarray":
+        import numpy as np
+
+        # 프로세스마다 값이 달라지는 hash() 대신 crc32를 사용해야 인덱스를 파일로 유지할 수 있음
+        values = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64)
+        with np.errstate(over="ignore"):  # uint64 곱셈의 자리 넘침은 의도된 것 (mod 2^64)
+            hashed = (values[:, None] * self._a + self._b) >> np.uint64(32)
+        return hashed.min(axis=0).astype(np.uint32)
+
+class NearDuplicateIndex:
+    """
+    이미 분류된 광고의 MinHash 시그니처를 LSH 밴드로 색인하는 SQLite 인덱스입니다.
+    날짜/리워드 가격/가이드 한 문장만 다른 광고처럼 텍스트가 거의 같은 광고를 찾아 결과를 재사용합니다.
+    인덱스는 만든 분류 설정(classification_fingerprint)에 묶여 있어 설정이 바뀌면 비워집니다.
+    광고를 추가할 때마다 밴드 키만 삽입하므로 점진적으로 갱신되며, 조회는 밴드 키 16개의 색인 검색입니다.
+    """
+
+    def __init__(self,
+                 path: str = NEAR_DUP_PATH,
+                 max_distance: float = NEAR_DUP_MAX_DISTANCE,
+                 permutations: int = MINHASH_PERMUTATIONS,
+                 bands: int = LSH_BANDS,
+                 fingerprint: Optional[str] = None):
+        import numpy as np
+
+        if permutations % bands:
+            raise ValueError("permutations는 bands의 배수여야 합니다.")
+        self.path = path
+        self.max_distance = max_distance
+        self.bands = bands
+        self.hits = 0
+        self.misses = 0
+        self._hasher = MinHasher(permutations)
+        self._rows = permutations // bands
+        rng = np.random.default_rng(MINHASH_SEED + 1)
+        self._band_mult = rng.integers(1, 2 ** 63, size=self._rows, dtype=np.uint64) | np.uint64(1)
+        self._band_ids = np.arange(bands, dtype=np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+        self._lock = threading.Lock()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS near_dup_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        params = json.dumps({"permutations": permutations, "bands": bands, "seed": MINHASH_SEED,
+                             "shingle_size": SHINGLE_SIZE, "shingle_fields": SHINGLE_FIELDS,
+                             "classification": fingerprint or classification_fingerprint()})
+        stored = self._conn.execute("SELECT value FROM near_dup_meta WHERE key = 'params'").fetchone()
+        if stored is not None and stored[0] != params:
+            # 시그니처 계산 방식이 바뀌면 이전 항목은 비교할 수 없고, 프롬프트/모델/응답 형식이 바뀌면
+            # 이전 결과는 결과 캐시처럼 무효이므로 새로 만듦
+            self._conn.execute("DROP TABLE IF EXISTS near_dup_items")
+            self._conn.execute("DROP TABLE IF EXISTS near_dup_bands")
+        self._conn.execute("INSERT OR REPLACE INTO near_dup_meta (key, value) VALUES ('params', ?)", (params,))
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS near_dup_items (
+                id INTEGER PRIMARY KEY,
+                text_hash TEXT NOT NULL UNIQUE,
+                signature BLOB NOT NULL,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS near_dup_bands (
+                band_key INTEGER NOT NULL,
+                item_id INTEGER NOT NULL,
+                PRIMARY KEY (band_key, item_id)
+            ) WITHOUT ROWID
+        """)
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM near_dup_items").fetchone()[0]
+
+    def signature(self, ad_data: Dict[str, str]) -> "np.ndarray":
+        return self._hasher.signature(ad_shingles(ad_data))
+
+    def _band_keys(self, signature: "np.ndarray") -> List[int]:
+        import numpy as np
+
+        bands = signature.astype(np.uint64).reshape(self.bands, self._rows)
+        with np.errstate(over="ignore"):
+            keys = (bands * self._band_mult).sum(axis=1) ^ self._band_ids
+        return keys.view(np.int64).tolist()  # SQLite INTEGER는 부호 있는 64비트
+
+    def lookup(self, ad_data: Dict[str, str]) -> Optional[Tuple[Dict[str, Any], float]]:
+        """자카드 거리가 max_distance 이내인 가장 비슷한 광고의 (결과, 추정 유사도)를 반환합니다. 없으면 None."""
+        import numpy as np
+
+        signature = self.signature(ad_data)
+        keys = self._band_keys(signature)
+        with self._lock:
+            candidates = self._conn.execute(
+                f"SELECT item_id FROM near_dup_bands WHERE band_key IN ({','.join('?' * len(keys))}) "
+                "GROUP BY item_id ORDER BY COUNT(*) DESC LIMIT ?",
+                (*keys, NEAR_DUP_MAX_CANDIDATES)
+            ).fetchall()
+            best_id, best_similarity = None, 1.0 - self.max_distance
+            if candidates:
+                ids = [item_id for item_id, in candidates]
+                for item_id, blob in self._conn.execute(
+                    f"SELECT id, signature FROM near_dup_items WHERE id IN ({','.join('?' * len(ids))})", ids
+                ):
+                    similarity = float(np.count_nonzero(np.frombuffer(blob, dtype=np.uint32) == signature)) / len(signature)
+                    if similarity >= best_similarity:
+                        best_id, best_similarity = item_id, similarity
+            if best_id is None:
+                self.misses += 1
+                return None
+            row = self._conn.execute("SELECT result FROM near_dup_items WHERE id = ?", (best_id,)).fetchone()
+            self.hits += 1
+        return json.loads(row[0]), best_similarity
+
+    def add(self, ad_data: Dict[str, str], result: Dict[str, Any]) -> None:
+        """Gemini로 분류한 광고를 인덱스에 추가합니다. 같은 텍스트의 광고는 한 번만 저장됩니다."""
+        text_hash = hashlib.sha256(format_ad_text(ad_data).encode("utf-8")).hexdigest()
+        signature = self.signature(ad_data)
+        keys = self._band_keys(signature)
+        payload = json.dumps(result, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute("BEGIN")  # 항목과 밴드 키를 한 트랜잭션으로 기록
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO near_dup_items (text_hash, signature, result, created_at) VALUES (?, ?, ?, ?)",
+                (text_hash, signature.tobytes(), payload, time.time())
+            )
+            if not cursor.rowcount:
+                self._conn.execute("COMMIT")
+                return
+            self._conn.executemany("INSERT OR IGNORE INTO near_dup_bands (band_key, item_id) VALUES (?, ?)",
+                                   [(key, cursor.lastrowid) for key in keys])
+            self._conn.execute("COMMIT")
+            self._entries += 1
+
+    def clear(self) -> None:
+        """모든 항목과 카운터를 초기화합니다."""
+        with self._lock:
+            self._conn.execute("DELETE FROM near_dup_bands")
+            self._conn.execute("DELETE FROM near_dup_items")
+            self._entries = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """재사용/미스 횟수와 색인된 광고 수를 반환합니다."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": self._entries
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+@shared_resource
+def get_near_duplicate_index() -> NearDuplicateIndex:
+    """프로세스 전체에서 공유하는 유사 광고 인덱스를 반환합니다."""
+    return NearDuplicateIndex()
+
+# =========================================================
+# 한국어 변환 함수들
+# =========================================================
+# 미리 만들어 둔 번역 표 (get_korean_*와 결과 표의 열 단위 번역이 함께 사용)
+KOREAN_AD_TYPES = {
+    "1": "설치형", "2": "실행형", "3": "참여형", "4": "클릭형",
+    "5": "페북", "6": "트위터", "7": "인스타", "8": "노출형",
+    "9": "퀘스트", "10": "유튜브", "11": "네이버", "12": "CPS(물건구매)",
+    "game": "게임", "app": "앱", "shopping": "쇼핑", "finance": "금융",
+    "service": "서비스", "content": "콘텐츠", "healthcare": "헬스케어",
+    "education": "교육", "rewards_only": "리워드 전용", "other": "기타"
+}
+KOREAN_TARGET_AGES = {
+    "all_ages": "전연령", "teens": "10대", "twenties": "20대", "thirties": "30대",
+    "forties": "40대", "fifties": "50대", "adults": "성인"
+}
+KOREAN_TARGET_GENDERS = {
+    "male_focus": "남성 중심", "female_focus": "여성 중심",
+    "male": "남성", "female": "여성", "neutral": "전성별"
+}
+KOREAN_CATEGORIES = {
+    "0": "카테고리 선택안함", "1": "앱(간편적립)",
+    "2": "경험하기(게임적립)/앱(간편적립)", "3": "구독(간편적립)",
+    "4": "간편미션-퀴즈(간편적립)", "5": "경험하기(게임적립)",
+    "6": "멀티보상(게임적립)", "7": "금융(참여적립)",
+    "8": "무료참여(참여적립)", "10": "유료참여(참여적립)",
+    "11": "쇼핑-상품별카테고리(쇼핑적립)", "12": "제휴몰(쇼핑적립)",
+    "13": "간편미션(간편적립)"
+}
+KOREAN_THEMES = {
+    "fantasy": "판타지", "competition": "경쟁", "growth": "성장",
+    "trust": "신뢰", "safety_net": "안전성", "security_privacy": "보안/개인정보",
+    "rewards": "리워드", "savings_benefit": "절약 혜택", "urgency": "긴급성",
+    "fun": "재미", "social": "소셜", "convenience": "편의성",
+    "curiosity": "호기심", "habit_building": "습관형성", "status_display": "지위표시"
+}
+KOREAN_SCORE_KEYS = {
+    "motivation": {
+        "fun": "재미", "social": "소셜", "rewards": "리워드", "savings": "절약",
+        "trust": "신뢰", "convenience": "편의성", "growth": "성장",
+        "status_display": "지위표시", "curiosity": "호기심",
+        "habit_building": "습관형성", "safety_net": "안전성"
+    },
+    "engagement": {
+        "casual_score": "캐주얼", "hardcore_score": "하드코어",
+        "frequency_score": "사용빈도", "multi_app_usage": "멀티앱",
+        "retention_potential": "유지력", "session_length_expectation": "세션길이"
+    },
+    "promo": {
+        "install_reward_sensitive": "설치리워드", "coupon_event_sensitive": "쿠폰이벤트",
+        "fomo_sensitive": "FOMO", "exclusive_benefit_sensitive": "독점혜택",
+        "trial_experience_sensitive": "체험경험"
+    },
+    "brand": {
+        "brand_loyalty": "브랜드충성도", "nostalgia": "향수",
+        "trust_in_official": "공식신뢰", "award_proof_sensitive": "수상증명",
+        "local_trust_factor": "국내신뢰", "global_trust_factor": "글로벌신뢰"
+    },
+    "commerce": {
+        "price_sensitivity": "가격민감도", "premium_willingness": "프리미엄지불의향",
+        "transaction_frequency": "거래빈도", "risk_tolerance": "위험감수성",
+        "recurring_payment": "정기결제", "big_purchase_intent": "고액구매의도"
+    },
+}
+
+def _korean_list(values, table: Dict[str, str]) -> str:
+    if isinstance(values, list):
+        korean = [table.get(str(value), str(value)) for value in values]
+        return ", ".join(korean) if korean else "N/A"
+    return table.get(str(values), str(values)) if values else "N/A"
+
+def get_korean_ad_type(ad_type):
+    """광고 유형을 한국어로 변환"""
+    # 숫자나 다른 타입도 문자열로 변환하여 처리
+    ad_type_str = str(ad_type)
+    return KOREAN_AD_TYPES.get(ad_type_str, ad_type_str)
+
+def get_korean_target_age(target_age):
+    """타겟 연령을 한국어로 변환"""
+    return KOREAN_TARGET_AGES.get(target_age, target_age)
+
+def get_korean_target_gender(target_gender):
+    """타겟 성별을 한국어로 변환"""
+    return KOREAN_TARGET_GENDERS.get(target_gender, target_gender)
+
+def get_korean_categories(categories):
+    """카테고리를 한국어로 변환"""
+    return _korean_list(categories, KOREAN_CATEGORIES)
+
+def get_korean_themes(themes):
+    """테마를 한국어로 변환"""
+    return _korean_list(themes, KOREAN_THEMES)
+
+def get_korean_motivation_key(key):
+    """동기 키를 한국어로 변환"""
+    return KOREAN_SCORE_KEYS["motivation"].get(key, key)
+
+def get_korean_engagement_key(key):
+    """참여도 키를 한국어로 변환"""
+    return KOREAN_SCORE_KEYS["engagement"].get(key, key)
+
+def get_korean_promo_key(key):
+    """프로모션 키를 한국어로 변환"""
+    return KOREAN_SCORE_KEYS["promo"].get(key, key)
+
+def get_korean_brand_key(key):
+    """브랜드 키를 한국어로 변환"""
+    return KOREAN_SCORE_KEYS["brand"].get(key, key)
+
+def get_korean_commerce_key(key):
+    """상거래 키를 한국어로 변환"""
+    return KOREAN_SCORE_KEYS["commerce"].get(key, key)
+
+# =========================================================
+# CSV 변환 함수
+# =========================================================
+# 결과 스키마: (섹션, 키, 종류) - 순서가 곧 json_total.csv의 컬럼 순서
+# 종류: "text" 문자열, "list" 쉼표로 이은 목록, "score" 숫자 점수 (없으면 0)
+RESULT_SCHEMA: Tuple[Tuple[str, str, str], ...] = (
+    ("", "ad_type", "text"), ("", "ad_type_category", "list"), ("", "ad_theme", "list"),
+    ("", "target_age", "text"), ("", "target_gender", "text"), ("", "notes", "list"),
+    ("", "ads_idx", "text"), ("", "ads_code", "text"), ("", "original_ads_name", "text"),
+    ("motivation", "fun", "score"), ("motivation", "social", "score"), ("motivation", "rewards", "score"),
+    ("motivation", "savings", "score"), ("motivation", "trust", "score"), ("motivation", "convenience", "score"),
+    ("motivation", "growth", "score"), ("motivation", "status_display", "score"),
+    ("motivation", "curiosity", "score"), ("motivation", "habit_building", "score"),
+    ("motivation", "safety_net", "score"),
+    ("engagement", "casual_score", "score"), ("engagement", "hardcore_score", "score"),
+    ("engagement", "frequency_score", "score"), ("engagement", "multi_app_usage", "score"),
+    ("engagement", "retention_potential", "score"), ("engagement", "session_length_expectation", "text"),
+    ("promo", "install_reward_sensitive", "score"), ("promo", "coupon_event_sensitive", "score"),
+    ("promo", "fomo_sensitive", "score"), ("promo", "exclusive_benefit_sensitive", "score"),
+    ("promo", "trial_experience_sensitive", "score"),
+    ("brand", "brand_loyalty", "score"), ("brand", "nostalgia", "score"), ("brand", "trust_in_official", "score"),
+    ("brand", "award_proof_sensitive", "score"), ("brand", "local_trust_factor", "score"),
+    ("brand", "global_trust_factor", "score"),
+    ("commerce", "price_sensitivity", "score"), ("commerce", "premium_willingness", "score"),
+    ("commerce", "transaction_frequency", "score"), ("commerce", "risk_tolerance", "score"),
+    ("commerce", "recurring_payment", "score"), ("commerce", "big_purchase_intent", "score"),
+)
+# 분류 출처와 신뢰도: 결과 JSON에는 항상 있고, 표 출력에는 include_source를 켤 때만 마지막 두 열로 추가
+SOURCE_SCHEMA: Tuple[Tuple[str, str, str], ...] = (("", "classification_source", "text"), ("", "confidence", "text"))
+EXTENDED_RESULT_SCHEMA = RESULT_SCHEMA + SOURCE_SCHEMA
+
+# CSV 헤더 정의 (json_total.csv 구조 43열 그대로)
+CSV_HEADERS = [f"{section}_{key}" if section else key for section, key, _ in RESULT_SCHEMA]
+EXTENDED_CSV_HEADERS = CSV_HEADERS + [key for _, key, _ in SOURCE_SCHEMA]
+
+RESULT_FORMATS = ("csv", "parquet", "arrow")
+RESULT_WRITE_BATCH = 1024  # 한 번에 모아 기록할 결과 수 (메모리 상한)
+
+# result_to_csv_row에서 매번 스키마를 해석하지 않도록 EXTENDED_RESULT_SCHEMA 순서 그대로 연속 구간으로 미리 묶어 둠
+# (섹션, [(키, 목록 여부, 기본값)]) - 섹션이 ""이면 최상위 필드. 최상위 필드가 섹션 뒤에도 오므로 순서를 유지해야 함
+# 행/열 변환은 항상 확장 스키마로 만들고, include_source가 꺼져 있으면 앞의 CSV_HEADERS 열만 사용
+_CSV_SEGMENTS: List[Tuple[str, List[Tuple[str, bool, Any]]]] = []
+for _section, _key, _kind in EXTENDED_RESULT_SCHEMA:
+    if not _CSV_SEGMENTS or _CSV_SEGMENTS[-1][0] != _section:
+        _CSV_SEGMENTS.append((_section, []))
+    _CSV_SEGMENTS[-1][1].append((_key, _kind == "list", 0 if _kind == "score" else ""))
+
+def _csv_join(data: Any) -> str:
+    if isinstance(data, (list, tuple)):
+        return ",".join(str(item) for item in data)
+    return str(data) if data else ""
+
+def result_to_csv_row(result: Union[Dict[str, Any], "ClassificationResult"],
+                      include_source: bool = False) -> List[Any]:
+    """
+    분류 결과 하나를 CSV_HEADERS 순서의 행(list)으로 변환합니다.
+    include_source이면 EXTENDED_CSV_HEADERS 순서(분류 출처/신뢰도 포함)입니다.
+    """
+    if isinstance(result, ClassificationResult):
+        return result.to_csv_row(include_source)
+    row: List[Any] = []
+    for section, fields in _CSV_SEGMENTS:
+        values = (result.get(section) or {}) if section else result
+        row.extend([_csv_join(values.get(key)) if is_list else values.get(key, default)
+                    for key, is_list, default in fields])
+    return row if include_source else row[:len(CSV_HEADERS)]
+
+# 결과 묶음을 열 단위로 다루기 위한 구간 정의. 같은 섹션의 연속된 점수는 itemgetter 하나로 꺼낸다.
+# ("text", 키, 목록 여부) | ("section_text", 섹션, 키) | ("scores", 섹션, itemgetter)
+_COLUMN_SEGMENTS: List[Tuple[str, str, Any]] = []
+for _section, _key, _kind in EXTENDED_RESULT_SCHEMA:
+    if _kind == "score":
+        if _COLUMN_SEGMENTS and _COLUMN_SEGMENTS[-1][0] == "scores" and _COLUMN_SEGMENTS[-1][1] == _section:
+            _COLUMN_SEGMENTS[-1][2].append(_key)
+        else:
+            _COLUMN_SEGMENTS.append(("scores", _section, [_key]))
+    elif _section:
+        _COLUMN_SEGMENTS.append(("section_text", _section, _key))
+    else:
+        _COLUMN_SEGMENTS.append(("text", _key, _kind == "list"))
+_COLUMN_SEGMENTS = [
+    (kind, name, (operator.itemgetter(*arg) if len(arg) > 1 else lambda d, k=arg[0]: (d[k],)) if kind == "scores" else arg)
+    for kind, name, arg in _COLUMN_SEGMENTS
+]
+_COLUMN_KINDS = [kind for _, _, kind in EXTENDED_RESULT_SCHEMA]
+
+def _csv_join_column(values: List[Any]) -> List[str]:
+    if set(map(type, values)) <= {list, tuple}:
+        try:
+            return list(map(",".join, values))  # 모두 문자열 목록이면 한 번에 이어 붙임
+        except TypeError:
+            pass
+    return list(map(_csv_join, values))
+
+def _dict_columns(results: List[Dict[str, Any]]) -> Optional[List[List[Any]]]:
+    """
+    결과 dict 묶음을 EXTENDED_RESULT_SCHEMA 순서의 열 목록으로 바꿉니다. 목록 필드는 쉼표로 이은 문자열이 됩니다.
+    map/itemgetter로 처리하여 행마다 파이썬 코드를 거의 실행하지 않습니다. 섹션이 없거나 dict가 아니면 None.
+    """
+    columns: List[List[Any]] = []
+    try:
+        for kind, name, arg in _COLUMN_SEGMENTS:
+            if kind == "text":
+                values = list(map(dict.get, results, itertools.repeat(name), itertools.repeat("")))
+                columns.append(_csv_join_column(values) if arg else values)
+            elif kind == "section_text":
+                sections = map(operator.itemgetter(name), results)
+                columns.append(list(map(dict.get, sections, itertools.repeat(arg), itertools.repeat(""))))
+            else:
+                sections = map(operator.itemgetter(name), results)
+                values = list(itertools.chain.from_iterable(map(arg, sections)))
+                width = len(values) // len(results)
+                columns.extend(values[offset::width] for offset in range(width))
+    except (KeyError, TypeError):
+        return None
+    return columns
+
+def _result_columns(results: List[Union[Dict[str, Any], "ClassificationResult"]],
+                    include_source: bool = False) -> List[List[Any]]:
+    """결과 묶음을 CSV_HEADERS(include_source이면 EXTENDED_CSV_HEADERS) 순서의 열 목록으로 바꿉니다. 값은 result_to_csv_row와 같습니다."""
+    columns = None
+    if all(type(result) is dict for result in results):
+        columns = _dict_columns(results)
+    elif all(isinstance(result, ClassificationResult) for result in results):
+        columns = _compact_columns(results)
+    if columns is None:
+        columns = [list(column) for column in zip(*(result_to_csv_row(result, True) for result in results))]
+    return columns if include_source else columns[:len(CSV_HEADERS)]
+
+class _ScoreText(dict):
+    """
+    점수 값 → CSV 문자열 캐시. 모델 점수는 서로 다른 값이 적어 float repr 비용을 대부분 없앤다.
+    1 == 1.0이므로 int와 float이 섞인 열은 (값, 타입)을 키로 쓰는 캐시를 따로 사용한다.
+    """
+    MAX_ENTRIES = 65536
+
+    def __missing__(self, key: Any) -> str:
+        value, value_type = key if type(key) is tuple else (key, type(key))
+        if value_type is not float and value_type is not int:
+            raise TypeError("숫자가 아닌 점수")  # 문자열/불리언 등은 _csv_text로 처리
+        text = repr(value)
+        # NaN은 키로 다시 찾을 수 없고, 0.0과 -0.0은 같은 키라 float 0은 저장하지 않음
+        if value == value and (value_type is int or value != 0) and len(self) < self.MAX_ENTRIES:
+            self[key] = text
+        return text
+
+_float_text = _ScoreText()        # float만 있는 열
+_score_text = _ScoreText()        # int/float이 섞인 열: (값, 타입) 키
+
+def _csv_text(value: Any) -> str:
+    # csv.writer(QUOTE_MINIMAL)와 같은 규칙
+    if type(value) is not str:
+        value = "" if value is None else str(value)
+    if "," in value or '"' in value or "\n" in value or "\r" in value:
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+def _csv_text_column(values: List[Any]) -> List[str]:
+    if None not in values:
+        values = list(map(str, values))
+        joined = "\x00".join(values)
+        if "," not in joined and '"' not in joined and "\n" not in joined and "\r" not in joined:
+            return values  # 따옴표 처리가 필요 없는 열은 그대로 사용
+    return list(map(_csv_text, values))
+
+def _csv_score_column(values: List[Any]) -> List[str]:
+    types = set(map(type, values))
+    try:
+        if types == {float}:
+            return list(map(_float_text.__getitem__, values))
+        if types == {int}:
+            return list(map(str, values))
+        return list(map(_score_text.__getitem__, zip(values, map(type, values))))
+    except TypeError:
+        return _csv_text_column(values)
+
+def _format_csv(columns: List[List[Any]]) -> str:
+    """열 목록을 csv.writer와 같은 형식의 CSV 텍스트로 만듭니다."""
+    texts = [
+        _csv_score_column(column) if kind == "score" else _csv_text_column(column)
+        for column, kind in zip(columns, _COLUMN_KINDS)
+    ]
+    return "\r\n".join(map(",".join, zip(*texts))) + "\r\n"
+
+def _load_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError as e:
+        raise RuntimeError("Parquet/Arrow 출력에는 pyarrow가 필요합니다. `pip install pyarrow`") from e
+    return pyarrow
+
+def _arrow_score(value: Any) -> Optional[float]:
+    return float(value) if isinstance(value, (int, float)) else None
+
+def _arrow_text(value: Any) -> Optional[str]:
+    return None if value is None else str(value)
+
+def _arrow_column(pa, values: List[Any], kind: str):
+    arrow_type = pa.float64() if kind == "score" else pa.string()
+    try:
+        return pa.array(values, type=arrow_type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError):
+        convert = _arrow_score if kind == "score" else _arrow_text
+        return pa.array([convert(value) for value in values], type=arrow_type)
+
+class ResultWriter:
+    """
+    분류 결과를 json_total.csv 컬럼 순서로 하나의 파일에 연속 기록합니다.
+    RESULT_WRITE_BATCH 행씩 모아 기록하므로 결과 수와 관계없이 메모리 사용량이 일정합니다.
+    output_format: "csv" (기본), "parquet", "arrow" (Arrow IPC 파일). parquet/arrow는 pyarrow가 필요합니다.
+    include_source이면 json_total.csv의 43열 뒤에 classification_source, confidence 열을 추가합니다.
+    """
+
+    def __init__(self, output, output_format: Optional[str] = None, batch_size: int = RESULT_WRITE_BATCH,
+                 include_source: bool = False):
+        self.format = output_format or result_format_for(output)
+        if self.format not in RESULT_FORMATS:
+            raise ValueError(f"지원하지 않는 출력 형식입니다: {self.format}")
+        self.include_source = include_source
+        self.headers = EXTENDED_CSV_HEADERS if include_source else CSV_HEADERS
+        self.batch_size = max(batch_size, 1)
+        self.rows_written = 0
+        self._pending: List[Any] = []
+
+        if self.format == "csv":
+            self._context = _open_output_csv(output)
+            self._file = self._context.__enter__()
+            csv.writer(self._file).writerow(self.headers)
+        else:
+            pa = _load_pyarrow()
+            self._arrow_schema = pa.schema([
+                (column, pa.float64() if kind == "score" else pa.string())
+                for column, kind in zip(self.headers, _COLUMN_KINDS)
+            ])
+            if self.format == "parquet":
+                self._arrow = pa.parquet.ParquetWriter(output, self._arrow_schema)
+            else:
+                self._arrow = pa.ipc.new_file(output, self._arrow_schema)
+
+    def write(self, result: Union[Dict[str, Any], "ClassificationResult"]) -> None:
+        self._pending.append(result)
+        self.rows_written += 1
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def write_many(self, results: Iterable[Union[Dict[str, Any], "ClassificationResult"]]) -> int:
+        """여러 결과를 기록하고 기록한 수를 반환합니다."""
+        count = 0
+        for result in results:
+            self.write(result)
+            count += 1
+        return count
+
+    def flush(self) -> None:
+        results, self._pending = self._pending, []
+        if not results:
+            return
+        # 행 단위 대신 열 단위로 변환하여 기록 (결과 수만큼 반복되는 파이썬 코드를 최소화)
+        started = time.perf_counter()
+        columns = _result_columns(results, self.include_source)
+        if self.format == "csv":
+            text = _format_csv(columns)
+            record_stage("flatten", time.perf_counter() - started, len(results))
+            self._file.write(text)
+        else:
+            pa = _load_pyarrow()
+            arrays = [_arrow_column(pa, column, kind) for column, kind in zip(columns, _COLUMN_KINDS)]
+            record_stage("flatten", time.perf_counter() - started, len(results))
+            self._arrow.write_batch(pa.record_batch(arrays, schema=self._arrow_schema))
+
+    def close(self) -> None:
+        self.flush()
+        if self.format == "csv":
+            self._context.__exit__(None, None, None)
+        else:
+            self._arrow.close()
+
+    def __enter__(self) -> "ResultWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+def result_format_for(output) -> str:
+    """출력 경로의 확장자로 형식을 정합니다. (.parquet / .arrow / .feather, 그 외는 csv)"""
+    if isinstance(output, (str, os.PathLike)):
+        suffix = os.path.splitext(os.fspath(output))[1].lower()
+        if suffix == ".parquet":
+            return "parquet"
+        if suffix in (".arrow", ".feather"):
+            return "arrow"
+    return "csv"
+
+def _open_output_csv(output_csv):
+    """출력 CSV를 엽니다. 파일 객체가 주어지면 그대로 사용합니다."""
+    if isinstance(output_csv, (str, os.PathLike)):
+        return open(output_csv, "w", newline="", encoding="utf-8-sig")
+    return contextlib.nullcontext(output_csv)
+
+def write_results(results: Iterable[Union[Dict[str, Any], "ClassificationResult"]],
+                  output,
+                  output_format: Optional[str] = None,
+                  include_source: bool = False) -> int:
+    """여러 결과를 json_total.csv 형식(또는 parquet/arrow)으로 기록하고 기록한 수를 반환합니다."""
+    with ResultWriter(output, output_format, include_source=include_source) as writer:
+        return writer.write_many(results)
+
+def convert_to_csv_format(result: Dict[str, Any]) -> str:
+    """JSON 결과를 CSV 형태로 변환합니다."""
+    output = io.StringIO()
+    write_results([result], output, "csv")
+    return output.getvalue()
+
+# =========================================================
+# 결과 표의 한국어 열 이름과 값 번역
+# =========================================================
+KOREAN_SECTIONS = {"motivation": "동기", "engagement": "참여도", "promo": "프로모션", "brand": "브랜드", "commerce": "상거래"}
+KOREAN_SOURCES = {"model": "Gemini", "rules": "규칙", "near_duplicate": "유사 광고"}
+_KOREAN_TOP_LEVEL_LABELS = {
+    "ad_type": "광고 유형", "ad_type_category": "카테고리", "ad_theme": "테마",
+    "target_age": "타겟 연령", "target_gender": "타겟 성별", "notes": "비고",
+    "ads_idx": "광고 번호", "ads_code": "광고 코드", "original_ads_name": "광고명",
+    "classification_source": "분류 출처", "confidence": "규칙 신뢰도",
+}
+# EXTENDED_CSV_HEADERS 열 이름 -> 결과 표의 한국어 열 이름 (예: motivation_fun -> 동기·재미)
+KOREAN_COLUMN_LABELS = {
+    header: (f"{KOREAN_SECTIONS[section]}·{KOREAN_SCORE_KEYS[section].get(key, key)}" if section
+             else _KOREAN_TOP_LEVEL_LABELS.get(key, key))
+    for header, (section, key, _) in zip(EXTENDED_CSV_HEADERS, EXTENDED_RESULT_SCHEMA)
+}
+# 값을 번역하는 열: (번역 표, 쉼표로 이은 목록 여부)
+_KOREAN_VALUE_TABLES: Dict[str, Tuple[Dict[str, str], bool]] = {
+    "ad_type": (KOREAN_AD_TYPES, False),
+    "ad_type_category": (KOREAN_CATEGORIES, True),
+    "ad_theme": (KOREAN_THEMES, True),
+    "target_age": (KOREAN_TARGET_AGES, False),
+    "target_gender": (KOREAN_TARGET_GENDERS, False),
+    "classification_source": (KOREAN_SOURCES, False),
+}
+
+def translate_column(column: str, values: Iterable[Any]) -> List[Any]:
+    """
+    결과 표(CSV_HEADERS 열) 한 열의 값을 한국어로 바꿉니다. 번역할 값이 없는 열은 그대로 반환합니다.
+    목록 열은 리스트 또는 쉼표로 이은 문자열을 받아 ", "로 이어 반환하고, 빈 값(None/NaN 포함)은 빈 문자열이 됩니다.
+    행마다 번역하지 않고 서로 다른 값마다 한 번만 번역하므로 수천 행도 열 하나에 수 밀리초면 끝납니다.
+    """
+    values = list(values)
+    spec = _KOREAN_VALUE_TABLES.get(column)
+    if spec is None:
+        return values
+    table, is_list = spec
+    translated: Dict[Any, str] = {}
+
+    def translate(value: Any) -> str:
+        if value is None or value != value:  # None / NaN
+            return ""
+        if isinstance(value, (list, tuple)):
+            items = [str(item) for item in value]
+        else:
+            text = str(value).strip()
+            if not text:
+                return ""
+            items = [item.strip() for item in text.split(",")] if is_list else [text]
+        return ", ".join(table.get(item, item) for item in items if item)
+
+    result = []
+    for value in values:
+        key = tuple(value) if isinstance(value, list) else value
+        try:
+            text = translated[key]
+        except KeyError:
+            text = translated[key] = translate(value)
+        except TypeError:  # 해시할 수 없는 값
+            text = translate(value)
+        result.append(text)
+    return result
+
+# =========================================================
+# 분류 결과 압축 표현
+# =========================================================
+RESULT_SECTIONS = ("motivation", "engagement", "promo", "brand", "commerce")
+
+# 숫자 점수 필드 (섹션, 키) - json_total.csv의 점수 컬럼 순서와 동일
+SCORE_FIELDS: Tuple[Tuple[str, str], ...] = tuple(
+    (section, key) for section, key, kind in RESULT_SCHEMA if kind == "score"
+)
+SCORE_INDEX = {field: i for i, field in enumerate(SCORE_FIELDS)}
+SCORE_DECIMALS = 7  # float32 유효 자릿수 안에서 원래 값을 복원하기 위한 반올림 자릿수 (복원되지 않는 값은 따로 보관)
+
+# 문자열 필드 (섹션이 없으면 최상위)
+_ENUM_FIELDS = (("", "ad_type"), ("", "target_age"), ("", "target_gender"), ("engagement", "session_length_expectation"))
+_LIST_FIELDS = ("ad_type_category", "ad_theme", "notes")
+_ID_FIELDS = ("ads_idx", "ads_code", "original_ads_name")
+_SOURCE_FIELDS = ("classification_source", "confidence")
+_KNOWN_TOP_LEVEL = ({name for section, name in _ENUM_FIELDS if not section} | set(_LIST_FIELDS) | set(_ID_FIELDS)
+                    | set(_SOURCE_FIELDS) | set(RESULT_SECTIONS))
+
+def _intern_value(value: Any) -> Any:
+    return sys.intern(value) if isinstance(value, str) else value
+
+_INTERNED_TUPLES_MAX = 65536
+_interned_tuples: Dict[tuple, tuple] = {}
+
+def _freeze_list(value: Any) -> Any:
+    # 리스트는 튜플로 바꾸고 같은 조합(ad_theme 등)은 같은 튜플 객체를 공유하게 함
+    if not isinstance(value, list):
+        return value
+    try:
+        frozen = tuple(_intern_value(item) for item in value)
+        shared = _interned_tuples.get(frozen)
+    except TypeError:  # 해시할 수 없는 원소 (dict 등)
+        return frozen
+    if shared is not None:
+        return shared
+    if len(_interned_tuples) < _INTERNED_TUPLES_MAX:
+        _interned_tuples[frozen] = frozen
+    return frozen
+
+def _thaw_list(value: Any) -> Any:
+    return list(value) if isinstance(value, tuple) else value
+
+_MISSING = object()
+
+# to_csv_row용: 컬럼마다 (속성 이름, 점수 인덱스, 목록 여부). 점수 컬럼은 속성 이름이 None
+_CSV_ROW_PLAN = [
+    (None, SCORE_INDEX[(section, key)], False) if kind == "score" else (key, -1, kind == "list")
+    for section, key, kind in EXTENDED_RESULT_SCHEMA
+]
+
+class ClassificationResult:
+    """
+    분류 결과 하나의 압축 표현입니다.
+    33개 숫자 점수는 float32 배열 하나(공유 행렬의 한 행일 수도 있음)에 담고,
+    ad_type / target_age / target_gender / session_length_expectation은 인턴된 문자열로 보관합니다.
+    from_dict / to_dict로 기존 JSON 결과와 손실 없이 변환됩니다.
+    float32에서 소수점 7자리 반올림으로 원래 값이 복원되지 않는 점수(0.123456789 등)는 원래 값을 extra에 함께 보관합니다.
+    """
+
+    __slots__ = ("scores", "int_mask", "ad_type", "target_age", "target_gender", "session_length_expectation",
+                 "ad_type_category", "ad_theme", "notes", "ads_idx", "ads_code", "original_ads_name",
+                 "classification_source", "confidence", "extra")
+
+    def __init__(self, scores: "np.ndarray", int_mask: int = 0, **fields: Any):
+        self.scores = scores
+        self.int_mask = int_mask
+        for name in self.__slots__[2:]:
+            setattr(self, name, fields.get(name, _MISSING))
+
+    @classmethod
+    def from_dict(cls, result: Dict[str, Any], out: Optional["np.ndarray"] = None) -> "ClassificationResult":
+        """
+        JSON 결과(dict)를 압축 표현으로 변환합니다.
+        out에 float32 배열(예: 공유 행렬의 한 행)을 주면 점수를 그 자리에 씁니다.
+        """
+        import numpy as np
+
+        scores = out if out is not None else np.empty(len(SCORE_FIELDS), dtype=np.float32)
+        scores.fill(np.nan)  # 없는 필드는 NaN
+        int_mask = 0
+        # 스키마에 없는 값: 최상위 필드는 이름(str), 섹션 안의 필드는 (섹션, 키) 튜플을 키로 사용
+        # (같은 문자열 공간을 쓰면 "promo.x" 같은 최상위 이름이 섹션 필드로 바뀌어 버림)
+        extra: Dict[Union[str, Tuple[str, str]], Any] = {}
+        assigned: List[Tuple[int, Any]] = []
+
+        for section in RESULT_SECTIONS:
+            values = result.get(section, _MISSING)
+            if values is _MISSING:
+                continue
+            if not isinstance(values, dict):
+                extra[section] = values
+                continue
+            for key, value in values.items():
+                index = SCORE_INDEX.get((section, key))
+                if index is not None and isinstance(value, (int, float)) and not isinstance(value, bool):
+                    scores[index] = value
+                    assigned.append((index, value))
+                    if isinstance(value, int):
+                        int_mask |= 1 << index
+                elif (section, key) != ("engagement", "session_length_expectation"):
+                    extra[(section, key)] = value
+            if not values:
+                extra[section] = {}
+
+        if assigned:
+            # float32로 복원되지 않는 점수는 원래 값을 보관 (모델 점수는 대부분 소수점 2자리라 거의 없음)
+            indexes, originals = zip(*assigned)
+            restored = np.round(scores[list(indexes)].astype(np.float64), SCORE_DECIMALS)
+            for index, original, value in zip(indexes, originals, restored.tolist()):
+                if value != original:
+                    extra[SCORE_FIELDS[index]] = original
+
+        fields = {name: _intern_value(result.get(name, _MISSING)) for section, name in _ENUM_FIELDS if not section}
+        engagement = result.get("engagement")
+        fields["session_length_expectation"] = _intern_value(
+            engagement.get("session_length_expectation", _MISSING) if isinstance(engagement, dict) else _MISSING
+        )
+        for name in _LIST_FIELDS:
+            fields[name] = _freeze_list(result.get(name, _MISSING))
+        for name in _ID_FIELDS:
+            fields[name] = result.get(name, _MISSING)
+        for name in _SOURCE_FIELDS:
+            fields[name] = _intern_value(result.get(name, _MISSING))
+        for key, value in result.items():
+            if key not in _KNOWN_TOP_LEVEL:
+                extra[key] = value
+
+        return cls(scores, int_mask, extra=extra or None, **fields)
+
+    def score(self, section: str, key: str) -> float:
+        """점수 하나를 반환합니다. 없는 필드는 NaN입니다."""
+        return float(self.scores[SCORE_INDEX[(section, key)]])
+
+    def to_csv_row(self, include_source: bool = False) -> List[Any]:
+        """to_dict를 거치지 않고 CSV_HEADERS(include_source이면 EXTENDED_CSV_HEADERS) 순서의 행으로 변환합니다."""
+        import numpy as np
+
+        if self.extra:
+            # 점수 자리에 숫자가 아닌 값 등이 있으면 dict 경로와 결과를 맞춤
+            return result_to_csv_row(self.to_dict(), include_source)
+        values = np.round(self.scores.astype(np.float64), SCORE_DECIMALS).tolist()
+        row = []
+        for name, index, is_list in _CSV_ROW_PLAN:
+            if name is None:
+                value = values[index]
+                row.append(0 if value != value else int(value) if self.int_mask >> index & 1 else value)
+            else:
+                value = getattr(self, name)
+                row.append("" if value is _MISSING else _csv_join(value) if is_list else value)
+        return row if include_source else row[:len(CSV_HEADERS)]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """기존 JSON 결과(dict) 형태로 되돌립니다."""
+        import numpy as np
+
+        result: Dict[str, Any] = {}
+        for name in ("ad_type", "ad_type_category", "ad_theme", "target_age", "target_gender"):
+            value = getattr(self, name)
+            if value is not _MISSING:
+                result[name] = _thaw_list(value)
+
+        extra = self.extra or {}
+        values = np.round(self.scores.astype(np.float64), SCORE_DECIMALS).tolist()
+        sections: Dict[str, Dict[str, Any]] = {}
+        for index, (section, key) in enumerate(SCORE_FIELDS):
+            value = values[index]
+            if value != value:  # NaN: 원래 없던 필드
+                continue
+            sections.setdefault(section, {})[key] = int(value) if self.int_mask >> index & 1 else value
+        if self.session_length_expectation is not _MISSING:
+            sections.setdefault("engagement", {})["session_length_expectation"] = self.session_length_expectation
+        for name, value in extra.items():
+            if isinstance(name, tuple):
+                section, key = name
+                sections.setdefault(section, {})[key] = value
+
+        for section in RESULT_SECTIONS:
+            if section in extra:
+                result[section] = extra[section]
+            elif section in sections:
+                result[section] = sections[section]
+
+        if self.notes is not _MISSING:
+            result["notes"] = _thaw_list(self.notes)
+        for name in _ID_FIELDS + _SOURCE_FIELDS:
+            value = getattr(self, name)
+            if value is not _MISSING:
+                result[name] = value
+        for name, value in extra.items():
+            if isinstance(name, str) and name not in RESULT_SECTIONS:
+                result[name] = value
+        return result
+
+def _compact_columns(results: List[ClassificationResult]) -> Optional[List[List[Any]]]:
+    """압축 결과 묶음을 EXTENDED_CSV_HEADERS 순서의 열 목록으로 바꿉니다. (_dict_columns의 ClassificationResult 버전)"""
+    import numpy as np
+
+    if any(result.extra for result in results):
+        return None
+    scores = np.round(np.stack([result.scores for result in results]).astype(np.float64), SCORE_DECIMALS)
+    masks = np.array([result.int_mask for result in results], dtype=np.uint64)
+    missing = np.isnan(scores)
+    as_int = ((masks[:, None] >> np.arange(len(SCORE_FIELDS), dtype=np.uint64)) & 1).astype(bool) | missing
+    values = scores.astype(object)
+    values[as_int] = np.where(missing, 0, scores)[as_int].astype(np.int64).astype(object)  # 없는 점수는 0
+
+    columns: List[List[Any]] = []
+    for name, index, is_list in _CSV_ROW_PLAN:
+        if name is None:
+            columns.append(values[:, index].tolist())
+        else:
+            column = list(map(operator.attrgetter(name), results))
+            if _MISSING in column:
+                column = ["" if value is _MISSING else value for value in column]
+            columns.append(_csv_join_column(column) if is_list else column)
+    return columns
+
+class ClassificationResultStore:
+    """
+    많은 분류 결과를 공유 float32 행렬 하나에 모아 보관합니다.
+    광고당 점수 132바이트와 인턴된 문자열 참조만 사용하므로, 결과 dict를 그대로 쌓는 것보다 훨씬 작습니다.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        import numpy as np
+
+        self._scores = np.empty((max(capacity, 1), len(SCORE_FIELDS)), dtype=np.float32)
+        self._results: List[ClassificationResult] = []
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def append(self, result: Dict[str, Any]) -> int:
+        """결과를 추가하고 인덱스를 반환합니다."""
+        index = len(self._results)
+        if index == len(self._scores):
+            self._grow()
+        self._results.append(ClassificationResult.from_dict(result, out=self._scores[index]))
+        return index
+
+    def _grow(self) -> None:
+        import numpy as np
+
+        scores = np.empty((len(self._scores) * 2, len(SCORE_FIELDS)), dtype=np.float32)
+        scores[:len(self._scores)] = self._scores
+        self._scores = scores
+        # 기존 결과가 새 행렬의 행을 가리키도록 다시 연결
+        for index, item in enumerate(self._results):
+            item.scores = scores[index]
+
+    def __getitem__(self, index: int) -> ClassificationResult:
+        return self._results[index]
+
+    def __iter__(self) -> Iterator[ClassificationResult]:
+        return iter(self._results)
+
+    @property
+    def scores(self) -> "np.ndarray":
+        """(결과 수 × 33) float32 점수 행렬"""
+        return self._scores[:len(self._results)]
+
+# =========================================================
+# 규칙 기반 빠른 분류 (명확한 광고는 Gemini 호출 없이 처리)
+# =========================================================
+RULE_FAST_PATH = os.getenv("IVE_RULE_FAST_PATH", "0") == "1"                # 기본 사용 여부 (기본 끔: 켜야 규칙 결과 사용)
+RULE_CONFIDENCE_THRESHOLD = float(os.getenv("IVE_RULE_CONFIDENCE", "0.85"))  # 이 값 이상일 때만 규칙 결과 사용
+RULE_TEXT_FIELDS = ("ads_name", "ads_summary", "ads_guide")
+
+# 광고 유형 키워드: (ad_type, 키워드 정규식들, 신뢰도)
+AD_TYPE_KEYWORDS: Tuple[Tuple[str, Tuple[str, ...], float], ...] = (
+    ("1", ("설치", "다운로드", "install"), 0.75),
+    ("2", ("실행", "접속"), 0.6),
+    ("3", ("참여", "가입", "신청", "응모", "상담"), 0.6),
+    ("4", ("클릭",), 0.7),
+    ("5", ("페이스북", "페북", "facebook"), 0.9),
+    ("6", ("트위터", "twitter"), 0.9),
+    ("7", ("인스타", "instagram"), 0.9),
+    ("9", ("퀘스트", r"레벨\s*달성", r"단계\s*달성"), 0.75),
+    ("10", ("유튜브", "youtube"), 0.9),
+    ("11", ("네이버", "naver", "스마트스토어"), 0.8),
+    ("12", ("구매", "주문", "최저가", "장바구니"), 0.8),
+)
+
+# 도메인 키워드: (도메인, 키워드 정규식들). "reward"는 다른 도메인이 없을 때만 도메인으로 취급
+DOMAIN_KEYWORDS: Tuple[Tuple[str, Tuple[str, ...]], ...] = (
+    ("game", ("게임", "rpg", "던전", "퍼즐", "캐릭터", "길드", "전투", "모험", "영웅", "방치형")),
+    ("shopping", ("쇼핑", "최저가", "특가", "할인", "상품", "배송", "장바구니")),
+    ("finance", ("대출", "보험", "카드", "증권", "투자", "적금", "예금", "은행", "금리", "주식", "코인", "가상화폐", "펀드", "계좌")),
+    ("education", ("학습", "강의", "교육", "공부", "자격증", "클래스")),
+    ("healthcare", ("건강", "병원", "의료", "영양제", "다이어트", "약국")),
+    ("content", ("웹툰", "영화", "드라마", "음악", "동영상", "소설")),
+    ("quiz", ("퀴즈", "정답")),
+    ("reward", ("적립", "보상", "리워드", "포인트", "캐시백")),
+)
+
+# 키워드가 있으면 점수 하한을 올림: (키워드 정규식들, {(섹션, 키): 값}, 테마)
+KEYWORD_SCORES: Tuple[Tuple[Tuple[str, ...], Dict[Tuple[str, str], float], Optional[str]], ...] = (
+    (("적립", "보상", "리워드", "포인트", "캐시백"), {("motivation", "rewards"): 1}, "rewards"),
+    (("할인", "최저가", "특가"), {("motivation", "savings"): 1, ("commerce", "price_sensitivity"): 0.9}, "savings_benefit"),
+    (("공식", "인증"), {("motivation", "trust"): 1, ("brand", "trust_in_official"): 0.6}, "trust"),
+    ((r"무료\s*체험", "체험판", r"새로운\s*기능"), {("motivation", "curiosity"): 1, ("promo", "trial_experience_sensitive"): 0.8}, "curiosity"),
+    (("쿠폰", "이벤트"), {("promo", "coupon_event_sensitive"): 0.8}, None),
+    (("한정", "마감", "오늘만", "선착순"), {("promo", "fomo_sensitive"): 0.8}, "urgency"),
+    (("단독", "독점", r"회원\s*전용"), {("promo", "exclusive_benefit_sensitive"): 0.8}, None),
+    (("rpg",), {("motivation", "growth"): 0.6, ("engagement", "hardcore_score"): 0.6}, "fantasy"),
+    (("투자", "주식", "코인", "가상화폐"), {("commerce", "risk_tolerance"): 0.8}, None),
+    (("대출", "보험"), {("commerce", "big_purchase_intent"): 0.7}, "safety_net"),
+    (("구독", r"정기\s*결제"), {("commerce", "recurring_payment"): 1, ("motivation", "habit_building"): 0.5}, None),
+    ((r"친구\s*초대", "공유하"), {("motivation", "social"): 0.6}, "social"),
+    (("출석", "매일"), {("motivation", "habit_building"): 0.6, ("engagement", "frequency_score"): 0.7}, "habit_building"),
+    (("삼성", "현대", "lg", "롯데", "카카오", "신한", "kb국민", "우리은행", "하나은행", "아모레퍼시픽", "cj"),
+     {("brand", "brand_loyalty"): 0.5, ("brand", "trust_in_official"): 0.5, ("brand", "local_trust_factor"): 1}, None),
+)
+
+# 키워드가 있으면 점수 상한을 내림 (보험은 리스크 회피)
+KEYWORD_CAPS: Tuple[Tuple[Tuple[str, ...], Dict[Tuple[str, str], float]], ...] = (
+    (("보험",), {("commerce", "risk_tolerance"): 0.1}),
+)
+
+GENDER_KEYWORDS: Tuple[Tuple[str, Tuple[str, ...]], ...] = (
+    ("female_focus", ("여성", "뷰티", "메이크업", "화장품", "네일")),
+    ("male_focus", ("남성", "면도", "밀리터리")),
+)
+
+# 도메인별 기본값 (분류 프롬프트의 점수 판정 기준을 옮긴 것)
+DOMAIN_PROFILES: Dict[str, Dict[str, Any]] = {
+    "game": {
+        "category": "2", "themes": ["fun", "growth"], "session": "medium",
+        "scores": {("motivation", "fun"): 0.8, ("motivation", "growth"): 0.4, ("motivation", "rewards"): 0.3,
+                   ("engagement", "casual_score"): 0.5, ("engagement", "hardcore_score"): 0.4,
+                   ("engagement", "frequency_score"): 0.6, ("engagement", "retention_potential"): 0.6,
+                   ("promo", "install_reward_sensitive"): 0.5},
+    },
+    "shopping": {
+        "category": "11", "themes": ["savings_benefit", "rewards"], "session": "short",
+        "scores": {("motivation", "savings"): 0.3, ("motivation", "rewards"): 0.3, ("commerce", "price_sensitivity"): 0.6,
+                   ("commerce", "transaction_frequency"): 0.5, ("promo", "coupon_event_sensitive"): 0.4,
+                   ("engagement", "casual_score"): 0.6},
+    },
+    "finance": {
+        "category": "7", "themes": ["trust", "security_privacy"], "session": "short", "age": "thirties",
+        "scores": {("motivation", "trust"): 0.5, ("motivation", "safety_net"): 0.3, ("brand", "trust_in_official"): 0.3,
+                   ("brand", "brand_loyalty"): 0.3, ("commerce", "big_purchase_intent"): 0.3},
+    },
+    "education": {
+        "category": "1", "themes": ["growth", "habit_building"], "session": "medium",
+        "scores": {("motivation", "growth"): 0.6, ("motivation", "habit_building"): 0.4,
+                   ("engagement", "retention_potential"): 0.5, ("commerce", "recurring_payment"): 0.3},
+    },
+    "healthcare": {
+        "category": "1", "themes": ["trust", "safety_net"], "session": "short",
+        "scores": {("motivation", "trust"): 0.5, ("motivation", "safety_net"): 0.4, ("motivation", "habit_building"): 0.3},
+    },
+    "content": {
+        "category": "1", "themes": ["fun", "curiosity"], "session": "medium",
+        "scores": {("motivation", "fun"): 0.5, ("motivation", "curiosity"): 0.4,
+                   ("engagement", "frequency_score"): 0.5, ("engagement", "retention_potential"): 0.4},
+    },
+    "quiz": {
+        "category": "4", "themes": ["curiosity", "rewards"], "session": "short",
+        "scores": {("motivation", "curiosity"): 0.6, ("motivation", "fun"): 0.4, ("motivation", "rewards"): 0.5,
+                   ("engagement", "casual_score"): 0.7},
+    },
+    "reward": {
+        "category": "1", "themes": ["rewards", "convenience"], "session": "short",
+        "scores": {("motivation", "convenience"): 0.4, ("motivation", "curiosity"): 0.2,
+                   ("promo", "install_reward_sensitive"): 0.6, ("engagement", "casual_score"): 0.6},
+    },
+}
+
+# 서로 잘 맞는 (광고 유형, 도메인) 조합은 신뢰도를 올림
+CONSISTENT_TYPE_DOMAINS = {
+    ("1", "game"), ("2", "game"), ("9", "game"), ("1", "reward"), ("2", "reward"), ("12", "shopping"),
+    ("3", "finance"), ("1", "finance"), ("3", "quiz"), ("1", "quiz"), ("1", "content"), ("1", "education"),
+    ("1", "healthcare"),
+}
+
+def _target_age_from_range(age_min: str, age_max: str) -> Optional[str]:
+    """입력된 연령 범위가 명시적이면 target_age 값으로 바꿉니다. (기본값 0~100은 명시 없음)"""
+    try:
+        low, high = int(float(age_min or 0)), int(float(age_max or 100))
+    except ValueError:
+        return None
+    if low <= 14 and high >= 60:
+        return None
+    if high <= 19:
+        return "teens"
+    for decade, label in ((20, "twenties"), (30, "thirties"), (40, "forties"), (50, "fifties")):
+        if decade <= low and high < decade + 10:
+            return label
+    return "adults" if low >= 19 else None
+
+def _rule_score(value: float) -> Union[int, float]:
+    return value if value % 1 else int(value)
+
+# 섹션별 점수 필드 (결과 dict를 만들 때 매번 SCORE_FIELDS를 거르지 않도록)
+_RULE_SECTION_FIELDS = [(section, [(key, (s, key)) for s, key in SCORE_FIELDS if s == section])
+                        for section in RESULT_SECTIONS]
+
+class RuleClassifier:
+    """
+    키워드/정규식 색인으로 광고를 분류하는 규칙 기반 분류기입니다.
+    모든 키워드를 정규식 하나로 묶어 광고 텍스트를 한 번만 훑고, 찾은 문자열은 dict로 규칙에 연결합니다.
+    (키워드마다 이름 있는 그룹을 두면 그룹 수만큼 매칭이 느려짐)
+    classify()는 항상 전체 스키마 결과와 신뢰도(confidence)를 반환하며, 사용 여부는 호출하는 쪽에서 정합니다.
+    """
+
+    def __init__(self):
+        # 키워드 → 그 키워드를 쓰는 규칙 목록. 같은 키워드가 여러 규칙에 있어도 한 번만 색인
+        self._keyword_rules: Dict[str, List[Tuple[str, int]]] = {}
+        rule_tables = (("type", [keywords for _, keywords, _ in AD_TYPE_KEYWORDS]),
+                       ("domain", [keywords for _, keywords in DOMAIN_KEYWORDS]),
+                       ("score", [keywords for keywords, _, _ in KEYWORD_SCORES]),
+                       ("cap", [keywords for keywords, _ in KEYWORD_CAPS]),
+                       ("gender", [keywords for _, keywords in GENDER_KEYWORDS]))
+        for kind, table in rule_tables:
+            for rule_index, keywords in enumerate(table):
+                for keyword in keywords:
+                    self._keyword_rules.setdefault(keyword.lower(), []).append((kind, rule_index))
+        # 정규식 키워드(공백 허용 등)는 찾은 문자열과 바로 대응되지 않으므로 따로 확인
+        self._pattern_keywords = [(re.compile(keyword), keyword) for keyword in self._keyword_rules
+                                  if re.escape(keyword) != keyword]
+        # 긴 키워드를 먼저 시도하여 "무료 체험"이 "체험판"보다 우선하도록 함
+        ordered = sorted(self._keyword_rules, key=len, reverse=True)
+        self._index = re.compile("|".join(ordered), re.IGNORECASE)
+
+    def _rules_for(self, keyword: str) -> List[Tuple[str, int]]:
+        rules = self._keyword_rules.get(keyword)
+        if rules is None:
+            for pattern, source in self._pattern_keywords:
+                if pattern.fullmatch(keyword):
+                    return self._keyword_rules[source]
+            return []
+        return rules
+
+    def _scan(self, text: str) -> Tuple[Dict[str, set], Dict[int, set], List[str]]:
+        """텍스트에서 찾은 키워드로 (종류별 규칙 인덱스, 도메인별 키워드, 찾은 키워드 순서)를 반환합니다."""
+        hits: Dict[str, set] = {"type": set(), "domain": set(), "score": set(), "cap": set(), "gender": set()}
+        domain_keywords: Dict[int, set] = {}
+        notes: List[str] = []
+        for keyword in self._index.findall(text):
+            if keyword in notes:
+                continue
+            notes.append(keyword)
+            for kind, rule_index in self._rules_for(keyword.lower()):
+                hits[kind].add(rule_index)
+                if kind == "domain":
+                    domain_keywords.setdefault(rule_index, set()).add(keyword.lower())
+        return hits, domain_keywords, notes
+
+    def classify(self, ad_data: Dict[str, str]) -> Dict[str, Any]:
+        """광고를 규칙으로 분류합니다. 결과에는 classification_source="rules"와 confidence(0~1)가 포함됩니다."""
+        text = "\n".join(ad_data.get(field, "") or "" for field in RULE_TEXT_FIELDS)
+        hits, domain_keywords, notes = self._scan(text)
+
+        # 도메인: 키워드 수가 가장 많은 도메인, 경쟁 도메인이 있으면 신뢰도 감소
+        counts = sorted(((len(words), DOMAIN_KEYWORDS[i][0]) for i, words in domain_keywords.items()
+                         if DOMAIN_KEYWORDS[i][0] != "reward"), reverse=True)
+        reward_hits = next((len(words) for i, words in domain_keywords.items()
+                            if DOMAIN_KEYWORDS[i][0] == "reward"), 0)
+        if counts:
+            domain_hits, domain = counts[0]
+            runner_up = counts[1][0] if len(counts) > 1 else 0
+        elif reward_hits:
+            domain_hits, domain, runner_up = reward_hits, "reward", 0
+        else:
+            domain_hits, domain, runner_up = 0, None, 0
+
+        # 광고 유형: 사용자 지정 값이 있으면 그대로, 없으면 키워드로 판단
+        user_type = str(ad_data.get("ad_type", "") or "").strip()
+        if user_type:
+            ad_type, type_confidence = user_type, 0.95
+        else:
+            candidates = sorted(
+                ((AD_TYPE_KEYWORDS[i][2] + (0.15 if (AD_TYPE_KEYWORDS[i][0], domain) in CONSISTENT_TYPE_DOMAINS else 0),
+                  AD_TYPE_KEYWORDS[i][0]) for i in hits["type"]),
+                reverse=True
+            )
+            if candidates:
+                type_confidence, ad_type = candidates[0]
+                if len(candidates) > 1 and candidates[1][0] >= type_confidence - 0.1:
+                    type_confidence -= 0.2  # 비슷한 강도의 다른 유형 키워드가 함께 있음
+            else:
+                ad_type, type_confidence = "", 0.2
+
+        if domain is None:
+            domain_confidence = 0.4
+        else:
+            domain_confidence = 0.7 + 0.1 * min(domain_hits, 2)
+            if (ad_type, domain) in CONSISTENT_TYPE_DOMAINS:
+                domain_confidence += 0.05
+            if runner_up:
+                domain_confidence -= 0.3 if runner_up >= domain_hits else 0.15
+        confidence = round(max(0.0, min(type_confidence, domain_confidence, 1.0)), 2)
+
+        # 점수: 도메인 기본값 → 키워드 하한 → 키워드 상한
+        profile = DOMAIN_PROFILES.get(domain or "", {})
+        scores: Dict[Tuple[str, str], float] = dict.fromkeys(SCORE_FIELDS, 0.0)
+        scores.update(profile.get("scores", {}))
+        themes: List[str] = list(profile.get("themes", []))
+        for i in sorted(hits["score"]):
+            keywords, floors, theme = KEYWORD_SCORES[i]
+            for field, value in floors.items():
+                scores[field] = max(scores[field], value)
+            if theme and theme not in themes:
+                themes.append(theme)
+        for i in hits["cap"]:
+            for field, value in KEYWORD_CAPS[i][1].items():
+                scores[field] = min(scores[field], value)
+
+        genders = {GENDER_KEYWORDS[i][0] for i in hits["gender"]}
+        user_category = str(ad_data.get("ad_type_category", "") or "").strip()
+        category = user_category or profile.get("category", "")
+        target_age = (_target_age_from_range(ad_data.get("ads_age_min", ""), ad_data.get("ads_age_max", ""))
+                      or profile.get("age") or "all_ages")
+
+        result: Dict[str, Any] = {
+            "ad_type": ad_type,
+            "ad_type_category": [category] if category else [],
+            "ad_theme": themes[:5],
+            "target_age": target_age,
+            "target_gender": genders.pop() if len(genders) == 1 else "neutral",
+        }
+        for section, fields in _RULE_SECTION_FIELDS:
+            result[section] = {key: _rule_score(scores[field]) for key, field in fields}
+        result["engagement"]["session_length_expectation"] = profile.get("session", "short")
+        result["notes"] = notes[:6]
+        result["classification_source"] = "rules"
+        result["confidence"] = confidence
+        return result
+
+@shared_resource
+def get_rule_classifier() -> RuleClassifier:
+    """프로세스 전체에서 공유하는 규칙 분류기 (색인은 처음 한 번만 만듦)"""
+    return RuleClassifier()
+
+def classify_ad_by_rules(ad_data: Dict[str, str]) -> Dict[str, Any]:
+    """규칙 기반으로 광고를 분류합니다. 신뢰도와 관계없이 결과를 반환합니다."""
+    return _attach_ad_fields(get_rule_classifier().classify(ad_data), ad_data)
+
+def confident_rule_result(ad_data: Dict[str, str],
+                          use_rules: Optional[bool] = None,
+                          threshold: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    """규칙 기반 결과의 신뢰도가 임계값 이상이면 그 결과를, 아니면 None을 반환합니다."""
+    if not (RULE_FAST_PATH if use_rules is None else use_rules):
+        return None
+    result = classify_ad_by_rules(ad_data)
+    return result if result["confidence"] >= (RULE_CONFIDENCE_THRESHOLD if threshold is None else threshold) else None
+
+# =========================================================
+# 구조화 출력 (responseMimeType + responseSchema)
+# =========================================================
+# 응답 형식
+#   text:    프롬프트의 스키마 설명만으로 JSON을 요청 (기존 방식, 코드 펜스가 붙거나 잘린 응답은 복구해서 해석)
+#   schema:  responseMimeType=application/json과 분류 스키마에서 만든 responseSchema로 형식을 강제
+#   compact: schema와 같되 필드 이름을 짧은 키(COMPACT_KEYS)로 받아 출력 토큰을 줄이고, 받은 뒤 원래 이름으로 펼침
+OUTPUT_MODES = ("text", "schema", "compact")
+GEMINI_OUTPUT_MODE = os.getenv("GEMINI_OUTPUT_MODE", "text")
+SCHEMA_MAX_LIST_ITEMS = int(os.getenv("GEMINI_SCHEMA_MAX_LIST_ITEMS", "5"))  # ad_theme, notes 등 목록 필드의 최대 원소 수
+
+# 값이 정해진 필드 (분류 규칙의 선택지와 동일)
+SCHEMA_ENUMS: Dict[str, Tuple[str, ...]] = {
+    "ad_type": tuple(str(n) for n in range(1, 13)),
+    "ad_type_category": ("0", "1", "2", "3", "4", "5", "6", "7", "8", "10", "11", "12", "13"),
+    "target_age": ("all_ages", "teens", "twenties", "thirties", "forties", "fifties", "adults"),
+    "target_gender": ("neutral", "female_focus", "male_focus"),
+    "session_length_expectation": ("short", "medium", "long"),
+}
+
+# 원래 이름 -> 짧은 키 (섹션과 필드를 통틀어 겹치지 않음)
+COMPACT_KEYS: Dict[str, str] = {
+    "ad_type": "t", "ad_type_category": "tc", "ad_theme": "th", "target_age": "ag", "target_gender": "gd",
+    "notes": "n",
+    "motivation": "m", "engagement": "e", "promo": "p", "brand": "b", "commerce": "c",
+    "fun": "fu", "social": "so", "rewards": "rw", "savings": "sv", "trust": "tr", "convenience": "cv",
+    "growth": "gr", "status_display": "sd", "curiosity": "cu", "habit_building": "hb", "safety_net": "sn",
+    "casual_score": "ca", "hardcore_score": "hc", "frequency_score": "fq", "multi_app_usage": "ma",
+    "retention_potential": "rp", "session_length_expectation": "sl",
+    "install_reward_sensitive": "ir", "coupon_event_sensitive": "ce", "fomo_sensitive": "fo",
+    "exclusive_benefit_sensitive": "eb", "trial_experience_sensitive": "te",
+    "brand_loyalty": "bl", "nostalgia": "no", "trust_in_official": "to", "award_proof_sensitive": "ap",
+    "local_trust_factor": "lt", "global_trust_factor": "gt",
+    "price_sensitivity": "ps", "premium_willingness": "pw", "transaction_frequency": "tf",
+    "risk_tolerance": "rt", "recurring_payment": "rc", "big_purchase_intent": "bp",
+}
+_EXPANDED_KEYS = {alias: name for name, alias in COMPACT_KEYS.items()}
+
+# 모델이 채우는 필드 (광고 식별 정보와 분류 출처는 로컬에서 붙임). 최상위 필드, 섹션, notes 순서로 출력
+_MODEL_TOP_FIELDS = [(key, kind) for section, key, kind in RESULT_SCHEMA
+                     if not section and key not in _ID_FIELDS + _SOURCE_FIELDS + ("notes",)]
+_MODEL_SECTION_FIELDS = [(section, [(key, kind) for s, key, kind in RESULT_SCHEMA if s == section])
+                         for section in RESULT_SECTIONS]
+
+def _output_mode(output_mode: Optional[str]) -> str:
+    output_mode = output_mode or GEMINI_OUTPUT_MODE
+    if output_mode not in OUTPUT_MODES:
+        raise ValueError(f"지원하지 않는 응답 형식입니다: {output_mode}")
+    return output_mode
+
+def _object_schema(properties: List[Tuple[str, Dict[str, Any]]]) -> Dict[str, Any]:
+    names = [name for name, _ in properties]
+    return {"type": "OBJECT", "properties": dict(properties), "required": names, "propertyOrdering": names}
+
+def _field_schema(key: str, kind: str, compact: bool) -> Dict[str, Any]:
+    enum = SCHEMA_ENUMS.get(key)
+    if kind == "score":
+        schema: Dict[str, Any] = {"type": "NUMBER", "minimum": 0, "maximum": 1}
+    elif kind == "list":
+        item: Dict[str, Any] = {"type": "STRING", "format": "enum", "enum": list(enum)} if enum else {"type": "STRING"}
+        schema = {"type": "ARRAY", "items": item, "maxItems": SCHEMA_MAX_LIST_ITEMS}
+    elif enum:
+        schema = {"type": "STRING", "format": "enum", "enum": list(enum)}
+    else:
+        schema = {"type": "STRING"}
+    if compact:
+        schema["description"] = key  # 짧은 키가 어떤 필드인지 모델에 알려 줌
+    return schema
+
+def classification_response_schema(output_mode: Optional[str] = None, packed: bool = False) -> Dict[str, Any]:
+    """
+    RESULT_SCHEMA에서 Gemini responseSchema(OpenAPI 부분집합)를 만듭니다.
+    compact이면 속성 이름을 COMPACT_KEYS의 짧은 키로 바꾸고, packed이면 "id"가 붙은 객체의 배열입니다.
+    반환한 dict는 요청마다 공유하므로 고치지 마세요.
+    """
+    return _response_schema(_output_mode(output_mode), packed)
+
+# 응답 형식별로 한 번만 만들고 공유 (GEMINI_OUTPUT_MODE가 바뀌어도 맞는 값을 쓰도록 형식을 확정한 뒤 조회)
+@functools.lru_cache(maxsize=None)
+def _response_schema(output_mode: str, packed: bool) -> Dict[str, Any]:
+    compact = output_mode == "compact"
+    name = COMPACT_KEYS.get if compact else (lambda key, default=None: key)
+
+    def field(key: str, kind: str) -> Tuple[str, Dict[str, Any]]:
+        return name(key, key), _field_schema(key, kind, compact)
+
+    properties = [field(key, kind) for key, kind in _MODEL_TOP_FIELDS]
+    for section, fields in _MODEL_SECTION_FIELDS:
+        section_schema = _object_schema([field(key, kind) for key, kind in fields])
+        if compact:
+            section_schema["description"] = section
+        properties.append((name(section, section), section_schema))
+    properties.append(field("notes", "list"))
+    if not packed:
+        return _object_schema(properties)
+    return {"type": "ARRAY", "items": _object_schema([("id", {"type": "STRING"})] + properties)}
+
+def classification_generation_config(output_mode: Optional[str] = None,
+                                     packed: bool = False,
+                                     max_output_tokens: Optional[int] = None) -> Dict[str, Any]:
+    """응답 형식에 맞는 generationConfig를 반환합니다. text이고 기본 토큰 한도이면 GENERATION_CONFIG 그대로입니다."""
+    return _generation_config(_output_mode(output_mode), packed, max_output_tokens)
+
+@functools.lru_cache(maxsize=None)
+def _generation_config(output_mode: str, packed: bool, max_output_tokens: Optional[int]) -> Dict[str, Any]:
+    config = dict(GENERATION_CONFIG)
+    if max_output_tokens is not None:
+        config["maxOutputTokens"] = max_output_tokens
+    if output_mode != "text":
+        config["responseMimeType"] = "application/json"
+        config["responseSchema"] = _response_schema(output_mode, packed)
+    return GENERATION_CONFIG if config == GENERATION_CONFIG else config
+
+def classification_instructions(output_mode: Optional[str] = None, packed: bool = False) -> str:
+    """응답 형식에 맞는 분류 지시문입니다. compact이면 마지막 지시문 앞에 짧은 키 대응표를 넣습니다."""
+    return _instructions(_output_mode(output_mode), packed)
+
+@functools.lru_cache(maxsize=None)
+def _instructions(output_mode: str, packed: bool) -> str:
+    base = create_packed_classification_prompt() if packed else create_classification_prompt()
+    if output_mode != "compact":
+        return base
+    legend = ", ".join(f"{name}={alias}" for name, alias in COMPACT_KEYS.items())
+    return base[:base.rfind("\n")] + f"""
+{8 if packed else 7}. 짧은 키 출력
+- 응답 JSON의 키는 위 스키마의 필드 이름 대신 아래 대응표의 짧은 키를 사용합니다. (필드 이름=짧은 키)
+- {legend}
+- 값을 정하는 기준은 필드 이름을 쓸 때와 같습니다.
+
+""" + base[base.rfind("\n") + 1:]
+
+def expand_compact_keys(data: Any) -> Any:
+    """
+    짧은 키로 받은 분류 결과(객체 또는 객체 배열)의 키를 원래 필드 이름으로 펼칩니다.
+    대응표에 없는 키("id" 등)는 그대로 두고, 목록 안의 문자열 값은 바꾸지 않습니다.
+    """
+    if isinstance(data, list):
+        return [expand_compact_keys(item) if isinstance(item, dict) else item for item in data]
+    if not isinstance(data, dict):
+        return data
+    return {_EXPANDED_KEYS.get(key, key): expand_compact_keys(value) if isinstance(value, dict) else value
+            for key, value in data.items()}
+
+def decode_classification_output(data: Any, output_mode: Optional[str] = None) -> Any:
+    """응답 형식에 따라 모델 출력을 원래 필드 이름의 결과로 바꿉니다."""
+    return expand_compact_keys(data) if _output_mode(output_mode) == "compact" else data
+
+def classification_request(ad_data: Dict[str, str], output_mode: Optional[str] = None) -> Tuple[str, Dict[str, Any]]:
+    """
+    광고 하나를 분류하는 요청의 (결과 캐시 키, call_gemini_json 인자)를 만듭니다.
+    캐시 키에는 generationConfig(응답 스키마 포함)와 분류 모델 목록이 들어가므로
+    응답 형식이나 cascade 구성마다 결과를 따로 보관합니다.
+    """
+    output_mode = _output_mode(output_mode)
+    instructions = classification_instructions(output_mode)
+    generation_config = classification_generation_config(output_mode)
+    user_text = _ad_user_text(ad_data)
+    cache_key = classification_cache_key(instructions + "\n\n" + user_text, model=",".join(classification_models()),
+                                         generation_config=generation_config)
+    return cache_key, {**gemini_prompt_args(instructions, user_text), "generation_config": generation_config}
+
+def classification_fingerprint(output_mode: Optional[str] = None) -> str:
+    """
+    분류 결과를 만든 설정의 지문: 분류 지시문(개별/묶음), 지시문 전달 방식, 응답 형식과 generationConfig, 분류 모델 목록.
+    결과 캐시 키와 같은 입력으로 만들므로 프롬프트나 모델이 바뀌면 달라집니다.
+    유사 광고 인덱스와 증분 분류 manifest가 이전 설정으로 만든 결과를 재사용하지 않도록 사용합니다.
+    """
+    output_mode = _output_mode(output_mode)
+    return classification_cache_key(
+        "\n\n".join(classification_instructions(output_mode, packed=packed) for packed in (False, True)),
+        model=",".join(classification_models()),
+        generation_config={"single": classification_generation_config(output_mode),
+                           "packed": classification_generation_config(output_mode, packed=True)},
+    )
+
+# =========================================================
+# 모델 단계적 상향 (cascade)
+# =========================================================
+# 분류에 사용할 모델 (쉼표로 구분, 앞에서부터 시도). 비어 있으면 GEMINI_MODEL 하나만 사용
+#   예: GEMINI_CASCADE_MODELS=gemini-2.5-flash-lite,gemini-2.5-flash
+# 앞 모델의 결과가 validate_classification을 통과하지 못하거나 해석되지 않으면 다음 모델로 다시 분류합니다.
+GEMINI_CASCADE_MODELS = tuple(m.strip() for m in os.getenv("GEMINI_CASCADE_MODELS", "").split(",") if m.strip())
+
+# 프롬프트의 판정 기준 중 광고 카테고리로 확인할 수 있는 것: (카테고리 코드, 섹션, 필드, 최소 점수)
+RESULT_PRIORS: Tuple[Tuple[Tuple[str, ...], str, str, float], ...] = (
+    (("2", "5", "6"), "motivation", "fun", 0.7),             # 게임적립: 'game' 광고는 fun 0.7 이상
+    (("7",), "motivation", "trust", 0.5),                     # 금융: trust 0.5 이상
+    (("11", "12"), "commerce", "price_sensitivity", 0.6),     # 쇼핑적립: price_sensitivity 0.6 이상
+)
+
+def classification_models() -> Tuple[str, ...]:
+    """분류에 차례로 시도할 모델 목록 (cascade를 쓰지 않으면 GEMINI_MODEL 하나)"""
+    return GEMINI_CASCADE_MODELS or (GEMINI_MODEL,)
+
+def _is_score(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and 0 <= value <= 1
+
+def validate_classification(result: Any, ad_data: Optional[Dict[str, str]] = None) -> List[str]:
+    """
+    모델이 만든 분류 결과를 검사하여 문제 목록을 반환합니다. (빈 리스트면 통과)
+    선택지가 정해진 필드의 값, 점수 범위(0~1), 섹션 존재 여부와 광고 유형/카테고리 코드를 확인하고,
+    ad_data가 있으면 프롬프트의 판정 기준(명시된 연령 범위, 사용자 지정 카테고리, RESULT_PRIORS)도 확인합니다.
+    """
+    if not isinstance(result, dict):
+        return ["결과가 JSON 객체가 아님"]
+    problems = []
+    for key in ("ad_type", "target_age", "target_gender"):
+        if str(result.get(key, "")) not in SCHEMA_ENUMS[key]:
+            problems.append(f"{key} 값이 선택지에 없음: {result.get(key)!r}")
+    categories = result.get("ad_type_category")
+    if not isinstance(categories, list) or not categories:
+        problems.append(f"ad_type_category가 비어 있거나 목록이 아님: {categories!r}")
+        categories = []
+    categories = [str(c) for c in categories]
+    unknown = [c for c in categories if c not in SCHEMA_ENUMS["ad_type_category"]]
+    if unknown:
+        problems.append(f"ad_type_category에 없는 코드: {unknown}")
+    for section, fields in _MODEL_SECTION_FIELDS:
+        values = result.get(section)
+        if not isinstance(values, dict):
+            problems.append(f"{section} 섹션 없음")
+            continue
+        for key, kind in fields:
+            value = values.get(key)
+            if kind == "score" and not _is_score(value):
+                problems.append(f"{section}.{key} 점수가 0~1 범위의 숫자가 아님: {value!r}")
+            elif kind == "text" and str(value) not in SCHEMA_ENUMS.get(key, (str(value),)):
+                problems.append(f"{section}.{key} 값이 선택지에 없음: {value!r}")
+    if problems or ad_data is None:
+        return problems
+
+    # 프롬프트의 판정 기준
+    target_age = _target_age_from_range(ad_data.get("ads_age_min", ""), ad_data.get("ads_age_max", ""))
+    if target_age and result["target_age"] != target_age:
+        problems.append(f"명시된 연령 범위({target_age})와 target_age가 다름: {result['target_age']!r}")
+    requested = [c.strip() for c in str(ad_data.get("ad_type_category", "") or "").split(",") if c.strip()]
+    missing = [c for c in requested if c not in categories]
+    if missing:
+        problems.append(f"사용자 지정 카테고리가 ad_type_category에 없음: {missing}")
+    if not any(result["motivation"].values()):
+        problems.append("motivation 점수가 모두 0")
+    for codes, section, key, minimum in RESULT_PRIORS:
+        if any(c in codes for c in categories) and result[section][key] < minimum:
+            problems.append(f"카테고리 {'/'.join(codes)} 광고의 {section}.{key}가 {minimum} 미만: {result[section][key]}")
+    return problems
+
+def _tier_outcome(problems: List[str], last: bool) -> str:
+    return "accepted" if not problems else ("invalid" if last else "escalated")
+
+def _log_escalation(ad_data: Dict[str, str], model: str, reason: Any) -> None:
+    logger.info("ads_idx=%s: %s 결과를 사용하지 않고 다음 모델로 다시 분류합니다 (%s)",
+                ad_data.get("ads_idx", ""), model, reason)
+
+def call_classification_models(ad_data: Dict[str, str],
+                               api_key: str,
+                               request_args: Dict[str, Any],
+                               output_mode: Optional[str] = None,
+                               models: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    """
+    classification_models()의 모델로 차례로 분류하여, 검증을 통과한 첫 결과를 반환합니다.
+    마지막 모델의 결과는 검증에 실패해도 반환하고, 마지막 모델의 응답도 해석하지 못하면 GeminiResponseError를 발생시킵니다.
+    모델별 호출 수, 시간, 토큰 비용은 지표의 tiers에 기록됩니다.
+    """
+    models = list(models or classification_models())
+    for n, model in enumerate(models):
+        last = n == len(models) - 1
+        started = time.perf_counter()
+        try:
+            result = decode_classification_output(call_gemini_json(api_key=api_key, model=model, **request_args),
+                                                  output_mode)
+        except GeminiResponseError as e:
+            record_tier(model, time.perf_counter() - started, "failed" if last else "escalated")
+            if last:
+                raise
+            _log_escalation(ad_data, model, e)
+            continue
+        problems = validate_classification(result, ad_data)
+        record_tier(model, time.perf_counter() - started, _tier_outcome(problems, last))
+        if not problems or last:
+            return result
+        _log_escalation(ad_data, model, "; ".join(problems))
+    raise ValueError("분류에 사용할 모델이 없습니다.")
+
+async def call_classification_models_async(ad_data: Dict[str, str],
+                                           api_key: str,
+                                           request_args: Dict[str, Any],
+                                           output_mode: Optional[str] = None,
+                                           models: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    """call_classification_models의 asyncio 버전입니다."""
+    models = list(models or classification_models())
+    for n, model in enumerate(models):
+        last = n == len(models) - 1
+        started = time.perf_counter()
+        try:
+            result = decode_classification_output(
+                await call_gemini_json_async(api_key=api_key, model=model, **request_args), output_mode
+            )
+        except GeminiResponseError as e:
+            record_tier(model, time.perf_counter() - started, "failed" if last else "escalated")
+            if last:
+                raise
+            _log_escalation(ad_data, model, e)
+            continue
+        problems = validate_classification(result, ad_data)
+        record_tier(model, time.perf_counter() - started, _tier_outcome(problems, last))
+        if not problems or last:
+            return result
+        _log_escalation(ad_data, model, "; ".join(problems))
+    raise ValueError("분류에 사용할 모델이 없습니다.")
+
+# =========================================================
+# 광고 분류 함수
+# =========================================================
+def format_ad_text(ad_data: Dict[str, str]) -> str:
+    """광고 데이터를 프롬프트에 넣을 광고 텍스트로 변환합니다."""
+    return f"""
+광고명: {ad_data.get('ads_name', '')}
+요약: {ad_data.get('ads_summary', '')}
+가이드: {ad_data.get('ads_guide', '')}
+제한사항: {ad_data.get('ads_limit', '')}
+리워드 가격: {ad_data.get('ads_reward_price', '')}
+연령 범위: {ad_data.get('ads_age_min', '')}~{ad_data.get('ads_age_max', '')}
+시작일: {ad_data.get('ads_sdate', '')}
+종료일: {ad_data.get('ads_edate', '')}
+사용자 지정 광고 유형: {ad_data.get('ad_type', '')}
+사용자 지정 광고 카테고리: {ad_data.get('ad_type_category', '')}
+""".strip()
+
+def _ad_user_text(ad_data: Dict[str, str]) -> str:
+    """user 메시지로 보내는 광고 부분 (분류 지시문 제외)"""
+    return "광고 텍스트:\n" + format_ad_text(ad_data)
+
+def build_classification_prompt(ad_data: Dict[str, str], output_mode: Optional[str] = None) -> str:
+    """분류 지시문과 광고 텍스트를 합친 전체 프롬프트를 만듭니다."""
+    return classification_instructions(output_mode) + "\n\n" + _ad_user_text(ad_data)
+
+def _attach_ad_fields(result: Dict[str, Any], ad_data: Dict[str, str]) -> Dict[str, Any]:
+    # 원본 데이터 추가 (JSON 형식에 맞춤)
+    result["ads_idx"] = ad_data.get("ads_idx", "")
+    result["ads_code"] = ad_data.get("ads_code", "")
+    result["original_ads_name"] = ad_data.get("ads_name", "")
+    result.setdefault("classification_source", "model")
+    
+    return result
+
+def _adjust_near_duplicate(result: Dict[str, Any], ad_data: Dict[str, str]) -> Dict[str, Any]:
+    """유사 광고의 결과를 이 광고에 맞게 가볍게 고칩니다. (사용자 지정 유형/카테고리, 명시된 연령 범위)"""
+    ad_type = str(ad_data.get("ad_type", "") or "").strip()
+    if ad_type:
+        result["ad_type"] = ad_type
+    categories = [c.strip() for c in str(ad_data.get("ad_type_category", "") or "").split(",") if c.strip()]
+    if categories:
+        result["ad_type_category"] = categories
+    target_age = _target_age_from_range(ad_data.get("ads_age_min", ""), ad_data.get("ads_age_max", ""))
+    if target_age:
+        result["target_age"] = target_age
+    return result
+
+def near_duplicate_result(ad_data: Dict[str, str],
+                          use_near_duplicates: Optional[bool] = None) -> Optional[Dict[str, Any]]:
+    """
+    이미 Gemini로 분류한 광고 중 충분히 비슷한 광고가 있으면 그 결과를 이 광고에 맞게 고쳐 반환합니다.
+    결과의 classification_source는 "near_duplicate", confidence는 추정 자카드 유사도입니다.
+    """
+    if not (NEAR_DUP_ENABLED if use_near_duplicates is None else use_near_duplicates):
+        return None
+    found = get_near_duplicate_index().lookup(ad_data)
+    if found is None:
+        return None
+    result, similarity = found
+    result["classification_source"] = "near_duplicate"
+    result["confidence"] = round(similarity, 2)
+    return _attach_ad_fields(_adjust_near_duplicate(result, ad_data), ad_data)
+
+def _remember_model_result(ad_data: Dict[str, str],
+                           result: Dict[str, Any],
+                           use_near_duplicates: Optional[bool] = None) -> None:
+    # Gemini 결과만 색인 (재사용한 결과를 다시 색인하면 오차가 누적됨)
+    if NEAR_DUP_ENABLED if use_near_duplicates is None else use_near_duplicates:
+        get_near_duplicate_index().add(ad_data, result)
+
+def classify_ad(ad_data: Dict[str, str],
+                api_key: str,
+                use_cache: bool = True,
+                use_rules: Optional[bool] = None,
+                use_near_duplicates: Optional[bool] = None) -> Dict[str, Any]:
+    """
+    광고 데이터를 분류합니다. 같은 프롬프트의 결과가 캐시에 있으면 API를 호출하지 않습니다.
+    use_rules가 켜져 있으면(None이면 RULE_FAST_PATH) 규칙 기반 결과의 신뢰도가 충분할 때 Gemini를 호출하지 않습니다.
+    use_near_duplicates가 켜져 있으면(None이면 NEAR_DUP_ENABLED) 텍스트가 거의 같은 광고의 결과를 재사용합니다.
+    결과의 classification_source는 "rules", "near_duplicate" 또는 "model"입니다.
+    같은 프롬프트를 동시에 분류하는 호출은 Gemini 요청 하나를 함께 기다립니다. (실패도 함께 받음)
+    분류에 실패하면 GeminiError(네트워크 오류는 requests.RequestException)를 발생시킵니다.
+    단계별 시간과 토큰 사용량은 광고 한 건의 기록(ad_trace)으로 지표에 남습니다.
+    응답 형식은 GEMINI_OUTPUT_MODE를 따르며, compact의 짧은 키는 원래 필드 이름으로 펼쳐서 반환합니다.
+    GEMINI_CASCADE_MODELS가 있으면 결과가 검증을 통과하지 못한 광고만 다음(상위) 모델로 다시 분류합니다.
+    """
+    with ad_trace(ad_data) as trace:
+        ruled = confident_rule_result(ad_data, use_rules)
+        if ruled is not None:
+            return trace.done(ruled)
+
+        with measure_stage("prompt_build"):
+            prompt_key, request_args = classification_request(ad_data)  # 결과 캐시 키이자 동시 요청을 합치는 키
+        cache = get_classification_cache() if use_cache else None
+
+        result = cache.get(prompt_key) if cache is not None else None
+        if result is None:
+            reused = near_duplicate_result(ad_data, use_near_duplicates)
+            if reused is not None:
+                return trace.done(reused)
+
+            def request() -> Dict[str, Any]:
+                fresh = call_classification_models(ad_data, api_key, request_args)
+                if cache is not None:
+                    cache.put(prompt_key, fresh)
+                _remember_model_result(ad_data, fresh, use_near_duplicates)
+                return fresh
+
+            result = get_gemini_single_flight().do(prompt_key, request)
+        else:
+            trace.source = "cache"
+
+        return trace.done(_attach_ad_fields(result, ad_data))
+
+async def classify_ad_async(ad_data: Dict[str, str],
+                            api_key: str,
+                            use_cache: bool = True,
+                            use_rules: Optional[bool] = None,
+                            use_near_duplicates: Optional[bool] = None) -> Dict[str, Any]:
+    """classify_ad의 asyncio 버전입니다. 네트워크 오류는 aiohttp.ClientError로 발생합니다."""
+    with ad_trace(ad_data) as trace:
+        ruled = confident_rule_result(ad_data, use_rules)
+        if ruled is not None:
+            return trace.done(ruled)
+
+        with measure_stage("prompt_build"):
+            prompt_key, request_args = classification_request(ad_data)
+        cache = get_classification_cache() if use_cache else None
+
+        result = cache.get(prompt_key) if cache is not None else None
+        if result is None:
+            reused = near_duplicate_result(ad_data, use_near_duplicates)
+            if reused is not None:
+                return trace.done(reused)
+
+            async def request() -> Dict[str, Any]:
+                fresh = await call_classification_models_async(ad_data, api_key, request_args)
+                if cache is not None:
+                    cache.put(prompt_key, fresh)
+                _remember_model_result(ad_data, fresh, use_near_duplicates)
+                return fresh
+
+            result = await get_gemini_single_flight().do_async(prompt_key, request)
+        else:
+            trace.source = "cache"
+
+        return trace.done(_attach_ad_fields(result, ad_data))
+
+def classify_ad_stream(ad_data: Dict[str, str],
+                       api_key: str,
+                       use_cache: bool = True,
+                       use_rules: Optional[bool] = None,
+                       use_near_duplicates: Optional[bool] = None) -> Iterator[Dict[str, Any]]:
+    """
+    classify_ad의 스트리밍 버전입니다. 최상위 필드가 도착할 때마다 지금까지의 부분 결과(dict)를 반환하므로
+    화면은 첫 조각이 도착하는 즉시 채워지기 시작합니다. 규칙/캐시/유사 광고로 처리되면 완성 결과를 한 번만 반환합니다.
+    마지막으로 반환되는 dict는 classification_source가 붙은 완성된 결과입니다.
+    cascade 중이면 첫 모델의 응답만 스트리밍하고, 검증에 실패하면 마지막 결과를 다음 모델의 결과로 바꿉니다.
+    응답이 스키마를 다 채우지 못하고 끝나면 GeminiResponseError를 발생시킵니다.
+    같은 광고를 동시에 분류하는 호출(classify_ad 포함)과는 Gemini 요청 하나를 함께 씁니다.
+    """
+    trace = AdTrace(ad_data)
+    try:
+        yield from _traced(trace, _classify_ad_stream(trace, ad_data, api_key, use_cache, use_rules,
+                                                      use_near_duplicates))
+    except Exception as e:
+        trace.error = type(e).__name__
+        raise
+    finally:
+        trace.finish()
+
+def _classify_ad_stream(trace: AdTrace,
+                        ad_data: Dict[str, str],
+                        api_key: str,
+                        use_cache: bool,
+                        use_rules: Optional[bool],
+                        use_near_duplicates: Optional[bool]) -> Iterator[Dict[str, Any]]:
+    ruled = confident_rule_result(ad_data, use_rules)
+    if ruled is not None:
+        yield trace.done(ruled)
+        return
+
+    with measure_stage("prompt_build"):
+        output_mode = _output_mode(None)
+        cache_key, request_args = classification_request(ad_data, output_mode)
+    cache = get_classification_cache() if use_cache else None
+
+    result = cache.get(cache_key) if cache is not None else None
+    if result is not None:
+        trace.source = "cache"
+        yield trace.done(_attach_ad_fields(result, ad_data))
+        return
+    reused = near_duplicate_result(ad_data, use_near_duplicates)
+    if reused is not None:
+        yield trace.done(reused)
+        return
+
+    def request() -> Iterator[Dict[str, Any]]:
+        # 첫 모델의 응답만 스트리밍으로 보여 주고, 검증에 실패하면 다음 모델의 결과로 바꿔 반환
+        models = classification_models()
+        started = time.perf_counter()
+        result = {}
+        for key, value in stream_gemini_json(api_key=api_key, model=models[0], **request_args):
+            if output_mode == "compact":
+                key, value = _EXPANDED_KEYS.get(key, key), expand_compact_keys(value)
+            result[key] = value
+            yield result
+        last = len(models) == 1
+        problems = validate_classification(result, ad_data)
+        if not is_complete_result(result):
+            record_tier(models[0], time.perf_counter() - started, "failed" if last else "escalated")
+            if last:
+                raise GeminiResponseError("Gemini 응답이 완성된 분류 결과가 아닙니다.")
+        else:
+            record_tier(models[0], time.perf_counter() - started, _tier_outcome(problems, last))
+        if problems and not last:
+            _log_escalation(ad_data, models[0], "; ".join(problems))
+            result = call_classification_models(ad_data, api_key, request_args, output_mode, models=models[1:])
+        if cache is not None:
+            cache.put(cache_key, result)
+        _remember_model_result(ad_data, result, use_near_duplicates)
+        return result
+
+    # classify_ad와 같은 키로 합치므로, 같은 광고를 동시에 분류하는 다른 호출은 이 응답을 함께 기다림
+    # (먼저 시작된 요청을 기다리게 되면 중간 결과 없이 완성 결과만 반환)
+    result = yield from get_gemini_single_flight().do_stream(cache_key, request)
+    yield trace.done(_attach_ad_fields(result, ad_data))
+
+# =========================================================
+# 여러 광고 묶음 분류 (한 번의 요청에 N개 광고)
+# =========================================================
+PACKED_MAX_ADS = 16                 # 한 요청에 묶을 최대 광고 수
+PACKED_INPUT_TOKEN_BUDGET = 6000    # 광고 텍스트 부분의 입력 토큰 예산
+PACKED_MAX_OUTPUT_TOKENS = 8192     # 묶음 요청의 maxOutputTokens
+PACKED_OUTPUT_TOKENS_PER_AD = 600   # 광고 하나의 결과 JSON 예상 토큰 수
+
+@shared_resource
+def create_packed_classification_prompt() -> str:
+    """여러 광고를 한 번에 분류하기 위한 프롬프트 (마지막 지시문만 JSON 배열 출력으로 교체)"""
+    base = create_classification_prompt()
+    return base[:base.rfind("\n")] + """
+7. 여러 광고 동시 분류
+- 아래에 여러 개의 광고가 "### 광고 id: <id>" 형식으로 구분되어 주어집니다.
+- 각 광고를 서로 독립적으로 분류하여 위 스키마의 JSON 객체를 하나씩 만들고, 각 객체의 "id" 필드에 해당 광고 id를 문자열로 그대로 기록합니다.
+- 결과는 입력 순서대로 JSON 배열 하나로만 반환합니다. 광고를 빠뜨리거나 합치지 마세요.
+
+다음 광고 텍스트들을 분석하여 JSON 배열을 반환하세요:"""
+
+def packed_ads_limit(max_output_tokens: int = PACKED_MAX_OUTPUT_TOKENS) -> int:
+    """maxOutputTokens 안에 결과가 모두 들어갈 수 있는 최대 광고 수"""
+    return max(1, min(PACKED_MAX_ADS, max_output_tokens // PACKED_OUTPUT_TOKENS_PER_AD))
+
+def is_complete_result(result: Any) -> bool:
+    """결과가 스키마의 필수 항목을 모두 갖춘 JSON 객체인지 확인합니다."""
+    return (
+        isinstance(result, dict)
+        and all(isinstance(result.get(section), dict) for section in RESULT_SECTIONS)
+        and "ad_type" in result and "target_age" in result and "target_gender" in result
+    )
+
+class _AdPacker:
+    """입력 토큰 예산과 출력 토큰 한도에 맞춰 광고를 묶음 단위로 모읍니다."""
+
+    def __init__(self,
+                 token_budget: int = PACKED_INPUT_TOKEN_BUDGET,
+                 max_output_tokens: int = PACKED_MAX_OUTPUT_TOKENS):
+        self.token_budget = token_budget
+        self.max_ads = packed_ads_limit(max_output_tokens)
+        self._items: List[Any] = []
+        self._tokens = 0
+
+    def add(self, item: Any, ad_data: Dict[str, str]) -> Optional[List[Any]]:
+        """광고를 추가합니다. 묶음이 가득 차면 완성된 묶음을 반환합니다."""
+        tokens = estimate_tokens(format_ad_text(ad_data))
+        full = None
+        if self._items and self._tokens + tokens > self.token_budget:
+            full = self.flush()
+        self._items.append(item)
+        self._tokens += tokens
+        if full is None and len(self._items) >= self.max_ads:
+            full = self.flush()
+        return full
+
+    def flush(self) -> Optional[List[Any]]:
+        """모아 둔 광고를 묶음으로 반환하고 비웁니다."""
+        if not self._items:
+            return None
+        items, self._items, self._tokens = self._items, [], 0
+        return items
+
+def classify_ads_packed(rows: List[Dict[str, str]],
+                        api_key: str,
+                        use_cache: bool = True,
+                        max_output_tokens: int = PACKED_MAX_OUTPUT_TOKENS,
+                        use_rules: Optional[bool] = None,
+                        use_near_duplicates: Optional[bool] = None
+                        ) -> List[Optional[Dict[str, Any]]]:
+    """
+    여러 광고를 하나의 generateContent 요청으로 분류합니다. 결과는 rows와 같은 순서의 리스트입니다.
+    응답에서 빠졌거나 스키마가 깨진 광고는 classify_ad로 개별 재시도합니다.
+    묶음 요청은 첫 번째 모델로 보내며, cascade 중이면 검증에 실패한 광고도 개별 재시도합니다.
+    규칙 기반 결과로 충분하거나 유사 광고의 결과를 재사용할 수 있는 광고는 요청에 넣지 않습니다.
+    """
+    output_mode = _output_mode(None)
+    models = classification_models()
+    instructions = classification_instructions(output_mode, packed=True)
+    generation_config = classification_generation_config(output_mode, packed=True, max_output_tokens=max_output_tokens)
+    cache = get_classification_cache() if use_cache else None
+
+    results: List[Optional[Dict[str, Any]]] = [None] * len(rows)
+    cache_keys = [""] * len(rows)
+    todo: List[int] = []
+    for i, row in enumerate(rows):
+        results[i] = confident_rule_result(row, use_rules)
+        if results[i] is not None:
+            continue
+        if cache is not None:
+            cache_keys[i] = classification_cache_key(
+                instructions + "\n\n" + format_ad_text(row), model=",".join(models), generation_config=generation_config
+            )
+            # 묶음 결과가 없으면 개별 요청으로 분류된 결과도 재사용
+            cached = cache.get_any((cache_keys[i], classification_request(row, output_mode)[0]))
+            if cached is not None:
+                results[i] = _attach_ad_fields(cached, row)
+                continue
+        results[i] = near_duplicate_result(row, use_near_duplicates)
+        if results[i] is not None:
+            continue
+        todo.append(i)
+
+    if len(todo) > 1:
+        ad_texts = "\n\n".join(
+            f"### 광고 id: {n}\n{format_ad_text(rows[i])}" for n, i in enumerate(todo, 1)
+        )
+        try:
+            data = decode_classification_output(
+                call_gemini_json(api_key=api_key, model=models[0], generation_config=generation_config,
+                                 **gemini_prompt_args(instructions, ad_texts)),
+                output_mode
+            )
+        except GeminiResponseError:
+            data = []  # 응답 전체를 해석하지 못하면 모든 광고를 개별 요청으로 재시도
+        items = data if isinstance(data, list) else [data]
+        by_id = {str(item.get("id", "")).strip(): item for item in items if isinstance(item, dict)}
+
+        for n, i in enumerate(todo, 1):
+            item = by_id.get(str(n))
+            if not is_complete_result(item):
+                continue
+            if len(models) > 1 and validate_classification(item, rows[i]):
+                continue  # cascade 중이면 검증에 실패한 광고는 개별 요청(다음 모델까지)으로 다시 분류
+            item.pop("id", None)
+            if cache is not None:
+                cache.put(cache_keys[i], item)
+            _remember_model_result(rows[i], item, use_near_duplicates)
+            results[i] = _attach_ad_fields(item, rows[i])
+            get_metrics().count_ads("packed")
+
+    # 누락되었거나 형식이 잘못된 광고는 개별 요청으로 재시도
+    for i in todo:
+        if results[i] is None:
+            results[i] = _classify_ad_safely(rows[i], api_key, use_cache, use_rules=False,
+                                             use_near_duplicates=use_near_duplicates)
+
+    return results
+
+# =========================================================
+# 스트리밍 파이프라인 (단계 사이의 제한된 큐)
+# =========================================================
+# 읽기 → 정규화 → (캐시 조회 → 분류) → 평탄화 → 기록 단계는 크기가 정해진 큐로 이어져,
+# 뒤 단계가 밀리면 앞 단계가 멈추므로(backpressure) 입력 크기와 관계없이 메모리 사용량이 일정합니다.
+BATCH_READ_AHEAD = int(os.getenv("IVE_READ_AHEAD", "256"))          # 분류를 기다리며 미리 읽어 둘 입력 행 수
+BATCH_WRITE_QUEUE = int(os.getenv("IVE_WRITE_QUEUE", "2048"))       # 기록을 기다릴 수 있는 결과 수
+BATCH_OUTPUT_WINDOW = int(os.getenv("IVE_OUTPUT_WINDOW", "4096"))   # 읽었지만 아직 내보내지 않은 행의 최대 수
+BATCH_DEDUPE_MAX_GROUPS = int(os.getenv("IVE_DEDUPE_MAX_GROUPS", "10000"))  # 중복 제거용으로 결과를 보관할 그룹 수 (그룹당 약 1KB)
+
+_STAGE_DONE = object()
+
+def pipeline_stage(items: Iterable[Any], maxsize: int = BATCH_READ_AHEAD, name: str = "pipeline-stage") -> Iterator[Any]:
+    """
+    items를 백그라운드 스레드에서 만들어 크기 maxsize의 큐로 넘겨 줍니다.
+    큐가 가득 차면 만드는 쪽이 기다리므로 앞서 나가는 양이 maxsize로 제한됩니다.
+    만드는 쪽의 예외는 받는 쪽에서 다시 발생하며, 받는 쪽이 중간에 멈추면(close) 만드는 쪽도 멈춥니다.
+    """
+    channel: "queue.Queue[Any]" = queue.Queue(maxsize=max(maxsize, 1))
+    stopped = threading.Event()
+
+    def offer(item: Any) -> bool:
+        while not stopped.is_set():
+            try:
+                channel.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        iterator = iter(items)
+        try:
+            for item in iterator:
+                if not offer((item, None)):
+                    return
+            offer((_STAGE_DONE, None))
+        except BaseException as e:
+            offer((_STAGE_DONE, e))
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()  # 제너레이터는 만든 스레드에서 닫음 (열린 입력 파일 정리)
+
+    producer = threading.Thread(target=produce, name=name, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item, error = channel.get()
+            if item is _STAGE_DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stopped.set()
+        producer.join()
+
+class BackgroundSink:
+    """
+    consume을 백그라운드 스레드에서 실행하는 마지막 단계(평탄화/기록)입니다.
+    put은 큐(maxsize)가 가득 차면 기다리고, 기록 스레드의 예외는 다음 put 또는 close에서 다시 발생합니다.
+    """
+
+    def __init__(self, consume: Callable[[Any], None], maxsize: int = BATCH_WRITE_QUEUE, name: str = "result-writer"):
+        self._consume = consume
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=max(maxsize, 1))
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is _STAGE_DONE:
+                return
+            if self._error is None:
+                try:
+                    self._consume(item)
+                except BaseException as e:
+                    self._error = e  # 이후 항목은 버리며 큐를 비워 put이 막히지 않게 함
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            raise self._error
+
+    def put(self, item: Any) -> None:
+        self._raise_error()
+        self._queue.put(item)
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            self._queue.put(_STAGE_DONE)
+            self._thread.join()
+        self._raise_error()
+
+    def __enter__(self) -> "BackgroundSink":
+        return self
+
+    def __exit__(self, exc_type, *exc) -> None:
+        if exc_type is None:
+            self.close()
+        elif self._thread.is_alive():
+            # 이미 예외로 끝나는 중이면 남은 기록만 마치고 원래 예외를 전달
+            self._queue.put(_STAGE_DONE)
+            self._thread.join()
+
+class _OutputWindow:
+    """
+    배치 분류에서 읽었지만 아직 내보내지 않은 행을 window개까지만 허용합니다. (가득 차면 입력을 더 읽지 않음)
+    ordered이면 결과를 입력 순서대로 내보내며, 앞선 행이 끝날 때까지 뒤의 결과를 보관합니다.
+    """
+
+    def __init__(self, window: int = BATCH_OUTPUT_WINDOW, ordered: bool = False):
+        self.window = max(window, 1)
+        self.ordered = ordered
+        self._sequence: Dict[int, int] = {}   # id(입력 행) -> 입력 순번 (행은 내보낼 때까지 살아 있음)
+        self._next_in = 0
+        self._next_out = 0
+        self._finished: Dict[int, Tuple[Dict[str, str], Optional[Dict[str, Any]]]] = {}
+
+    @property
+    def full(self) -> bool:
+        return self._next_in - self._next_out >= self.window
+
+    def admit(self, row: Dict[str, str]) -> None:
+        """입력에서 새 행을 읽었을 때 호출합니다."""
+        if self.ordered:
+            self._sequence[id(row)] = self._next_in
+        self._next_in += 1
+
+    def complete(self, row: Dict[str, str], result: Optional[Dict[str, Any]]
+                 ) -> List[Tuple[Dict[str, str], Optional[Dict[str, Any]]]]:
+        """행의 결과가 나왔을 때 호출합니다. 지금 내보낼 수 있는 (행, 결과) 목록을 반환합니다."""
+        if not self.ordered:
+            self._next_out += 1
+            return [(row, result)]
+        self._finished[self._sequence.pop(id(row))] = (row, result)
+        ready = []
+        while self._next_out in self._finished:
+            ready.append(self._finished.pop(self._next_out))
+            self._next_out += 1
+        return ready
+
+# =========================================================
+# 배치 분류 (CSV)
+# =========================================================
+def iter_ads_csv(source) -> Iterator[Dict[str, str]]:
+    """
+    입력 CSV에서 광고 행을 한 줄씩 읽어옵니다.
+    파일 경로 또는 텍스트 파일 객체를 받을 수 있으며, 전체 파일을 메모리에 올리지 않습니다.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, newline="", encoding="utf-8-sig") as f:
+            yield from iter_ads_csv(f)
+        return
+
+    for row in csv.DictReader(source):
+        yield {
+            (key or "").strip(): "" if value is None else str(value).strip()
+            for key, value in row.items()
+        }
+
+def _normalize_ad_content(value: str) -> str:
+    """비교용 정규화: 유니코드 호환 문자 통일, 소문자화, 공백 정리"""
+    return " ".join(unicodedata.normalize("NFKC", value or "").lower().split())
+
+def ad_group_key(ad_data: Dict[str, str]) -> Optional[str]:
+    """
+    같은 광고의 변형(ads_code가 같은 행)을 묶기 위한 그룹 키를 만듭니다.
+    ads_code와 정규화된 요약/가이드/제한사항/사용자 지정 분류/연령 범위가 모두 같으면 같은 키가 됩니다.
+    (연령 범위는 target_age에 그대로 반영되므로 범위가 다른 변형은 따로 분류)
+    ads_code가 없는 행은 묶지 않으므로 None을 반환합니다.
+    """
+    ads_code = (ad_data.get("ads_code") or "").strip()
+    if not ads_code:
+        return None
+    content = "\x1f".join(
+        _normalize_ad_content(ad_data.get(field, ""))
+        for field in ("ads_summary", "ads_guide", "ads_limit", "ad_type", "ad_type_category",
+                      "ads_age_min", "ads_age_max")
+    )
+    return ads_code + "\x1e" + hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+class _AdGroupDeduplicator:
+    """
+    배치 분류에서 같은 그룹의 광고는 대표 행 하나만 분류하고,
+    결과를 그룹의 나머지 행에 ads_idx/ads_code/original_ads_name만 바꿔 나눠 줍니다.
+    끝난 그룹의 결과는 최근에 쓰인 max_groups개만 보관하므로, 입력이 아무리 커도 메모리 사용량이 일정합니다.
+    (밀려난 그룹의 행은 다시 분류되며, 대개 결과 캐시에서 바로 찾음)
+    """
+
+    def __init__(self, enabled: bool = True, max_groups: int = BATCH_DEDUPE_MAX_GROUPS):
+        self.enabled = enabled
+        self.max_groups = max(max_groups, 1)
+        self.deduplicated = 0
+        self._waiting: Dict[str, List[Dict[str, str]]] = {}
+        # 그룹이 많아도 메모리를 적게 쓰도록 압축 표현으로 보관 (오래 쓰이지 않은 그룹부터 밀어냄)
+        self._results: "collections.OrderedDict[str, ClassificationResult]" = collections.OrderedDict()
+
+    def admit(self, row: Dict[str, str]) -> Tuple[Optional[str], bool, Optional[Dict[str, Any]]]:
+        """
+        새 입력 행을 등록합니다. (그룹 키, 분류 요청 필요 여부, 재사용 결과)를 반환합니다.
+        이미 분류된 그룹이면 결과를 바로 돌려주고, 대표 행이 진행 중이면 대기열에 넣습니다.
+        """
+        key = ad_group_key(row) if self.enabled else None
+        if key is None:
+            return None, True, None
+        if key in self._results:
+            self.deduplicated += 1
+            self._results.move_to_end(key)
+            return key, False, self._fan_out(self._results[key], row)
+        if key in self._waiting:
+            self._waiting[key].append(row)
+            return key, False, None
+        self._waiting[key] = []
+        return key, True, None
+
+    def complete(self, key: Optional[str], result: Optional[Dict[str, Any]]
+                 ) -> Tuple[List[Tuple[Dict[str, str], Dict[str, Any]]], Optional[Dict[str, str]]]:
+        """
+        대표 행의 분류가 끝났을 때 호출합니다. (대기 중이던 행과 결과 목록, 다시 분류할 행)을 반환합니다.
+        대표 행이 실패하면 대기 중인 다음 행을 새 대표로 삼아 다시 시도합니다.
+        """
+        if key is None:
+            return [], None
+        waiting = self._waiting.pop(key, [])
+        if result is None:
+            if not waiting:
+                return [], None
+            self._waiting[key] = waiting[1:]
+            return [], waiting[0]
+
+        compact = ClassificationResult.from_dict(result)
+        self._results[key] = compact
+        if len(self._results) > self.max_groups:
+            self._results.popitem(last=False)
+        self.deduplicated += len(waiting)
+        return [(row, self._fan_out(compact, row)) for row in waiting], None
+
+    @staticmethod
+    def _fan_out(result: ClassificationResult, row: Dict[str, str]) -> Dict[str, Any]:
+        # to_dict()는 매번 새 dict를 만들므로 행마다 복사할 필요가 없음
+        return _attach_ad_fields(result.to_dict(), row)
+
+def _classify_ad_safely(ad_data: Dict[str, str],
+                        api_key: str,
+                        use_cache: bool = True,
+                        use_rules: Optional[bool] = None,
+                        use_near_duplicates: Optional[bool] = None) -> Optional[Dict[str, Any]]:
+    """배치용 분류 함수. 한 광고의 실패로 전체 배치가 중단되지 않도록 로그를 남기고 None으로 처리합니다."""
+    try:
+        return classify_ad(ad_data, api_key, use_cache=use_cache, use_rules=use_rules,
+                           use_near_duplicates=use_near_duplicates)
+    except (requests.RequestException, GeminiError) as e:
+        logger.warning("Gemini API 요청 실패 (ads_idx=%s): %s", ad_data.get("ads_idx", ""), e)
+        return None
+
+def _classify_rows_safely(rows: List[Dict[str, str]],
+                          api_key: str,
+                          use_cache: bool = True,
+                          use_rules: Optional[bool] = None,
+                          use_near_duplicates: Optional[bool] = None) -> List[Optional[Dict[str, Any]]]:
+    """배치 작업 단위(광고 1개 또는 묶음)를 분류합니다. 묶음 요청이 실패하면 광고별로 재시도합니다."""
+    if len(rows) == 1:
+        return [_classify_ad_safely(rows[0], api_key, use_cache, use_rules, use_near_duplicates)]
+    try:
+        return classify_ads_packed(rows, api_key, use_cache=use_cache, use_rules=use_rules,
+                                   use_near_duplicates=use_near_duplicates)
+    except (requests.RequestException, GeminiError) as e:
+        logger.warning("Gemini 묶음 요청 실패, 광고별로 재시도합니다: %s", e)
+        return [_classify_ad_safely(row, api_key, use_cache, use_rules, use_near_duplicates) for row in rows]
+
+def classify_ads_batch(rows: Iterable[Dict[str, str]],
+                       api_key: str,
+                       max_workers: int = 8,
+                       max_in_flight: Optional[int] = None,
+                       use_cache: bool = True,
+                       dedupe: bool = True,
+                       pack: bool = False,
+                       stats: Optional[Dict[str, Any]] = None,
+                       use_rules: Optional[bool] = None,
+                       use_near_duplicates: Optional[bool] = None,
+                       ordered: bool = False,
+                       output_window: int = BATCH_OUTPUT_WINDOW
+                       ) -> Iterator[Tuple[Dict[str, str], Optional[Dict[str, Any]]]]:
+    """
+    여러 광고를 스레드 풀에서 동시에 분류합니다.
+    동시에 진행 중인 요청 수를 max_in_flight로 제한하며, 입력은 필요한 만큼만 읽습니다.
+    dedupe가 켜져 있으면 ad_group_key가 같은 행은 한 번만 분류하고 결과를 나눠 줍니다.
+    pack이 켜져 있으면 토큰 예산에 맞춰 여러 광고를 하나의 요청으로 묶어 분류합니다.
+    use_rules가 켜져 있으면 규칙 기반 결과로 충분한 행은 작업을 만들지 않고 바로 반환합니다.
+    429/503 스로틀링이 관측되면 동시 요청 수를 절반으로 줄였다가 성공에 따라 다시 늘립니다 (AIMD).
+    읽었지만 아직 반환하지 않은 행이 output_window개가 되면 입력을 더 읽지 않습니다.
+    완료된 순서대로(ordered이면 입력 순서대로) (입력 행, 분류 결과 또는 None)을 반환합니다.
+    """
+    if max_workers < 1:
+        raise ValueError("max_workers는 1 이상이어야 합니다.")
+    max_in_flight = max(max_in_flight or max_workers * 2, 1)
+
+    row_iter = iter(rows)
+    groups = _AdGroupDeduplicator(enabled=dedupe)
+    packer = _AdPacker() if pack else None
+    window = _OutputWindow(output_window, ordered)
+    key_pool = get_api_key_pool(api_key)  # 키가 여럿이면 모든 키의 스로틀링 합계를 봄
+    concurrency = AdaptiveConcurrency(max_in_flight)
+    seen_throttles = key_pool.throttle_events
+    pending: Dict[Future, List[Tuple[Dict[str, str], Optional[str]]]] = {}
+    exhausted = False
+    ruled_count = 0
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ad-classifier") as pool:
+
+        def submit(items: List[Tuple[Dict[str, str], Optional[str]]]) -> None:
+            future = pool.submit(_classify_rows_safely, [row for row, _ in items], api_key, use_cache, False,
+                                 use_near_duplicates)
+            pending[future] = items
+
+        while True:
+            # 진행 중인 요청이 상한(스로틀링에 따라 조절됨)에 도달할 때까지 입력을 채움
+            while not exhausted and len(pending) < concurrency.limit and not window.full:
+                row = next(row_iter, None)
+                if row is None:
+                    exhausted = True
+                    leftover = packer.flush() if packer is not None else None
+                    if leftover:
+                        submit(leftover)
+                    break
+                window.admit(row)
+                ruled = confident_rule_result(row, use_rules)
+                if ruled is not None:
+                    ruled_count += 1
+                    get_metrics().count_ads("rules")
+                    yield from window.complete(row, ruled)
+                    continue
+                key, needs_request, reused = groups.admit(row)
+                if needs_request:
+                    full = packer.add((row, key), row) if packer is not None else [(row, key)]
+                    if full:
+                        submit(full)
+                elif reused is not None:
+                    yield from window.complete(row, reused)
+            if window.full and packer is not None:
+                # 창이 가득 찼으면 묶음이 차기를 기다리지 않고 보냄 (앞선 행이 묶음에 갇혀 멈추지 않도록)
+                leftover = packer.flush()
+                if leftover:
+                    submit(leftover)
+
+            if stats is not None:
+                stats["deduplicated"] = groups.deduplicated
+                stats["concurrency"] = concurrency.limit
+                stats["rules"] = ruled_count
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                seen_throttles = concurrency.observe(key_pool, seen_throttles)
+                items = pending.pop(future)
+                for (row, key), result in zip(items, future.result()):
+                    yield from window.complete(row, result)
+
+                    fanned_out, retry_row = groups.complete(key, result)
+                    for fanned_row, fanned_result in fanned_out:
+                        yield from window.complete(fanned_row, fanned_result)
+                    if retry_row is not None:
+                        submit([(retry_row, key)])
+
+async def _classify_ad_async_safely(ad_data: Dict[str, str],
+                                    api_key: str,
+                                    use_cache: bool = True,
+                                    use_rules: Optional[bool] = None,
+                                    use_near_duplicates: Optional[bool] = None) -> Optional[Dict[str, Any]]:
+    """비동기 배치용 분류 함수. 실패한 광고는 로그를 남기고 None으로 처리합니다."""
+    import asyncio
+    import aiohttp
+
+    try:
+        return await classify_ad_async(ad_data, api_key, use_cache=use_cache, use_rules=use_rules,
+                                       use_near_duplicates=use_near_duplicates)
+    except (aiohttp.ClientError, asyncio.TimeoutError, GeminiError) as e:
+        logger.warning("Gemini API 요청 실패 (ads_idx=%s): %s", ad_data.get("ads_idx", ""), e)
+        return None
+
+async def classify_ads_async(rows: Iterable[Dict[str, str]],
+                             api_key: str,
+                             max_in_flight: int = 256,
+                             use_cache: bool = True,
+                             dedupe: bool = True,
+                             stats: Optional[Dict[str, Any]] = None,
+                             use_rules: Optional[bool] = None,
+                             use_near_duplicates: Optional[bool] = None,
+                             ordered: bool = False,
+                             output_window: int = BATCH_OUTPUT_WINDOW
+                             ) -> AsyncIterator[Tuple[Dict[str, str], Optional[Dict[str, Any]]]]:
+    """
+    classify_ads_batch의 asyncio 버전입니다.
+    스레드 없이 하나의 이벤트 루프에서 최대 max_in_flight개의 요청을 동시에 처리하며,
+    스로틀링이 관측되면 동시 요청 수를 조절합니다.
+    완료된 순서대로(ordered이면 입력 순서대로) (입력 행, 분류 결과 또는 None)을 반환합니다.
+    """
+    import asyncio
+
+    if max_in_flight < 1:
+        raise ValueError("max_in_flight는 1 이상이어야 합니다.")
+
+    row_iter = iter(rows)
+    groups = _AdGroupDeduplicator(enabled=dedupe)
+    window = _OutputWindow(output_window, ordered)
+    key_pool = get_api_key_pool(api_key)  # 키가 여럿이면 모든 키의 스로틀링 합계를 봄
+    concurrency = AdaptiveConcurrency(max_in_flight)
+    seen_throttles = key_pool.throttle_events
+    pending: Dict[asyncio.Task, Tuple[Dict[str, str], Optional[str]]] = {}
+    exhausted = False
+    ruled_count = 0
+
+    try:
+        while True:
+            while not exhausted and len(pending) < concurrency.limit and not window.full:
+                row = next(row_iter, None)
+                if row is None:
+                    exhausted = True
+                    break
+                window.admit(row)
+                ruled = confident_rule_result(row, use_rules)
+                if ruled is not None:
+                    ruled_count += 1
+                    get_metrics().count_ads("rules")
+                    for item in window.complete(row, ruled):
+                        yield item
+                    continue
+                key, needs_request, reused = groups.admit(row)
+                if needs_request:
+                    task = asyncio.ensure_future(
+                        _classify_ad_async_safely(row, api_key, use_cache, False, use_near_duplicates)
+                    )
+                    pending[task] = (row, key)
+                elif reused is not None:
+                    for item in window.complete(row, reused):
+                        yield item
+
+            if stats is not None:
+                stats["deduplicated"] = groups.deduplicated
+                stats["concurrency"] = concurrency.limit
+                stats["rules"] = ruled_count
+            if not pending:
+                break
+
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                seen_throttles = concurrency.observe(key_pool, seen_throttles)
+                row, key = pending.pop(task)
+                result = task.result()
+                for item in window.complete(row, result):
+                    yield item
+
+                fanned_out, retry_row = groups.complete(key, result)
+                for fanned_row, fanned_result in fanned_out:
+                    for item in window.complete(fanned_row, fanned_result):
+                        yield item
+                if retry_row is not None:
+                    task = asyncio.ensure_future(
+                        _classify_ad_async_safely(retry_row, api_key, use_cache, False, use_near_duplicates)
+                    )
+                    pending[task] = (retry_row, key)
+    finally:
+        for task in pending:
+            task.cancel()
+
+BATCH_JOBS_DIR = os.getenv("IVE_JOBS_DIR", os.path.join(".cache", "jobs"))
+JOURNAL_FSYNC_EVERY = 200        # 이 개수만큼 기록할 때마다 디스크에 동기화
+JOURNAL_FSYNC_INTERVAL = 2.0     # 또는 마지막 동기화 후 이 시간(초)이 지나면 동기화
+_INPUT_POSITION_FIELD = "__input_position"  # 저널/증분 분류에서 행에 붙이는 입력 순서 (프롬프트/결과에는 들어가지 않음)
+
+def journal_key(ad_data: Dict[str, str]) -> str:
+    """저널에서 광고를 식별하는 키. ads_idx가 없으면 광고 내용의 해시를 사용합니다."""
+    ads_idx = (ad_data.get("ads_idx") or "").strip()
+    if ads_idx:
+        return ads_idx
+    content = (ad_data.get("ads_code") or "") + "\n" + format_ad_text(ad_data)
+    return "sha1:" + hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+class _JournalIndex:
+    """
+    저널의 키 -> 마지막 기록(줄 번호, 파일 위치, 입력 순서, 실패 여부)을 임시 SQLite 파일에 보관하는 색인입니다.
+    재시작할 때 완료된 광고를 건너뛰고 저널을 정리하는 데 쓰며, 키가 수백만 개여도 메모리를 거의 쓰지 않습니다.
+    """
+
+    def __init__(self, entries: Iterable[Tuple[int, Dict[str, Any]]]):
+        self._conn = sqlite3.connect("", check_same_thread=False)  # 빈 경로: 닫으면 지워지는 임시 파일
+        self._conn.execute("CREATE TABLE journal_keys (key TEXT PRIMARY KEY, line INTEGER NOT NULL, "
+                           "offset INTEGER NOT NULL, position INTEGER, failed INTEGER NOT NULL) WITHOUT ROWID")
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO journal_keys (key, line, offset, position, failed) VALUES (?, ?, ?, ?, ?)",
+                ((entry.get("key", ""), line_no, offset, entry.get("position"), bool(entry.get("failed")))
+                 for line_no, (offset, entry) in enumerate(entries))
+            )
+        self._count = self._conn.execute("SELECT COUNT(*) FROM journal_keys WHERE NOT failed").fetchone()[0]
+
+    def __contains__(self, key: str) -> bool:
+        # 마지막 기록이 실패인 광고는 완료되지 않은 것으로 보고 다시 분류
+        return self._conn.execute("SELECT 1 FROM journal_keys WHERE key = ? AND NOT failed",
+                                  (key,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def offsets(self, ordered: bool = False) -> Iterator[int]:
+        """완료된 광고마다 마지막 기록의 파일 위치를 기록 순서(ordered이면 입력 순서)대로 반환합니다."""
+        order = "position IS NULL, position, line" if ordered else "line"
+        cursor = self._conn.execute(f"SELECT offset FROM journal_keys WHERE NOT failed ORDER BY {order}")
+        while True:
+            rows = cursor.fetchmany(RESULT_WRITE_BATCH)
+            if not rows:
+                return
+            for (offset,) in rows:
+                yield offset
+
+    def close(self) -> None:
+        self._conn.close()
+
+class BatchJournal:
+    """
+    배치 작업에서 완료된 분류 결과를 한 줄에 하나씩 JSONL 파일에 추가 기록하는 저널입니다.
+    같은 job_id로 다시 실행하면 이미 기록된 광고를 건너뛰고 이어서 진행할 수 있습니다.
+    기록은 매번 파일에 쓰고, 디스크 동기화(fsync)는 일정 개수/시간마다 묶어서 수행합니다.
+    """
+
+    def __init__(self,
+                 job_id: str,
+                 directory: str = BATCH_JOBS_DIR,
+                 fsync_every: int = JOURNAL_FSYNC_EVERY,
+                 fsync_interval: float = JOURNAL_FSYNC_INTERVAL):
+        if not job_id or os.sep in job_id or (os.altsep and os.altsep in job_id) or job_id in (".", ".."):
+            raise ValueError(f"사용할 수 없는 작업 ID입니다: {job_id!r}")
+        os.makedirs(directory, exist_ok=True)
+        self.job_id = job_id
+        self.path = os.path.join(directory, f"{job_id}.jsonl")
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._repair_partial_line()
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _repair_partial_line(self) -> None:
+        # 기록 도중 중단되어 마지막 줄이 잘렸으면 잘린 부분을 버림
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb+") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size == 0:
+                return
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) == b"\n":
+                return
+            f.seek(0)
+            data = f.read()
+            f.truncate(data.rfind(b"\n") + 1)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        """
+        기록된 항목을 순서대로 반환합니다. 완료는 {"key": ..., "position": ..., "result": {...}},
+        실패는 {"key": ..., "position": ..., "failed": true}입니다. (position은 입력 순서, 없을 수 있음)
+        """
+        for _, entry in self._entries():
+            yield entry
+
+    def _entries(self) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        # (줄의 파일 위치, 항목). 정리할 때 색인에서 찾은 위치로 바로 찾아가 읽음
+        self._file.flush()
+        with open(self.path, "rb") as f:
+            offset = 0
+            for line in f:
+                start, offset = offset, offset + len(line)
+                if not line.strip():
+                    continue
+                try:
+                    yield start, json.loads(line)
+                except ValueError:  # JSONDecodeError, UnicodeDecodeError
+                    continue
+
+    def completed_keys(self) -> set:
+        """이미 완료된 광고의 journal_key 집합 (실패로 기록된 광고 제외)"""
+        keys = set()
+        for entry in self:
+            (keys.discard if entry.get("failed") else keys.add)(entry.get("key", ""))
+        return keys
+
+    def completed_index(self) -> _JournalIndex:
+        """
+        이미 완료된 광고의 journal_key 색인 (in으로 확인). completed_keys와 같지만 임시 파일에 보관하므로
+        완료된 광고가 많아도 메모리 사용량이 일정합니다. 다 쓰면 close()로 닫습니다.
+        """
+        return _JournalIndex(self._entries())
+
+    def append(self, key: str, result: Optional[Dict[str, Any]], position: Optional[int] = None) -> None:
+        """
+        분류 결과 하나를 입력 순서(position)와 함께 기록합니다.
+        result가 None이면 실패로 기록하며, 다시 실행하면 이 광고는 다시 분류합니다.
+        """
+        entry: Dict[str, Any] = {"key": key}
+        if position is not None:
+            entry["position"] = position
+        if result is None:
+            entry["failed"] = True
+        else:
+            entry["result"] = result
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self) -> None:
+        """기록된 내용을 디스크에 동기화합니다."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def compact(self, output_csv, output_format: Optional[str] = None, include_source: bool = False,
+                ordered: bool = False) -> int:
+        """
+        저널을 json_total.csv 형식의 최종 CSV(또는 parquet/arrow)로 정리합니다.
+        같은 키가 여러 번 기록되었으면 마지막 결과를 사용하고, 마지막 기록이 실패인 광고는 빼고 씁니다.
+        ordered이면 기록 순서 대신 입력 순서(position)대로 씁니다. (이어서 실행하며 나중에 성공한 광고도 제자리에)
+        기록된 광고 수를 반환합니다.
+        """
+        # 첫 번째로 읽으며 키마다 마지막 기록의 파일 위치를 임시 색인에 모으고, 색인 순서대로 그 줄만 다시 읽어 기록
+        # (결과도 키 목록도 메모리에 모으지 않으므로 저널 크기와 관계없이 일정한 메모리로 정리)
+        self._file.flush()
+        index = _JournalIndex(self._entries())
+
+        def latest_results() -> Iterator[Dict[str, Any]]:
+            with open(self.path, "rb") as f:
+                for offset in index.offsets(ordered):
+                    f.seek(offset)
+                    yield json.loads(f.readline()).get("result", {})
+
+        try:
+            return write_results(latest_results(), output_csv, output_format, include_source)
+        finally:
+            index.close()
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def __enter__(self) -> "BatchJournal":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+def run_batch_csv(input_csv,
+                  output_csv,
+                  api_key: str,
+                  max_workers: int = 8,
+                  max_in_flight: Optional[int] = None,
+                  use_cache: bool = True,
+                  dedupe: bool = True,
+                  pack: bool = False,
+                  job_id: Optional[str] = None,
+                  output_format: Optional[str] = None,
+                  progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+                  use_rules: Optional[bool] = None,
+                  use_near_duplicates: Optional[bool] = None,
+                  ordered: bool = False,
+                  include_source: bool = False
+                  ) -> Dict[str, Any]:
+    """
+    입력 CSV의 모든 광고를 분류하여 json_total.csv와 같은 형식의 CSV로 저장합니다.
+    input_csv/output_csv에는 파일 경로 또는 텍스트 파일 객체를 전달할 수 있습니다.
+    읽기/정규화는 앞 스레드, 평탄화/기록은 뒤 스레드에서 제한된 큐로 이어서 처리하므로
+    입력이 수백만 행이어도 메모리 사용량이 일정합니다. ordered이면 출력(저널)을 입력 행 순서대로 기록합니다.
+    job_id를 주면 결과(실패 포함)를 입력 순서와 함께 저널에 기록하고, 같은 job_id로 다시 실행하면 이미 완료된 광고는
+    건너뛰고 실패했던 광고는 다시 분류합니다. 이 경우 출력 CSV는 마지막에 저널을 정리하여 만들며,
+    ordered이면 이어서 실행한 결과도 입력 순서대로 씁니다.
+    output_format을 "parquet"/"arrow"로 주거나 출력 경로 확장자가 .parquet/.arrow이면 해당 형식으로 저장합니다.
+    include_source이면 출력 마지막에 classification_source, confidence 열을 추가합니다. (기본은 json_total.csv의 43열)
+    stats["rules"]는 Gemini 호출 없이 규칙 기반으로 분류된 광고 수, stats["near_duplicates"]는 유사 광고의 결과를 재사용한 수입니다.
+    """
+    stats: Dict[str, Any] = {"processed": 0, "succeeded": 0, "failed": 0, "deduplicated": 0,
+                             "resumed": 0, "rules": 0, "near_duplicates": 0, "failed_ads_idx": []}
+
+    if job_id:
+        journal = BatchJournal(job_id)
+        completed = journal.completed_index()
+
+        def pending_rows() -> Iterator[Dict[str, str]]:
+            try:
+                for position, row in enumerate(iter_ads_csv(input_csv)):
+                    if journal_key(row) in completed:
+                        stats["resumed"] += 1
+                    else:
+                        row[_INPUT_POSITION_FIELD] = position
+                        yield row
+            finally:
+                completed.close()
+
+        rows: Iterable[Dict[str, str]] = pending_rows()
+        out = contextlib.nullcontext(None)
+    else:
+        journal = None
+        rows = iter_ads_csv(input_csv)
+        out = ResultWriter(output_csv, output_format, include_source=include_source)
+
+    with out as writer, (journal or contextlib.nullcontext()):
+
+        def record(item: Tuple[Dict[str, str], Optional[Dict[str, Any]]]) -> None:
+            row, result = item
+            if journal is not None:
+                journal.append(journal_key(row), result, row.get(_INPUT_POSITION_FIELD))
+            else:
+                writer.write(result)
+
+        with BackgroundSink(record) as sink:
+            for row, result in classify_ads_batch(pipeline_stage(rows, name="ad-reader"), api_key,
+                                                  max_workers=max_workers,
+                                                  max_in_flight=max_in_flight,
+                                                  use_cache=use_cache,
+                                                  dedupe=dedupe,
+                                                  pack=pack,
+                                                  stats=stats,
+                                                  use_rules=use_rules,
+                                                  use_near_duplicates=use_near_duplicates,
+                                                  ordered=ordered):
+                stats["processed"] += 1
+                if result is None:
+                    stats["failed"] += 1
+                    stats["failed_ads_idx"].append(row.get("ads_idx", ""))
+                    if journal is not None:
+                        sink.put((row, None))  # 다시 실행하면 다시 분류하도록 실패도 기록
+                else:
+                    stats["succeeded"] += 1
+                    if result.get("classification_source") == "near_duplicate":
+                        stats["near_duplicates"] += 1
+                    sink.put((row, result))
+
+                if progress_callback is not None:
+                    progress_callback(stats)
+
+        if journal is not None:
+            journal.sync()
+            stats["written"] = journal.compact(output_csv, output_format, include_source, ordered)
+
+    return stats
+
+# =========================================================
+# 증분 재분류 (입력 피드 변경 감지)
+# =========================================================
+MANIFEST_WRITE_BATCH = 1000  # 바뀌지 않은 광고의 입력 순서 갱신을 모아 한 트랜잭션으로 기록할 수
+
+def ad_content_hash(ad_data: Dict[str, str], fingerprint: str = "") -> str:
+    """
+    classify_ad가 프롬프트에 넣는 필드(format_ad_text)와 분류 설정의 지문(classification_fingerprint)으로 만든 내용 해시입니다.
+    ads_idx/ads_code처럼 프롬프트에 들어가지 않는 필드가 바뀌어도 해시는 같고,
+    프롬프트/응답 형식/모델이 바뀌면 모든 광고의 해시가 달라집니다.
+    """
+    return hashlib.sha1((fingerprint + "\n" + format_ad_text(ad_data)).encode("utf-8")).hexdigest()
+
+def default_manifest_path(output) -> str:
+    """출력 파일 옆에 두는 매니페스트 경로 (json_total.csv -> json_total.csv.manifest.sqlite3)"""
+    if not isinstance(output, (str, os.PathLike)):
+        raise ValueError("출력이 파일 객체이면 매니페스트 경로를 지정해야 합니다.")
+    return os.fspath(output) + ".manifest.sqlite3"
+
+class AdManifest:
+    """
+    증분 재분류용 매니페스트(SQLite): 광고 키(journal_key) -> 프롬프트 내용 해시, ads_code, 마지막 분류 결과, 입력 순서.
+    실행마다 번호(run)를 매기고 입력에 있던 광고에 그 번호를 기록하여, 실행이 끝나면 입력에서 빠진 광고를 지웁니다.
+    내용 해시에는 분류 설정의 지문(fingerprint, 기본값: 현재 classification_fingerprint())이 들어가므로
+    프롬프트나 모델이 바뀌면 모든 광고가 바뀐 광고가 됩니다.
+    """
+
+    def __init__(self, path: str, fingerprint: Optional[str] = None):
+        self.path = path
+        self.fingerprint = fingerprint if fingerprint is not None else classification_fingerprint()
+        self._lock = threading.Lock()
+        self._touches: List[Tuple[int, int, str]] = []
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS ad_manifest (
+                key TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                ads_code TEXT NOT NULL,
+                result TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                run INTEGER NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+
+    def start_run(self) -> int:
+        """새 실행 번호를 반환합니다. (중단된 실행이 남긴 번호보다 항상 큼)"""
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(run), 0) + 1 FROM ad_manifest").fetchone()[0]
+
+    def content_hash(self, ad_data: Dict[str, str]) -> str:
+        """이 매니페스트의 분류 설정으로 만든 광고의 내용 해시"""
+        return ad_content_hash(ad_data, self.fingerprint)
+
+    def lookup(self, key: str) -> Optional[Tuple[str, str]]:
+        """기록된 (내용 해시, ads_code)를 반환합니다. 처음 보는 광고이면 None을 반환합니다."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT content_hash, ads_code FROM ad_manifest WHERE key = ?", (key,)
+            ).fetchone()
+
+    def touch(self, key: str, position: int, run: int) -> None:
+        """입력에 그대로 있는 광고의 입력 순서와 실행 번호를 갱신합니다. (MANIFEST_WRITE_BATCH개씩 모아 기록)"""
+        with self._lock:
+            self._touches.append((position, run, key))
+            if len(self._touches) >= MANIFEST_WRITE_BATCH:
+                self._flush_touches()
+
+    def _flush_touches(self) -> None:
+        # 잠금 안에서 호출됨
+        if not self._touches:
+            return
+        self._conn.execute("BEGIN")
+        self._conn.executemany("UPDATE ad_manifest SET position = ?, run = ? WHERE key = ?", self._touches)
+        self._conn.execute("COMMIT")
+        self._touches = []
+
+    def relabel(self, key: str, ad_data: Dict[str, str]) -> None:
+        """프롬프트 내용은 같고 ads_code 등 식별 정보만 바뀐 광고의 결과를 다시 분류하지 않고 고칩니다."""
+        with self._lock:
+            row = self._conn.execute("SELECT result FROM ad_manifest WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return
+            result = _attach_ad_fields(json.loads(row[0]), ad_data)
+            self._conn.execute(
+                "UPDATE ad_manifest SET ads_code = ?, result = ?, updated_at = ? WHERE key = ?",
+                (ad_data.get("ads_code", ""), json.dumps(result, ensure_ascii=False), time.time(), key)
+            )
+
+    def put(self, key: str, ad_data: Dict[str, str], result: Dict[str, Any], position: int, run: int) -> None:
+        """새로 분류한 광고의 결과와 내용 해시를 기록합니다."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ad_manifest (key, content_hash, ads_code, result, position, run, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, self.content_hash(ad_data), ad_data.get("ads_code", ""), json.dumps(result, ensure_ascii=False),
+                 position, run, time.time())
+            )
+
+    def remove_unseen(self, run: int) -> int:
+        """이번 실행의 입력에 없던 광고를 지우고 지운 수를 반환합니다."""
+        with self._lock:
+            self._flush_touches()
+            return self._conn.execute("DELETE FROM ad_manifest WHERE run < ?", (run,)).rowcount
+
+    def results(self) -> Iterator[Dict[str, Any]]:
+        """기록된 결과를 입력 순서대로 반환합니다. (RESULT_WRITE_BATCH개씩 읽어 메모리 사용량 일정)"""
+        with self._lock:
+            self._flush_touches()
+            cursor = self._conn.execute("SELECT result FROM ad_manifest ORDER BY position")
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(RESULT_WRITE_BATCH)
+            if not rows:
+                return
+            for (payload,) in rows:
+                yield json.loads(payload)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": self._conn.execute("SELECT COUNT(*) FROM ad_manifest").fetchone()[0]}
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush_touches()
+            self._conn.close()
+
+    def __enter__(self) -> "AdManifest":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+def _write_results_replacing(results: Iterable[Dict[str, Any]], output, output_format: Optional[str] = None,
+                             include_source: bool = False) -> int:
+    # 경로이면 임시 파일에 다 쓴 뒤 바꿔치기하여, 도중에 실패해도 이전 출력이 그대로 남게 함
+    if not isinstance(output, (str, os.PathLike)):
+        return write_results(results, output, output_format, include_source)
+    output_format = output_format or result_format_for(output)
+    temp_path = os.fspath(output) + ".tmp"
+    try:
+        written = write_results(results, temp_path, output_format, include_source)
+        os.replace(temp_path, output)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return written
+
+def run_incremental_csv(input_csv,
+                        output_csv,
+                        api_key: str,
+                        manifest_path: Optional[str] = None,
+                        max_workers: int = 8,
+                        max_in_flight: Optional[int] = None,
+                        use_cache: bool = True,
+                        dedupe: bool = True,
+                        pack: bool = False,
+                        output_format: Optional[str] = None,
+                        progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+                        use_rules: Optional[bool] = None,
+                        use_near_duplicates: Optional[bool] = None,
+                        include_source: bool = False
+                        ) -> Dict[str, Any]:
+    """
+    run_batch_csv의 증분 버전입니다. 매니페스트(기본값: 출력 경로 + ".manifest.sqlite3")에 광고별 프롬프트 내용 해시와
+    마지막 결과를 보관하고, 새 광고와 내용이 바뀐 광고만 분류합니다. 입력에서 빠진 광고는 매니페스트와 출력에서 지웁니다.
+    출력은 매니페스트의 결과를 입력 순서대로 다시 써서 만듭니다. (이전 출력 파일을 읽지 않음)
+    다시 분류하다 실패한 광고는 이전 결과를 유지하고 다음 실행에서 다시 시도합니다.
+    중간에 중단되어도 끝난 광고의 결과는 매니페스트에 남으므로, 다시 실행하면 나머지만 분류합니다.
+    stats의 new/changed/unchanged/removed는 새 광고, 바뀐 광고, 그대로인 광고, 지운 광고 수이고,
+    relabeled는 프롬프트 내용은 같고 ads_code만 바뀌어 결과만 고친 광고 수입니다.
+    분류 지시문, 응답 형식, 모델(cascade 포함)이 바뀌면 모든 광고를 바뀐 광고(changed)로 보고 다시 분류합니다.
+    """
+    stats: Dict[str, Any] = {"processed": 0, "succeeded": 0, "failed": 0, "deduplicated": 0, "rules": 0,
+                             "near_duplicates": 0, "new": 0, "changed": 0, "unchanged": 0, "relabeled": 0,
+                             "removed": 0, "failed_ads_idx": []}
+
+    with AdManifest(manifest_path or default_manifest_path(output_csv)) as manifest:
+        run = manifest.start_run()
+
+        def changed_rows() -> Iterator[Dict[str, str]]:
+            for position, row in enumerate(iter_ads_csv(input_csv)):
+                key = journal_key(row)
+                known = manifest.lookup(key)
+                if known is not None:
+                    # 분류에 실패해도 이전 결과가 남도록 입력 순서와 실행 번호는 먼저 갱신
+                    manifest.touch(key, position, run)
+                    if known[0] == manifest.content_hash(row):
+                        stats["unchanged"] += 1
+                        if known[1] != row.get("ads_code", ""):
+                            manifest.relabel(key, row)
+                            stats["relabeled"] += 1
+                        continue
+                stats["changed" if known is not None else "new"] += 1
+                # 입력 순서는 별도 표 없이 행에 실어 보냄 (행은 결과가 나올 때까지만 살아 있음)
+                row[_INPUT_POSITION_FIELD] = position
+                yield row
+
+        for row, result in classify_ads_batch(changed_rows(), api_key,
+                                              max_workers=max_workers,
+                                              max_in_flight=max_in_flight,
+                                              use_cache=use_cache,
+                                              dedupe=dedupe,
+                                              pack=pack,
+                                              stats=stats,
+                                              use_rules=use_rules,
+                                              use_near_duplicates=use_near_duplicates):
+            stats["processed"] += 1
+            if result is None:
+                stats["failed"] += 1
+                stats["failed_ads_idx"].append(row.get("ads_idx", ""))
+            else:
+                stats["succeeded"] += 1
+                if result.get("classification_source") == "near_duplicate":
+                    stats["near_duplicates"] += 1
+                manifest.put(journal_key(row), row, result, row[_INPUT_POSITION_FIELD], run)
+
+            if progress_callback is not None:
+                progress_callback(stats)
+
+        stats["removed"] = manifest.remove_unseen(run)
+        stats["written"] = _write_results_replacing(manifest.results(), output_csv, output_format, include_source)
+
+    return stats
@@ -0,0 +1,379 @@
+"""
+분류 HTTP 서비스 (다른 시스템에서 Streamlit 없이 분류 요청)
+
+- POST /classify          광고 JSON 객체 하나 → 분류 결과 JSON
+- POST /classify/batch    {"ads": [광고, ...]} 또는 광고 배열 → {"results": [결과 또는 null, ...], "stats": {...}}
+- GET  /healthz           상태 확인
+- GET  /stats             처리 중/대기/거절 수, 결과 캐시와 속도 제한 통계, 단계별 지표 요약 (프로세스별)
+- GET  /metrics           단계별 시간/토큰/응답 해석 지표 (Prometheus 텍스트 형식, 프로세스별)
+
+쿼리 문자열 cache=0으로 결과 캐시를 끄고, 기본으로 꺼져 있는 규칙 기반 분류와 유사 광고 재사용은
+rules=1, near_duplicates=1로 켭니다. (rules=0, near_duplicates=0은 환경변수 기본값과 관계없이 끔)
+
+요청은 프로세스당 max_concurrency개까지 동시에 처리하고, 그 이상은 max_queue개까지 차례를 기다립니다.
+대기열이 가득 찼거나 queue_timeout초 안에 차례가 오지 않으면 503(Retry-After)으로 바로 거절하여
+느려진 Gemini 앞에 요청이 끝없이 쌓이지 않도록 합니다. 묶음 요청은 자리 하나를 차지하고 그 안에서
+batch_workers개의 스레드로 분류합니다.
+HTTP 연결 풀, 결과 캐시, 유사 광고 색인, API 키 풀(키별 속도 제한기)은 프로세스 안의 모든 요청이 공유합니다.
+processes > 1이면 리스닝 소켓 하나를 여러 프로세스(fork)가 나눠 받습니다. (SQLite 캐시는 WAL 모드로 함께 사용)
+
+실행:
+    python -m ive_classifier serve --port 8080 --concurrency 16 --queue 64 --processes 4
+    GEMINI_API_BASE=http://127.0.0.1:8765/v1beta python -m ive_classifier serve   # 로컬 대역 서버로 시험
+"""
+import os
+import json
+import time
+import logging
+import signal
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from typing import Dict, Any, Optional, List
+
+import requests
+
+from ive_classifier import core
+
+logger = logging.getLogger(__name__)
+
+SERVICE_MAX_CONCURRENCY = int(os.getenv("IVE_SERVICE_CONCURRENCY", "16"))  # 프로세스당 동시에 처리할 요청 수
+SERVICE_MAX_QUEUE = int(os.getenv("IVE_SERVICE_QUEUE", "64"))              # 차례를 기다릴 수 있는 요청 수
+SERVICE_QUEUE_TIMEOUT = float(os.getenv("IVE_SERVICE_QUEUE_TIMEOUT", "30"))  # 대기 상한(초)
+SERVICE_BATCH_WORKERS = 8           # 묶음 요청 하나를 처리하는 스레드 수
+SERVICE_MAX_BATCH_ADS = 1000        # 묶음 요청 하나의 최대 광고 수
+SERVICE_MAX_BODY_BYTES = 16 * 1024 * 1024
+
+
+class ServiceError(Exception):
+    """HTTP 오류 응답으로 바꿔 보낼 예외"""
+
+    def __init__(self, status: int, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class AdmissionControl:
+    """
+    동시에 처리하는 요청 수와 기다리는 요청 수를 제한합니다.
+    처리 자리가 없으면 대기열에서 기다리고, 대기열도 가득 찼으면 기다리지 않고 바로 거절합니다.
+    """
+
+    def __init__(self,
+                 max_concurrency: int = SERVICE_MAX_CONCURRENCY,
+                 max_queue: int = SERVICE_MAX_QUEUE,
+                 queue_timeout: float = SERVICE_QUEUE_TIMEOUT):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency는 1 이상이어야 합니다.")
+        self.max_concurrency = max_concurrency
+        self.max_queue = max(max_queue, 0)
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> bool:
+        """처리 자리를 얻으면 True, 대기열이 가득 찼거나 대기 시간이 지나면 False를 반환합니다."""
+        with self._cond:
+            if self.active < self.max_concurrency:
+                self.active += 1
+                return True
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                return False
+
+            self.waiting += 1
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while self.active >= self.max_concurrency:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        return False
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+            self.active += 1
+            return True
+
+    def release(self) -> None:
+        with self._cond:
+            self.active -= 1
+            self.completed += 1
+            self._cond.notify()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "active": self.active,
+                "waiting": self.waiting,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+            }
+
+
+def _options(query: Dict[str, List[str]]) -> Dict[str, Any]:
+    # 값이 "0"/"false"이면 끄고 그 밖의 값이면 켬. 없으면 core의 환경변수 기본값을 따름 (규칙 기반 분류/유사 광고 재사용은 기본 꺼짐)
+    def flag(name: str) -> Optional[bool]:
+        values = query.get(name)
+        if not values:
+            return None
+        return values[-1].lower() not in ("0", "false", "no", "off")
+
+    use_cache = flag("cache")
+    return {
+        "use_cache": True if use_cache is None else use_cache,
+        "use_rules": flag("rules"),
+        "use_near_duplicates": flag("near_duplicates"),
+    }
+
+
+def _ad_row(ad: Any) -> Dict[str, str]:
+    if not isinstance(ad, dict):
+        raise ServiceError(400, "광고는 JSON 객체여야 합니다.")
+    return {str(key): "" if value is None else str(value) for key, value in ad.items()}
+
+
+class _ClassificationHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "_ServiceHTTPServer"
+
+    def log_message(self, format, *args):  # noqa: A002 - BaseHTTPRequestHandler 시그니처
+        pass
+
+    def _send_json(self, status: int, payload: Any, headers: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, error: ServiceError) -> None:
+        headers = {"Retry-After": str(max(int(error.retry_after), 1))} if error.retry_after is not None else None
+        self._send_json(error.status, {"error": {"code": error.status, "message": str(error)}}, headers)
+
+    def _read_json(self) -> Any:
+        try:
+            length = int(self.headers.get("Content-Length", 0) or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True  # 본문 길이를 알 수 없으므로 연결을 재사용할 수 없음
+            raise ServiceError(400, "Content-Length가 올바르지 않습니다.")
+        if length > SERVICE_MAX_BODY_BYTES:
+            self.close_connection = True  # 본문을 읽지 않았으므로 연결을 재사용할 수 없음
+            raise ServiceError(413, f"요청 본문이 너무 큽니다. (최대 {SERVICE_MAX_BODY_BYTES}바이트)")
+        try:
+            return json.loads(self.rfile.read(length) or b"null")
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            raise ServiceError(400, "요청 본문이 올바른 JSON이 아닙니다.")
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == "/healthz":
+            self._send_json(200, {"status": "ok", "pid": os.getpid()})
+        elif path == "/stats":
+            self._send_json(200, self.server.service.stats())
+        elif path == "/metrics":
+            body = core.get_metrics().prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json(404, {"error": {"code": 404, "message": "not found"}})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        service = self.server.service
+        try:
+            payload = self._read_json()
+            if url.path == "/classify":
+                handler = service.classify
+            elif url.path == "/classify/batch":
+                handler = service.classify_batch
+            else:
+                raise ServiceError(404, "not found")
+            options = _options(parse_qs(url.query))
+            self._send_json(200, service.admitted(handler, payload, options))
+        except ServiceError as e:
+            self._send_error(e)
+        except Exception:
+            # 예상하지 못한 오류도 연결을 끊지 않고 JSON 오류 본문으로 알림 (자세한 내용은 로그에만 남김)
+            logger.exception("분류 요청 처리 실패: %s", url.path)
+            self._send_error(ServiceError(500, "서버 내부 오류가 발생했습니다."))
+
+
+class _ServiceHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    service: "ClassificationService"
+
+
+class ClassificationService:
+    """
+    분류 HTTP 서비스. with 문으로 사용하면 백그라운드 스레드에서 실행됩니다. (시험용)
+    서비스로 실행할 때는 serve()를 사용하세요.
+    """
+
+    def __init__(self,
+                 host: str = "127.0.0.1",
+                 port: int = 8080,
+                 api_key: Optional[str] = None,
+                 max_concurrency: int = SERVICE_MAX_CONCURRENCY,
+                 max_queue: int = SERVICE_MAX_QUEUE,
+                 queue_timeout: float = SERVICE_QUEUE_TIMEOUT,
+                 batch_workers: int = SERVICE_BATCH_WORKERS,
+                 max_batch_ads: int = SERVICE_MAX_BATCH_ADS):
+        self.api_key = api_key or core.default_api_key()
+        if not self.api_key:
+            raise ValueError("GEMINI_API_KEYS/GEMINI_API_KEY 환경변수 또는 api_key가 필요합니다.")
+        self.admission = AdmissionControl(max_concurrency, max_queue, queue_timeout)
+        self.batch_workers = batch_workers
+        self.max_batch_ads = max_batch_ads
+        self._httpd = _ServiceHTTPServer((host, port), _ClassificationHandler)
+        self._httpd.service = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def admitted(self, handler, payload: Any, options: Dict[str, Any]) -> Any:
+        """처리 자리를 얻어 handler를 실행합니다. 자리가 없으면 503으로 거절합니다."""
+        if not self.admission.acquire():
+            raise ServiceError(503, "요청이 많아 처리할 수 없습니다. 잠시 후 다시 시도해주세요.", retry_after=1)
+        try:
+            return handler(payload, options)
+        finally:
+            self.admission.release()
+
+    def classify(self, payload: Any, options: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            return core.classify_ad(_ad_row(payload), self.api_key, **options)
+        except core.GeminiAPIError as e:
+            # Gemini가 스로틀링 중이면 호출자에게도 잠시 뒤에 다시 시도하도록 알림
+            if e.status_code in (429, 503):
+                raise ServiceError(503, str(e), retry_after=1)
+            raise ServiceError(502, str(e))
+        except core.GeminiError as e:
+            raise ServiceError(502, str(e))
+        except requests.Timeout as e:
+            raise ServiceError(504, f"Gemini API 요청 시간 초과: {e}")
+        except requests.RequestException as e:
+            raise ServiceError(502, f"Gemini API 요청 실패: {e}")
+
+    def classify_batch(self, payload: Any, options: Dict[str, Any]) -> Dict[str, Any]:
+        ads = payload.get("ads") if isinstance(payload, dict) else payload
+        if not isinstance(ads, list):
+            raise ServiceError(400, '광고 배열 또는 {"ads": [...]} 형식이어야 합니다.')
+        if len(ads) > self.max_batch_ads:
+            raise ServiceError(413, f"한 번에 최대 {self.max_batch_ads}개까지 분류할 수 있습니다.")
+        rows = [_ad_row(ad) for ad in ads]
+
+        stats: Dict[str, Any] = {}
+        results: List[Optional[Dict[str, Any]]] = [
+            result for _, result in core.classify_ads_batch(rows, self.api_key, max_workers=self.batch_workers,
+                                                            stats=stats, ordered=True, **options)
+        ]
+
+        failed = [i for i, result in enumerate(results) if result is None]
+        return {
+            "results": results,
+            "stats": {
+                "processed": len(rows),
+                "succeeded": len(rows) - len(failed),
+                "failed": len(failed),
+                "failed_indices": failed,
+                "deduplicated": stats.get("deduplicated", 0),
+                "rules": stats.get("rules", 0),
+            },
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pid": os.getpid(),
+            "requests": self.admission.stats(),
+            "classification_cache": core.get_classification_cache().stats(),
+            "rate_limiter": core.get_api_key_pool(self.api_key).stats(),  # 키별 통계는 "keys"
+            "single_flight": core.get_gemini_single_flight().stats(),
+            "metrics": core.get_metrics().summary(),
+        }
+
+    def serve_forever(self) -> None:
+        """현재 스레드에서 서버를 실행합니다."""
+        try:
+            self._httpd.serve_forever()
+        finally:
+            self._httpd.server_close()
+
+    def start(self) -> "ClassificationService":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="classification-service", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "ClassificationService":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def serve(host: str = "127.0.0.1", port: int = 8080, processes: int = 1, **options: Any) -> None:
+    """
+    분류 서비스를 실행합니다. processes > 1이면 소켓을 먼저 열고 작업 프로세스를 fork하여
+    모든 프로세스가 같은 포트에서 연결을 나눠 받습니다. (POSIX 전용)
+    연결 풀과 SQLite 연결은 fork 뒤 각 프로세스에서 처음 사용할 때 만들어집니다.
+    """
+    service = ClassificationService(host, port, **options)
+    print(f"IVE classification service: {service.base_url} (processes={processes})", flush=True)
+    if processes <= 1:
+        try:
+            service.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return
+    if not hasattr(os, "fork"):
+        raise RuntimeError("여러 프로세스 실행은 fork를 지원하는 운영체제에서만 가능합니다.")
+
+    children: List[int] = []
+    for _ in range(processes):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                service.serve_forever()
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    def stop_children(signum=None, frame=None) -> None:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop_children)
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        stop_children()
+        for pid in children:
+            os.waitpid(pid, 0)
+    finally:
+        service._httpd.server_close()
@@ -0,0 +1,29 @@
+"""
+테스트 공통 설정: 캐시/인덱스/저널 경로를 임시 디렉터리로 돌리고 네트워크 호출을 막습니다.
+ive_classifier.core는 경로를 불러올 때 읽으므로 환경변수는 가져오기 전에 정합니다.
+"""
+import os
+import tempfile
+
+_TEST_DIR = tempfile.mkdtemp(prefix="ive-tests-")
+os.environ.update({
+    "IVE_CACHE_PATH": os.path.join(_TEST_DIR, "cache.sqlite3"),
+    "IVE_NEAR_DUP_PATH": os.path.join(_TEST_DIR, "near_duplicates.sqlite3"),
+    "IVE_JOBS_DIR": os.path.join(_TEST_DIR, "jobs"),
+    "IVE_METRICS_PATH": "",
+    "GEMINI_API_BASE": "http://127.0.0.1:9",  # 실수로 실제 API를 부르지 않도록
+})
+
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    """로컬 Gemini 대역 서버(bench.mock_gemini)를 띄우고 분류기가 그 서버를 부르게 합니다."""
+    from bench.mock_gemini import MockGeminiServer
+    from ive_classifier import core
+
+    with MockGeminiServer(fenced_rate=0.0, seed=0) as server:
+        monkeypatch.setattr(core, "GEMINI_API_BASE", server.base_url)
+        yield server
@@ -0,0 +1,147 @@
+"""배치 분류: 저널로 이어서 실행, 입력 순서 유지, CSV/Parquet/Arrow 기록"""
+import csv
+import io
+import os
+
+import pytest
+
+from bench.synthetic import synthetic_ads
+from ive_classifier import core
+from ive_classifier.core import CSV_HEADERS, BatchJournal, run_batch_csv, write_results
+
+from tests.test_csv import full_result
+from tests.test_incremental import read_output, write_ads
+
+OPTIONS = dict(use_cache=False, use_rules=False, use_near_duplicates=False, max_workers=4)
+
+
+class Interrupted(Exception):
+    pass
+
+
+def make_ads(count):
+    return [dict(ad, ads_name=f"{ad['ads_name']} #{i}") for i, ad in enumerate(synthetic_ads(count, seed=2))]
+
+
+def test_job_resumes_after_interruption(gemini, tmp_path):
+    ads = make_ads(20)
+    write_ads(tmp_path / "ads.csv", ads)
+    output = str(tmp_path / "json_total.csv")
+
+    def stop_after_five(stats):
+        if stats["processed"] == 5:
+            raise Interrupted()
+
+    with pytest.raises(Interrupted):
+        run_batch_csv(str(tmp_path / "ads.csv"), output, "test-key", job_id="resume-test", ordered=True,
+                      progress_callback=stop_after_five, **OPTIONS)
+    assert not os.path.exists(output)
+    first_requests = gemini.stats()["generate_requests"]
+
+    gemini.reset_stats()
+    stats = run_batch_csv(str(tmp_path / "ads.csv"), output, "test-key", job_id="resume-test", ordered=True, **OPTIONS)
+    assert stats["resumed"] >= 5
+    assert stats["resumed"] + stats["processed"] == len(ads) and stats["failed"] == 0
+    assert gemini.stats()["generate_requests"] == stats["processed"] <= len(ads) - 5
+    assert first_requests >= 5
+    rows = read_output(output)
+    assert [row["ads_idx"] for row in rows] == [ad["ads_idx"] for ad in ads]  # 중복 없이 입력 순서대로
+
+
+def test_journal_ignores_torn_last_line(gemini, tmp_path):
+    ads = make_ads(6)
+    write_ads(tmp_path / "ads.csv", ads)
+    output = str(tmp_path / "json_total.csv")
+    run_batch_csv(str(tmp_path / "ads.csv"), output, "test-key", job_id="torn-test", **OPTIONS)
+    journal = BatchJournal("torn-test")
+    journal.close()
+    with open(journal.path, "a", encoding="utf-8") as f:
+        f.write('{"key": "999", "result": {"ad_ty')  # 기록 도중 중단된 줄
+
+    gemini.reset_stats()
+    stats = run_batch_csv(str(tmp_path / "ads.csv"), output, "test-key", job_id="torn-test", **OPTIONS)
+    assert (stats["resumed"], stats["processed"], gemini.stats()["generate_requests"]) == (len(ads), 0, 0)
+    assert sorted(row["ads_idx"] for row in read_output(output)) == sorted(ad["ads_idx"] for ad in ads)
+
+
+@pytest.mark.parametrize("pack", [False, True])
+def test_ordered_output_with_small_window(gemini, tmp_path, monkeypatch, pack):
+    monkeypatch.setattr(core, "BATCH_OUTPUT_WINDOW", 3)
+    ads = make_ads(40) + [dict(ad, ads_idx=str(300000 + i)) for i, ad in enumerate(make_ads(5))]  # 같은 내용 포함
+    write_ads(tmp_path / "ads.csv", ads)
+    output = io.StringIO()
+    stats = run_batch_csv(str(tmp_path / "ads.csv"), output, "test-key", ordered=True, pack=pack,
+                          **dict(OPTIONS, max_workers=8))
+    assert stats["failed"] == 0
+    rows = list(csv.DictReader(io.StringIO(output.getvalue())))
+    assert [row["ads_idx"] for row in rows] == [ad["ads_idx"] for ad in ads]
+
+
+@pytest.mark.parametrize("suffix", [".parquet", ".arrow"])
+def test_columnar_output_matches_csv(tmp_path, suffix):
+    pytest.importorskip("pyarrow")
+    import pyarrow.feather as feather
+    import pyarrow.parquet as parquet
+
+    results = [full_result(ads_idx=str(i), classification_source="model", confidence="") for i in range(3)]
+    del results[1]["promo"]["fomo_sensitive"]
+    text = io.StringIO()
+    write_results(results, text, "csv")
+    expected = list(csv.DictReader(io.StringIO(text.getvalue())))
+
+    path = str(tmp_path / f"json_total{suffix}")
+    assert write_results(results, path) == len(results)
+    table = parquet.read_table(path) if suffix == ".parquet" else feather.read_table(path)
+    assert table.column_names == CSV_HEADERS
+    scores = {f"{section}_{key}" for section, key, kind in core.RESULT_SCHEMA if kind == "score"}
+    for row, want in zip(table.to_pylist(), expected):
+        for header in CSV_HEADERS:
+            if header in scores:  # 점수 열은 float64
+                assert row[header] == float(want[header]), header
+            else:
+                assert ("" if row[header] is None else str(row[header])) == want[header], header
+
+
+def test_dedupe_keeps_variants_with_different_age_ranges(gemini, tmp_path):
+    base = dict(make_ads(1)[0], ads_code="AGE1")
+    twenties = dict(base, ads_idx="1", ads_age_min="20", ads_age_max="29")
+    forties = dict(base, ads_idx="2", ads_age_min="40", ads_age_max="49")
+    repeat = dict(twenties, ads_idx="3", ads_name="다른 이름")
+    assert core.ad_group_key(twenties) != core.ad_group_key(forties)
+    assert core.ad_group_key(twenties) == core.ad_group_key(repeat)
+
+    write_ads(tmp_path / "ads.csv", [twenties, forties, repeat])
+    output = str(tmp_path / "json_total.csv")
+    stats = run_batch_csv(str(tmp_path / "ads.csv"), output, "test-key", dedupe=True, ordered=True,
+                          **dict(OPTIONS, max_workers=1))
+    assert (stats["deduplicated"], gemini.stats()["generate_requests"]) == (1, 2)
+    ages = {row["ads_idx"]: row["target_age"] for row in read_output(output)}
+    assert ages == {"1": "twenties", "2": "forties", "3": "twenties"}
+
+
+def test_failed_rows_are_retried_in_input_order(gemini, tmp_path, monkeypatch):
+    ads = make_ads(12)
+    write_ads(tmp_path / "ads.csv", ads)
+    output = str(tmp_path / "json_total.csv")
+    failing = {ads[2]["ads_idx"], ads[7]["ads_idx"]}
+    classify_ad = core.classify_ad
+
+    def flaky(ad_data, *args, **kwargs):
+        if ad_data["ads_idx"] in failing:
+            raise core.GeminiResponseError("일시적인 실패")
+        return classify_ad(ad_data, *args, **kwargs)
+
+    monkeypatch.setattr(core, "classify_ad", flaky)
+    stats = run_batch_csv(str(tmp_path / "ads.csv"), output, "test-key", job_id="retry-test", ordered=True, **OPTIONS)
+    assert stats["failed"] == 2 and stats["written"] == len(ads) - 2
+    journal = BatchJournal("retry-test")
+    assert journal.completed_keys() == {ad["ads_idx"] for ad in ads} - failing
+    journal.close()
+
+    failing.clear()
+    gemini.reset_stats()
+    stats = run_batch_csv(str(tmp_path / "ads.csv"), output, "test-key", job_id="retry-test", ordered=True, **OPTIONS)
+    assert (stats["resumed"], stats["processed"], stats["failed"]) == (len(ads) - 2, 2, 0)
+    assert gemini.stats()["generate_requests"] == 2
+    # 나중에 성공한 광고도 저널 기록 순서가 아닌 입력 순서의 제자리에 들어감
+    assert [row["ads_idx"] for row in read_output(output)] == [ad["ads_idx"] for ad in ads]
@@ -0,0 +1,25 @@
+"""결과 캐시 통계: 한 광고를 여러 키로 찾아도 적중/미스는 한 번만 셉니다."""
+from ive_classifier import core
+from ive_classifier.core import ClassificationCache
+
+from tests.test_batch import make_ads
+
+
+def test_get_any_counts_one_lookup(tmp_path):
+    cache = ClassificationCache(str(tmp_path / "cache.sqlite3"))
+    assert cache.get_any(("packed", "single")) is None
+    cache.put("single", {"ad_type": "1"})
+    assert cache.get_any(("packed", "single")) == {"ad_type": "1"}
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_packed_batch_counts_one_miss_per_ad(gemini):
+    core.get_classification_cache().clear()
+    cache = core.get_classification_cache()
+    hits, misses = cache.hits, cache.misses
+    ads = make_ads(4)
+    options = dict(use_rules=False, use_near_duplicates=False)
+    assert all(core.classify_ads_packed(ads, "test-key", **options))
+    assert (cache.hits - hits, cache.misses - misses) == (0, len(ads))
+    assert all(core.classify_ads_packed(ads, "test-key", **options))
+    assert (cache.hits - hits, cache.misses - misses) == (len(ads), len(ads))
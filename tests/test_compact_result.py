@@ -0,0 +1,70 @@
+"""ClassificationResult: 기존 JSON 결과(dict)와 손실 없이 오가야 합니다."""
+import json
+
+import pytest
+
+from ive_classifier.core import (
+    RESULT_SCHEMA,
+    ClassificationResult,
+    ClassificationResultStore,
+    result_to_csv_row,
+)
+
+from tests.test_csv import full_result
+
+
+def schema_result(score):
+    """RESULT_SCHEMA의 모든 필드를 채운 결과 (점수는 score(열 번호))"""
+    result = full_result(classification_source="model", confidence=0.91)
+    for index, (section, key, kind) in enumerate(RESULT_SCHEMA):
+        if kind == "score":
+            result[section][key] = score(index)
+    result["engagement"]["session_length_expectation"] = "short"
+    return result
+
+
+@pytest.mark.parametrize("score", [
+    lambda i: round(0.05 * (i % 21), 2),         # 모델이 주는 소수점 2자리 점수
+    lambda i: i % 2,                             # 정수 0/1
+    lambda i: 0.123456789 + i * 1e-9,            # float32로 복원되지 않는 값
+    lambda i: [0.1, 1, 0.3333333333333333, 1e-12][i % 4],
+])
+def test_round_trip_over_full_schema(score):
+    result = schema_result(score)
+    compact = ClassificationResult.from_dict(result)
+    restored = compact.to_dict()
+    assert restored == result
+    assert json.dumps(restored, sort_keys=True) == json.dumps(result, sort_keys=True)  # int/float 구분까지 같음
+    assert compact.to_csv_row() == result_to_csv_row(result)
+
+
+def test_round_trip_keeps_missing_and_unknown_fields():
+    result = schema_result(lambda i: 0.5)
+    del result["ads_code"]
+    del result["motivation"]["fun"]
+    result["promo"]["unexpected"] = "high"
+    result["brand"]["nostalgia"] = "n/a"
+    result["extra_field"] = {"nested": [1, 2]}
+    result["commerce"] = []
+    assert ClassificationResult.from_dict(result).to_dict() == result
+
+
+def test_dotted_top_level_key_stays_top_level():
+    # 최상위 extra와 섹션 extra의 이름이 섞이면 "promo.unexpected"가 promo 섹션으로 들어가거나 사라짐
+    result = schema_result(lambda i: 0.5)
+    result["promo.unexpected"] = "top"
+    result["model.version"] = "v2"
+    result["promo"]["unexpected"] = "section"
+    restored = ClassificationResult.from_dict(result).to_dict()
+    assert restored == result
+    assert restored["promo"]["unexpected"] == "section" and restored["promo.unexpected"] == "top"
+
+
+def test_store_round_trip_after_growth():
+    results = [schema_result(lambda i, n=n: round((i + n) % 100 / 100, 2)) for n in range(5)]
+    results.append(schema_result(lambda i: 0.987654321))
+    store = ClassificationResultStore(capacity=1)
+    for result in results:
+        store.append(result)
+    assert [item.to_dict() for item in store] == results
+    assert store.scores.shape == (len(results), len(store[0].scores))
@@ -0,0 +1,69 @@
+"""컨텍스트 캐시 등록: 같은 지시문의 등록은 하나로 합치고, 등록 중에도 다른 지시문은 기다리지 않습니다."""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from ive_classifier import core
+
+
+class FakeResponse:
+    def __init__(self, status_code, name=None):
+        self.status_code = status_code
+        self._name = name
+
+    def json(self):
+        return {"name": self._name} if self._name else {"error": {}}
+
+
+class FakeSession:
+    """지시문에 "slow"가 들어간 등록 요청은 release가 설정될 때까지 멈춤"""
+
+    def __init__(self, status_code=200):
+        self.status_code = status_code
+        self.posts = 0
+        self.release = threading.Event()
+
+    def post(self, url, params=None, headers=None, data=None, timeout=None):
+        self.posts += 1
+        if b"slow" in data:
+            assert self.release.wait(5)
+        return FakeResponse(self.status_code, f"cachedContents/{self.posts}" if self.status_code == 200 else None)
+
+
+@pytest.fixture
+def session(monkeypatch):
+    core._context_cache_registry.clear()
+    core._context_cache_flight.clear()
+    fake = FakeSession()
+    monkeypatch.setattr(core, "get_http_session", lambda: fake)
+    yield fake
+    core._context_cache_registry.clear()
+    core._context_cache_flight.clear()
+
+
+def test_registration_is_shared_and_does_not_block_other_keys(session):
+    with ThreadPoolExecutor(4) as pool:
+        slow = [pool.submit(core.get_context_cache_name, "slow instructions", "test-key") for _ in range(3)]
+        while core._context_cache_flight().stats()["coalesced"] < 2:
+            time.sleep(0.01)
+        # 등록이 진행 중이어도 다른 지시문의 등록은 바로 끝남
+        assert core.get_context_cache_name("other instructions", "test-key") is not None
+        session.release.set()
+        names = {future.result(timeout=5) for future in slow}
+    assert len(names) == 1 and None not in names
+    assert session.posts == 2
+    assert core.get_context_cache_name("slow instructions", "test-key") in names
+    assert session.posts == 2
+
+
+@pytest.mark.parametrize("status, retry_after", [(503, 30), (429, 30), (400, 300)])
+def test_failed_registration_retry_delay(session, status, retry_after):
+    session.status_code = status
+    assert core.get_context_cache_name("instructions", "test-key") is None
+    [(name, expires_at)] = core._context_cache_registry()[0].values()
+    assert name is None
+    assert expires_at - time.time() == pytest.approx(retry_after, abs=2)
+    assert core.get_context_cache_name("instructions", "test-key") is None
+    assert session.posts == 1
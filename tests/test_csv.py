@@ -0,0 +1,112 @@
+"""json_total.csv 열 정렬: 헤더와 값이 RESULT_SCHEMA 순서로 맞아야 합니다.
+
+기본 출력은 43열이고, 분류 출처/신뢰도 열은 include_source=True일 때만 뒤에 붙습니다.
+"""
+import csv
+import io
+
+from ive_classifier.core import (
+    CSV_HEADERS,
+    EXTENDED_CSV_HEADERS,
+    EXTENDED_RESULT_SCHEMA,
+    RESULT_SCHEMA,
+    ClassificationResult,
+    convert_to_csv_format,
+    result_to_csv_row,
+    write_results,
+)
+
+
+def full_result(**overrides):
+    """모든 필드가 채워진 결과. 점수는 열마다 다른 값이라 밀리면 바로 드러납니다."""
+    result = {}
+    for index, (section, key, kind) in enumerate(EXTENDED_RESULT_SCHEMA):
+        value = round(0.01 * index, 2) if kind == "score" else (["a", "b"] if kind == "list" else f"{key}-value")
+        (result.setdefault(section, {}) if section else result)[key] = value
+    result.update(overrides)
+    return result
+
+
+def expected_row(result, schema=RESULT_SCHEMA):
+    row = {}
+    for section, key, kind in schema:
+        header = f"{section}_{key}" if section else key
+        value = (result.get(section) or {}).get(key) if section else result.get(key)
+        if kind == "list":
+            row[header] = ",".join(value) if value else ""
+        elif value is None:
+            row[header] = "0" if kind == "score" else ""
+        else:
+            row[header] = str(value)
+    return row
+
+
+def read_rows(text, headers=CSV_HEADERS):
+    reader = csv.reader(io.StringIO(text))
+    header = next(reader)
+    assert header == headers
+    return [dict(zip(header, row)) for row in reader]
+
+
+def test_row_matches_headers_for_full_result():
+    result = full_result()
+    row = result_to_csv_row(result)
+    assert len(row) == len(CSV_HEADERS)
+    assert {h: str(v) for h, v in zip(CSV_HEADERS, row)} == expected_row(result)
+
+
+def test_row_alignment_with_missing_fields():
+    # 점수 키 하나가 빠지면 dict 열 변환이 실패하여 행 단위 변환으로 넘어가는 경로
+    result = full_result(classification_source="model", confidence="")
+    del result["motivation"]["social"]
+    del result["commerce"]
+    del result["ads_code"]
+    row = dict(zip(EXTENDED_CSV_HEADERS, map(str, result_to_csv_row(result, include_source=True))))
+    assert row == expected_row(result, EXTENDED_RESULT_SCHEMA)
+    assert row["motivation_social"] == "0"
+    assert row["motivation_fun"] == str(result["motivation"]["fun"])
+    assert row["classification_source"] == "model"
+    assert row["commerce_big_purchase_intent"] == "0"
+
+
+def test_writer_rows_align_for_mixed_results():
+    complete = full_result()
+    partial = full_result(ads_idx="2")
+    del partial["engagement"]["casual_score"]
+    output = io.StringIO()
+    assert write_results([complete, partial], output, "csv", include_source=True) == 2
+    rows = read_rows(output.getvalue(), EXTENDED_CSV_HEADERS)
+    assert rows[0]["engagement_casual_score"] == str(complete["engagement"]["casual_score"])
+    assert rows[1]["engagement_casual_score"] == "0"
+    for row, result in zip(rows, (complete, partial)):
+        for header in ("motivation_fun", "commerce_big_purchase_intent", "classification_source"):
+            assert row[header] == expected_row(result, EXTENDED_RESULT_SCHEMA)[header]
+
+
+def test_single_result_csv_with_missing_score():
+    result = full_result()
+    del result["brand"]["nostalgia"]
+    [row] = read_rows(convert_to_csv_format(result))
+    assert row["brand_nostalgia"] == "0"
+    assert row["brand_trust_in_official"] == str(result["brand"]["trust_in_official"])
+    assert "classification_source" not in row
+
+
+def test_compact_result_row_matches_dict_row():
+    result = full_result(classification_source="model", confidence="")
+    compact = ClassificationResult.from_dict(result)
+    assert compact.to_csv_row() == result_to_csv_row(result)
+    extended = compact.to_csv_row(include_source=True)
+    assert len(extended) == len(EXTENDED_CSV_HEADERS)
+    assert dict(zip(EXTENDED_CSV_HEADERS, extended))["classification_source"] == "model"
+
+
+def test_default_output_keeps_baseline_columns():
+    # 기존 json_total.csv 소비자를 위해 기본 스키마는 43열 그대로
+    assert len(CSV_HEADERS) == 43
+    assert EXTENDED_CSV_HEADERS == CSV_HEADERS + ["classification_source", "confidence"]
+    result = full_result(classification_source="rules", confidence=0.9)
+    output = io.StringIO()
+    assert write_results([result, ClassificationResult.from_dict(result)], output, "csv") == 2
+    rows = read_rows(output.getvalue())
+    assert rows[0] == rows[1] == expected_row(result)
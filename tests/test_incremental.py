@@ -0,0 +1,79 @@
+"""증분 재분류: 바뀐 광고만 다시 분류하고 매니페스트의 결과를 입력 순서대로 합쳐 씁니다."""
+import csv
+
+from bench.synthetic import synthetic_ads
+from bench.throughput import AD_COLUMNS
+from ive_classifier import core
+from ive_classifier.core import run_incremental_csv
+
+OPTIONS = dict(use_cache=False, dedupe=False, use_rules=False, use_near_duplicates=False, max_workers=4)
+
+
+def make_ads(count):
+    return [dict(ad, ads_name=f"{ad['ads_name']} #{i}") for i, ad in enumerate(synthetic_ads(count, seed=1))]
+
+
+def write_ads(path, ads):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=AD_COLUMNS)
+        writer.writeheader()
+        writer.writerows(ads)
+
+
+def read_output(path):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        return list(csv.DictReader(f))
+
+
+def run(gemini, tmp_path, ads):
+    write_ads(tmp_path / "ads.csv", ads)
+    gemini.reset_stats()
+    stats = run_incremental_csv(str(tmp_path / "ads.csv"), str(tmp_path / "json_total.csv"), "test-key", **OPTIONS)
+    return stats, gemini.stats()["generate_requests"], read_output(tmp_path / "json_total.csv")
+
+
+def test_only_changed_ads_are_reclassified_and_merged_in_order(gemini, tmp_path):
+    ads = make_ads(8)
+    stats, requests, rows = run(gemini, tmp_path, ads)
+    assert (stats["new"], stats["failed"], requests) == (8, 0, 8)
+    assert [row["ads_idx"] for row in rows] == [ad["ads_idx"] for ad in ads]
+
+    changed = dict(ads[2], ads_summary="요약이 바뀐 광고입니다.")
+    relabeled = dict(ads[5], ads_code="AD999999")
+    added = dict(ads[0], ads_idx="200000", ads_name="새 광고")
+    feed = [ads[0], ads[1], changed, ads[4], relabeled, ads[6], ads[7], added]  # ads[3] 삭제
+    stats, requests, rows = run(gemini, tmp_path, feed)
+    assert requests == 2
+    assert (stats["new"], stats["changed"], stats["unchanged"], stats["relabeled"], stats["removed"]) == (1, 1, 6, 1, 1)
+    assert [row["ads_idx"] for row in rows] == [ad["ads_idx"] for ad in feed]
+    assert rows[4]["ads_code"] == "AD999999"
+    assert len(read_output(tmp_path / "json_total.csv")[0]) == len(core.CSV_HEADERS)
+
+    stats, requests, _ = run(gemini, tmp_path, feed)
+    assert requests == 0 and stats["unchanged"] == len(feed)
+
+
+def test_classification_change_reclassifies_everything(gemini, tmp_path, monkeypatch):
+    ads = make_ads(5)
+    run(gemini, tmp_path, ads)
+
+    monkeypatch.setattr(core, "GEMINI_CASCADE_MODELS", ("gemini-2.5-flash-lite", core.GEMINI_MODEL))
+    stats, requests, rows = run(gemini, tmp_path, ads)
+    assert stats["changed"] == 5 and requests >= 5
+    assert [row["ads_idx"] for row in rows] == [ad["ads_idx"] for ad in ads]
+
+    stats, requests, _ = run(gemini, tmp_path, ads)
+    assert requests == 0 and stats["unchanged"] == 5
+
+
+def test_order_is_kept_with_grouped_and_packed_rows(gemini, tmp_path):
+    # 같은 ads_code의 변형은 대표 행의 결과를 나눠 받으므로 행마다 입력 순서가 따로 있어야 함
+    ads = make_ads(6)
+    ads += [dict(ad, ads_idx=str(300000 + i), ads_name=f"변형 {i}") for i, ad in enumerate(ads[:3])]
+    write_ads(tmp_path / "ads.csv", ads)
+    stats = run_incremental_csv(str(tmp_path / "ads.csv"), str(tmp_path / "json_total.csv"), "test-key",
+                                **dict(OPTIONS, dedupe=True, pack=True))
+    assert stats["failed"] == 0 and stats["deduplicated"] == 3
+    rows = read_output(tmp_path / "json_total.csv")
+    assert [row["ads_idx"] for row in rows] == [ad["ads_idx"] for ad in ads]
+    assert list(rows[0]) == core.CSV_HEADERS
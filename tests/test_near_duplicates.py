@@ -0,0 +1,72 @@
+"""유사 광고 인덱스: 비슷한 광고의 결과 재사용과 분류 설정이 바뀌었을 때의 무효화"""
+from ive_classifier.core import NEAR_DUP_MAX_DISTANCE, NearDuplicateIndex, ad_shingles, classification_fingerprint
+
+AD = {"ads_idx": "1", "ads_code": "AD1", "ads_name": "웹툰 정주행 이벤트",
+      "ads_summary": "웹툰 앱 설치 후 10화 감상 시 500포인트 지급, 2025-01-01까지"}
+NEAR = dict(AD, ads_idx="2", ads_summary="웹툰 앱 설치 후 10화 감상 시 700포인트 지급, 2025-02-01까지")
+RESULT = {"ad_type": "3", "motivation": {"fun": 0.8}}
+
+
+def test_lookup_reuses_near_duplicate(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path / "index.sqlite3"), fingerprint="v1")
+    index.add(AD, RESULT)
+    found = index.lookup(NEAR)
+    assert found is not None and found[0] == RESULT
+    index.close()
+
+
+def test_index_is_reset_when_classification_changes(tmp_path):
+    path = str(tmp_path / "index.sqlite3")
+    index = NearDuplicateIndex(path, fingerprint="v1")
+    index.add(AD, RESULT)
+    index.close()
+
+    same = NearDuplicateIndex(path, fingerprint="v1")
+    assert same.stats()["entries"] == 1
+    same.close()
+
+    changed = NearDuplicateIndex(path, fingerprint="v2")
+    assert changed.stats()["entries"] == 0
+    assert changed.lookup(AD) is None
+    changed.close()
+
+
+def test_fingerprint_covers_prompt_model_and_output_mode(monkeypatch):
+    from ive_classifier import core
+
+    base = classification_fingerprint("text")
+    assert classification_fingerprint("text") == base
+    assert classification_fingerprint("compact") != base
+    monkeypatch.setattr(core, "GEMINI_CASCADE_MODELS", ("gemini-lite", "gemini-pro"))
+    assert classification_fingerprint("text") != base
+    monkeypatch.setattr(core, "GEMINI_CASCADE_MODELS", ())
+    monkeypatch.setattr(core, "classification_instructions", lambda *args, **kwargs: "changed prompt")
+    assert classification_fingerprint("text") != base
+
+
+def jaccard_distance(a, b):
+    left, right = ad_shingles(a), ad_shingles(b)
+    return 1 - len(left & right) / len(left | right)
+
+
+def test_short_unrelated_ads_are_not_near_duplicates(tmp_path):
+    # 고정 라벨("광고명:", "요약:" 등)이 shingle에 들어가면 짧은 광고끼리는 내용이 달라도 거리가 0.2 아래로 내려감
+    webtoon = {"ads_idx": "1", "ads_code": "A", "ads_name": "웹툰"}
+    insurance = {"ads_idx": "2", "ads_code": "B", "ads_name": "보험"}
+    assert jaccard_distance(webtoon, insurance) > NEAR_DUP_MAX_DISTANCE
+    index = NearDuplicateIndex(str(tmp_path / "index.sqlite3"), fingerprint="v1")
+    index.add(webtoon, RESULT)
+    assert index.lookup(insurance) is None
+    index.close()
+
+
+def test_near_duplicates_are_off_by_default(gemini):
+    from ive_classifier import core
+
+    assert core.NEAR_DUP_ENABLED is False
+    options = dict(use_cache=False, use_rules=False)
+    core.classify_ad(AD, "test-key", use_near_duplicates=True, **options)
+    assert core.classify_ad(NEAR, "test-key", **options)["classification_source"] == "model"
+    reused = core.classify_ad(NEAR, "test-key", use_near_duplicates=True, **options)
+    assert reused["classification_source"] == "near_duplicate"
+    assert gemini.stats()["generate_requests"] == 2
@@ -0,0 +1,34 @@
+"""규칙 기반 빠른 분류는 기본으로 꺼져 있고, 켠 경우에만 Gemini 대신 규칙 결과를 사용합니다."""
+import json
+
+from bench.synthetic import synthetic_ads
+from ive_classifier import core
+from ive_classifier.__main__ import main
+
+OPTIONS = dict(use_cache=False, use_near_duplicates=False)
+
+
+def confident_ad():
+    return next(ad for ad in synthetic_ads(200) if core.confident_rule_result(ad, use_rules=True) is not None)
+
+
+def test_rule_fast_path_is_off_by_default(gemini):
+    assert core.RULE_FAST_PATH is False
+    ad = confident_ad()
+    assert core.classify_ad(ad, "test-key", **OPTIONS)["classification_source"] == "model"
+    assert gemini.stats()["generate_requests"] == 1
+
+
+def test_rule_fast_path_when_enabled(gemini):
+    ad = confident_ad()
+    assert core.classify_ad(ad, "test-key", use_rules=True, **OPTIONS)["classification_source"] == "rules"
+    assert gemini.stats()["generate_requests"] == 0
+
+
+def test_cli_rules_flag(gemini, tmp_path, capsys):
+    ad_file = tmp_path / "ad.json"
+    ad_file.write_text(json.dumps(confident_ad(), ensure_ascii=False), encoding="utf-8")
+    for flags, source in (([], "model"), (["--rules"], "rules")):
+        assert main(["classify", str(ad_file), "--compact", "--no-cache", "--no-near-duplicates",
+                     "--api-key", "test-key", *flags]) == 0
+        assert f'"classification_source": "{source}"' in capsys.readouterr().out
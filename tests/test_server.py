@@ -0,0 +1,53 @@
+"""HTTP 서비스: 잘못된 요청은 400, 예상하지 못한 오류는 500 JSON 본문으로 응답합니다."""
+import http.client
+import json
+from urllib.parse import urlsplit
+
+import pytest
+
+from ive_classifier.server import ClassificationService
+
+AD = {"ads_idx": "1", "ads_code": "AD1", "ads_name": "웹툰 정주행", "ads_summary": "앱 설치 후 10화 감상"}
+
+
+@pytest.fixture
+def service(gemini):
+    with ClassificationService(port=0, api_key="test-key") as service:
+        yield service
+
+
+def post(service, body=b"", headers=None, path="/classify?cache=0"):
+    url = urlsplit(service.base_url)
+    connection = http.client.HTTPConnection(url.hostname, url.port, timeout=10)
+    try:
+        connection.putrequest("POST", path)
+        for name, value in (headers or {"Content-Length": str(len(body))}).items():
+            connection.putheader(name, value)
+        connection.endheaders(body)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+
+def test_classify(service):
+    status, result = post(service, json.dumps(AD).encode("utf-8"))
+    assert status == 200 and result["ads_idx"] == "1"
+
+
+@pytest.mark.parametrize("length", ["abc", "-5", "1e3"])
+def test_invalid_content_length_is_rejected(service, length):
+    status, body = post(service, b"{}", {"Content-Length": length})
+    assert status == 400
+    assert body["error"]["code"] == 400
+
+
+def test_unexpected_error_returns_json_500(service, monkeypatch):
+    def broken(*args, **kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(service, "classify", broken)
+    status, body = post(service, json.dumps(AD).encode("utf-8"))
+    assert status == 500
+    assert body["error"]["code"] == 500 and "boom" not in body["error"]["message"]
+    assert service.stats()["requests"]["active"] == 0  # 처리 자리는 돌려받음
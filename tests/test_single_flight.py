@@ -0,0 +1,97 @@
+"""같은 광고를 동시에 분류하는 호출(스트리밍 포함)은 Gemini 요청 하나를 함께 씁니다."""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from ive_classifier.core import SingleFlight, classify_ad, classify_ad_stream
+
+AD = {"ads_idx": "1", "ads_code": "AD1", "ads_name": "판타지 RPG 신규 설치", "ads_summary": "레벨 10 달성 시 보상"}
+OPTIONS = dict(use_cache=False, use_rules=False, use_near_duplicates=False)
+
+
+def final(partials):
+    return list(partials)[-1]
+
+
+def test_concurrent_streams_share_one_request(gemini):
+    gemini.latency_ms = 300
+    ads = [dict(AD, ads_idx=str(i)) for i in range(4)]
+    with ThreadPoolExecutor(len(ads)) as pool:
+        results = list(pool.map(lambda ad: final(classify_ad_stream(ad, "test-key", **OPTIONS)), ads))
+    assert gemini.stats()["generate_requests"] == 1
+    assert [result["ads_idx"] for result in results] == [ad["ads_idx"] for ad in ads]
+    assert all(result["classification_source"] == "model" for result in results)
+
+
+def test_stream_and_classify_ad_share_one_request(gemini):
+    gemini.latency_ms = 300
+    with ThreadPoolExecutor(2) as pool:
+        streamed = pool.submit(lambda: final(classify_ad_stream(AD, "test-key", **OPTIONS)))
+        plain = pool.submit(classify_ad, dict(AD, ads_idx="2"), "test-key", **OPTIONS)
+        assert plain.result()["motivation"] == streamed.result()["motivation"]
+    assert gemini.stats()["generate_requests"] == 1
+
+
+def test_waiter_reruns_when_streaming_leader_stops_early():
+    flight = SingleFlight()
+
+    def leader_request():
+        yield "partial"
+        return "leader"
+
+    leader = flight.do_stream("key", leader_request)
+    assert next(leader) == "partial"
+
+    with ThreadPoolExecutor(1) as pool:
+        waiter = pool.submit(flight.do, "key", lambda: "rerun")
+        while flight.stats()["coalesced"] == 0:
+            time.sleep(0.01)
+        leader.close()  # 화면이 다시 그려지는 등으로 스트림을 끝까지 받지 않음
+        assert waiter.result(timeout=5) == "rerun"
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_stream_errors_are_shared():
+    flight = SingleFlight()
+
+    def failing():
+        yield "partial"
+        raise RuntimeError("boom")
+
+    stream = flight.do_stream("key", failing)
+    next(stream)
+    with ThreadPoolExecutor(1) as pool:
+        waiter = pool.submit(flight.do, "key", lambda: "unused")
+        while flight.stats()["coalesced"] == 0:
+            time.sleep(0.01)
+        with pytest.raises(RuntimeError):
+            next(stream)
+        with pytest.raises(RuntimeError):
+            waiter.result(timeout=5)
+
+
+def test_cancelled_async_leader_does_not_cancel_waiters():
+    import asyncio
+
+    flight = SingleFlight()
+    runs = []
+
+    async def request():
+        runs.append(len(runs))
+        await asyncio.sleep(0.2 if len(runs) == 1 else 0)
+        return f"run-{len(runs)}"
+
+    async def scenario():
+        leader = asyncio.ensure_future(flight.do_async("key", request))
+        await asyncio.sleep(0.01)
+        waiters = [asyncio.ensure_future(flight.do_async("key", request)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        waiters[0].cancel()  # 기다리던 작업 하나가 취소되어도 다른 호출에는 영향 없음
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await asyncio.gather(*waiters[1:])
+
+    assert asyncio.run(scenario()) == ["run-2", "run-2"]
+    assert len(runs) == 2 and flight.stats()["in_flight"] == 0
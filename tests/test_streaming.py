@@ -0,0 +1,34 @@
+"""스트리밍 응답 해석: 깨진 SSE 조각은 다른 응답 오류와 같은 GeminiResponseError로 알립니다."""
+import pytest
+
+from ive_classifier import core
+
+
+class FakeStream:
+    status_code = 200
+
+    def __init__(self, lines):
+        self.lines = lines
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def iter_lines(self, chunk_size=None):
+        return iter(self.lines)
+
+
+@pytest.mark.parametrize("line", [b'data: {"candidates": [{"content": {"parts": [{"text": "{\\"ad', b"data: [1, 2]",
+                                  b"data: \xff\xfe"])
+def test_malformed_sse_chunk_raises_response_error(monkeypatch, line):
+    monkeypatch.setattr(core, "_post_gemini", lambda *args, **kwargs: FakeStream([b": keep-alive", line]))
+    with pytest.raises(core.GeminiResponseError):
+        list(core.stream_gemini_json("prompt", "test-key"))
+
+
+def test_stream_yields_fields(gemini):
+    ad = {"ads_idx": "1", "ads_code": "AD1", "ads_name": "웹툰 정주행", "ads_summary": "앱 설치 후 10화 감상"}
+    fields = dict(core.stream_gemini_json(core.build_classification_prompt(ad), "test-key"))
+    assert "motivation" in fields and "target_age" in fields